@@ -0,0 +1,160 @@
+import logging
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from redis.asyncio import Redis
+from sqlalchemy import select, update
+from app.db.session import async_session_factory
+from app.db.models.order import Order, OrderStatus
+from app.redis import get_redis, node_for_key
+from app.schemas.bulk_restore_inventory_request import BulkRestoreInventoryRequest
+from app.schemas.eligibility_request import EligibilityRequest
+from app.exception import LotteryClosedException
+from app.services.eligibility import eligibility_service
+from app.services.inventory import inventory_service
+from app.services.lottery import lottery_service
+from app.services.order_retry import order_retry_service
+from app.services.redis_metrics import redis_metrics
+from app.workers import metrics_reporter
+router = APIRouter(
+    prefix="/admin"
+)
+logger = logging.getLogger(__name__)
+
+# keeps each IN (...) well under asyncpg's bind parameter limit
+ORDER_ID_CHUNK_SIZE = 5000
+CANCELLABLE_STATUSES = [OrderStatus.PENDING, OrderStatus.PAYMENT_IN_PROGRESS, OrderStatus.CONFIRMED]
+
+
+def _with_shard(report: dict):
+    # builds new dicts: the report may be metrics_reporter.last_report, shared between requests
+    return {
+        **report,
+        "hot_keys": [{**item, "node": node_for_key(item["key"])} for item in report.get("hot_keys", [])],
+    }
+
+
+@router.get("/redis/hot-keys")
+async def hot_keys():
+    """
+    Current hot inventory keys with the slot and node serving them, plus per-script latency.
+    Use it to decide which products need sharding or local caching.
+    """
+    return {
+        "current": _with_shard(redis_metrics.snapshot()),
+        "last_window": _with_shard(metrics_reporter.last_report),
+    }
+
+
+@router.get("/orders/dead-letters")
+async def dead_letters(redis: Redis = Depends(get_redis)):
+    """
+    Order events that ran out of retries, with the last error seen.
+    """
+    return await order_retry_service.dead_letters(redis)
+
+
+async def cancel_orders_and_restore(order_ids: list[str], items: list, redis: Redis) -> tuple[list[dict], list[dict]]:
+    """
+    Give back the stock of `items` and of the given orders, and mark those orders CANCELLED.
+    Returns the orders this call cancelled and the new stock levels.
+
+    Stock is restored in Redis while the order rows are locked, and the orders are only marked
+    CANCELLED after that succeeds. If Redis fails, the orders stay cancellable and a replay
+    restores them. Redis remembers every order it gave back, so a replay after a failed DB
+    commit never restores an order twice. Orders already CANCELLED, FAILED or EXPIRED are skipped.
+    """
+    if not order_ids:
+        return [], await inventory_service.bulk_restore_inventory(items, [], redis)
+    cancelled = []
+    async with async_session_factory() as db:
+        async with db.begin():
+            for start in range(0, len(order_ids), ORDER_ID_CHUNK_SIZE):
+                chunk = order_ids[start:start + ORDER_ID_CHUNK_SIZE]
+                # lock first so we know whether each order was already confirmed, and so the
+                # order worker can't move them on while their stock is being given back
+                result = await db.execute(
+                    select(Order.id, Order.order_id, Order.flash_sale_id, Order.product_id, Order.status)
+                    .where(Order.order_id.in_(chunk))
+                    .where(Order.status.in_(CANCELLABLE_STATUSES))
+                    .with_for_update()
+                )
+                cancelled += [{
+                    "id": row.id,
+                    "order_id": row.order_id,
+                    "flash_sale_id": row.flash_sale_id,
+                    "product_id": row.product_id,
+                    "was_confirmed": row.status == OrderStatus.CONFIRMED,
+                } for row in result.all()]
+            stock = await inventory_service.bulk_restore_inventory(items, cancelled, redis)
+            ids = [order["id"] for order in cancelled]
+            for start in range(0, len(ids), ORDER_ID_CHUNK_SIZE):
+                await db.execute(
+                    update(Order)
+                    .where(Order.id.in_(ids[start:start + ORDER_ID_CHUNK_SIZE]))
+                    .values(status=OrderStatus.CANCELLED)
+                )
+    return cancelled, stock
+
+
+@router.post("/inventory/restore")
+async def bulk_restore_inventory(data: BulkRestoreInventoryRequest, redis: Redis = Depends(get_redis)):
+    """
+    Restore stock for many products and/or cancelled orders in one call.
+    """
+    try:
+        cancelled_orders, stock = await cancel_orders_and_restore(data.order_ids, data.items, redis)
+        logger.info(f"Bulk restore: {len(data.items)} items, {len(cancelled_orders)}/{len(data.order_ids)} orders cancelled")
+        return {
+            "orders_cancelled": len(cancelled_orders),
+            "orders_skipped": len(data.order_ids) - len(cancelled_orders),
+            "stock": stock,
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/flash-sale/{flash_sale_id}/product/{product_id}/lottery/open")
+async def open_lottery(flash_sale_id: int, product_id: int, window_seconds: Optional[int] = None, redis: Redis = Depends(get_redis)):
+    """
+    Switch a product to lottery allocation and start its entry window.
+    """
+    try:
+        opened = await lottery_service.open_lottery(flash_sale_id, product_id, redis, window_seconds)
+        if not opened:
+            raise HTTPException(status_code=409, detail="Lottery already exists for this product")
+        return {"message": "Lottery opened"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/flash-sale/{flash_sale_id}/product/{product_id}/lottery/draw")
+async def draw_lottery(flash_sale_id: int, product_id: int, redis: Redis = Depends(get_redis)):
+    try:
+        return await lottery_service.draw_lottery(flash_sale_id, product_id, redis)
+    except LotteryClosedException as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.put("/flash-sale/{flash_sale_id}/eligibility")
+async def load_eligibility(flash_sale_id: int, data: EligibilityRequest, redis: Redis = Depends(get_redis)):
+    """
+    Open the sale's products only to the given users. Load before the sale starts;
+    for very large lists call eligibility_service.load_eligibility from a script instead.
+    """
+    try:
+        return await eligibility_service.load_eligibility(flash_sale_id, data.product_ids, data.user_ids, redis, data.false_positive_rate)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.delete("/flash-sale/{flash_sale_id}/eligibility")
+async def clear_eligibility(flash_sale_id: int, product_ids: List[int] = Query(...), redis: Redis = Depends(get_redis)):
+    try:
+        await eligibility_service.clear_eligibility(flash_sale_id, product_ids, redis)
+        return {"message": "Eligibility filter removed"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
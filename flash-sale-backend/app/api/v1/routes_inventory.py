@@ -1,7 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
 from redis.asyncio import Redis
 from app.services.inventory import inventory_service
-from app.exception import OutOfStockException, UserAlreadyPurchasedException
+from app.services.lottery import lottery_service
+from app.exception import OutOfStockException, UserAlreadyPurchasedException, LotteryAllocationException, LotteryClosedException, RateLimitedException, UserNotEligibleException
 from app.schemas.buy import BuyRequest
 from app.redis import get_redis
 router = APIRouter(
@@ -10,13 +12,43 @@ router = APIRouter(
 
 
 @router.post("/flash-sale/{flash_sale_id}/product/{product_id}/{user_id}/buy")
-async def buy(flash_sale_id: int, product_id: int, user_id: str, redis: Redis = Depends(get_redis)):
+async def buy(flash_sale_id: int, product_id: int, user_id: str, request: Request,
+              request_id: Optional[str] = Header(None, alias="X-Request-Id"),
+              redis: Redis = Depends(get_redis)):
     try:
-        data = BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id=user_id)
+        # behind a proxy, run uvicorn with --proxy-headers so this is the real client
+        client_ip = request.client.host if request.client else None
+        data = BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id=user_id, request_id=request_id, client_ip=client_ip)
         return await inventory_service.reserve_inventory(data, redis)
     except OutOfStockException as e:
         raise HTTPException(status_code=400, detail=str(e))
     except UserAlreadyPurchasedException as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except LotteryAllocationException as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except RateLimitedException as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except UserNotEligibleException as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/flash-sale/{flash_sale_id}/product/{product_id}/{user_id}/lottery")
+async def enter_lottery(flash_sale_id: int, product_id: int, user_id: str, redis: Redis = Depends(get_redis)):
+    try:
+        return await lottery_service.enter_lottery(flash_sale_id, product_id, user_id, redis)
+    except LotteryClosedException as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UserNotEligibleException as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/flash-sale/{flash_sale_id}/product/{product_id}/{user_id}/lottery")
+async def lottery_result(flash_sale_id: int, product_id: int, user_id: str, redis: Redis = Depends(get_redis)):
+    try:
+        return await lottery_service.lottery_result(flash_sale_id, product_id, user_id, redis)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -10,12 +10,18 @@ from app.db.session import async_session_factory
 from app.db.models.order import Order, OrderStatus
 from app.db.models.webhook_event import WebhookEvent
 from app.core.config import settings
+from app.redis import redis_client
+from app.services.inventory import inventory_service
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 # In production, this would come from environment/secrets
-WEBHOOK_SECRET = getattr(settings, 'WEBHOOK_SECRET', 'whsec_test_secret')
+WEBHOOK_SECRET = settings.WEBHOOK_SECRET
+
+# the order worker moves an order to PAYMENT_IN_PROGRESS before charging,
+# so the gateway's webhook usually finds it there
+SETTLEABLE_STATUSES = [OrderStatus.PENDING, OrderStatus.PAYMENT_IN_PROGRESS]
 
 
 def verify_signature(payload: bytes, signature: str, secret: str) -> bool:
@@ -113,20 +119,25 @@ async def handle_payment_success(order_id: str, event_id: str):
     """
     Handle successful payment - update order to CONFIRMED.
 
-    Idempotent: Only updates if status is PENDING.
+    Idempotent: Only updates if status is PENDING or PAYMENT_IN_PROGRESS.
     """
     async with async_session_factory() as db:
-        # Only update PENDING orders (guard against duplicate updates)
+        # Only update unsettled orders (guard against duplicate updates)
         result = await db.execute(
             update(Order)
             .where(Order.order_id == order_id)
-            .where(Order.status == OrderStatus.PENDING)
+            .where(Order.status.in_(SETTLEABLE_STATUSES))
             .values(status=OrderStatus.CONFIRMED)
+            .returning(Order.flash_sale_id, Order.product_id)
         )
+        confirmed = result.fetchone()
         await db.commit()
 
-        if result.rowcount > 0:
+        if confirmed is not None:
             logger.info(f"Order {order_id} confirmed via webhook {event_id}")
+            # Keep the unit sold: the hold sweeper must not return it
+            if not await inventory_service.confirm_hold(confirmed.flash_sale_id, confirmed.product_id, order_id, redis_client):
+                logger.warning(f"Order {order_id} confirmed after its hold expired")
         else:
             logger.info(
                 f"Order {order_id} not updated (already processed or not found)")
@@ -136,7 +147,7 @@ async def handle_payment_failure(order_id: str, event_id: str):
     """
     Handle failed payment - update order to FAILED and restore inventory.
 
-    Idempotent: Only updates if status is PENDING.
+    Idempotent: Only updates if status is PENDING or PAYMENT_IN_PROGRESS.
     """
     async with async_session_factory() as db:
         # Get order details before updating (need product_id for inventory restore)
@@ -150,34 +161,27 @@ async def handle_payment_failure(order_id: str, event_id: str):
                 f"Order {order_id} not found for webhook {event_id}")
             return
 
-        if order.status != OrderStatus.PENDING:
+        if order.status not in SETTLEABLE_STATUSES:
             logger.info(
                 f"Order {order_id} already in status {order.status}, skipping")
             return
 
         # Update status to FAILED
-        await db.execute(
+        result = await db.execute(
             update(Order)
             .where(Order.order_id == order_id)
-            .where(Order.status == OrderStatus.PENDING)
+            .where(Order.status.in_(SETTLEABLE_STATUSES))
             .values(status=OrderStatus.FAILED)
+            .returning(Order.order_id)
         )
+        failed = result.fetchone()
         await db.commit()
+        if failed is None:
+            # the order worker settled it between our read and update
+            return
 
         logger.info(f"Order {order_id} marked FAILED via webhook {event_id}")
 
-        # Restore inventory in Redis
-        await restore_inventory(order.flash_sale_id, order.product_id)
-
-
-async def restore_inventory(flash_sale_id: int, product_id: int):
-    """
-    Restore inventory to Redis after failed/expired order.
-    """
-    from app.redis import redis_client
-
-    prefix_tag = f"flashsale:{{{flash_sale_id}:{product_id}}}"
-    inventory_key = f"{prefix_tag}:stock"
-
-    await redis_client.incr(inventory_key)
-    logger.info(f"Restored 1 unit to {inventory_key}")
+        # Restore inventory in Redis (no-op if the hold sweeper already did)
+        if await inventory_service.release_hold(order.flash_sale_id, order.product_id, order_id, redis_client):
+            logger.info(f"Restored 1 unit for order {order_id}")
@@ -1,4 +1,5 @@
 import asyncio
+import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.core.config import settings
@@ -8,8 +9,20 @@ from app.db.models.flash_sale import FlashSale
 import app.db.models.flash_sale_product
 import app.db.models.order
 import app.db.models.webhook_event
-from app.api.v1 import routes_inventory, routes_webhook
+import app.db.models.inventory_event
+from app.api.v1 import routes_admin, routes_inventory, routes_webhook
 from app.workers.order_worker import order_worker
+from app.workers.hold_sweeper import hold_sweeper
+from app.workers.metrics_reporter import metrics_reporter
+from app.workers.retry_pump import retry_pump
+from app.workers.inventory_event_consumer import inventory_event_consumer
+from app.workers.stock_flusher import stock_flusher
+from app.workers.stock_lease_keeper import stock_lease_keeper
+from app.redis import redis_client
+from app.services.stock_sync import stock_sync_service
+from app.services.inventory import stock_leases
+
+logger = logging.getLogger(__name__)
 
 
 @asynccontextmanager
@@ -19,7 +32,24 @@ async def lifespan(app: FastAPI):
         await session.preload_inventory()
 
     asyncio.create_task(order_worker())
+    asyncio.create_task(hold_sweeper())
+    asyncio.create_task(metrics_reporter())
+    asyncio.create_task(retry_pump())
+    asyncio.create_task(inventory_event_consumer())
+    asyncio.create_task(stock_flusher())
+    if settings.STOCK_LEASE_ENABLED:
+        asyncio.create_task(stock_lease_keeper())
     yield
+    # unsold leased units go back before the counters are persisted
+    try:
+        await stock_leases.return_idle(redis_client, return_all=True)
+    except Exception as ex:
+        logger.error(f"Returning stock leases failed: {ex}", exc_info=True)
+    # last write-behind pass, so a clean shutdown leaves Postgres current
+    try:
+        await stock_sync_service.flush(redis_client)
+    except Exception as ex:
+        logger.error(f"Final stock flush failed: {ex}", exc_info=True)
 
 
 def create_app():
@@ -35,6 +65,12 @@ def create_app():
         prefix="/api/v1"
     )
 
+    app.include_router(
+        routes_admin.router,
+        prefix="/api/v1",
+        tags=["admin"]
+    )
+
     app.include_router(
         routes_webhook.router,
         prefix="/api/v1/webhooks",
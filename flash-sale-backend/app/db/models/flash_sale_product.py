@@ -1,4 +1,5 @@
-from sqlalchemy import BigInteger, ForeignKey, Integer
+from datetime import datetime
+from sqlalchemy import BigInteger, DateTime, ForeignKey, Integer
 from sqlalchemy.orm import Mapped, mapped_column
 from app.db.models import TimestampMixin
 from app.db.base import Base
@@ -6,4 +7,7 @@ class FlashSaleProduct(Base, TimestampMixin):
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, index=True)
     flash_sale_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("flashsale.id", ondelete="CASCADE"), nullable=False)
     product_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("product.id", ondelete="CASCADE"), nullable=False)
-    total_stock: Mapped[int] = mapped_column(Integer, nullable=False)
\ No newline at end of file
+    total_stock: Mapped[int] = mapped_column(Integer, nullable=False)
+    # write-behind copy of the Redis stock counter, see app/services/stock_sync.py
+    remaining_stock: Mapped[int] = mapped_column(Integer, nullable=True)
+    stock_synced_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
\ No newline at end of file
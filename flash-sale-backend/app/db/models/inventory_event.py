@@ -0,0 +1,25 @@
+from datetime import datetime
+from sqlalchemy import BigInteger, DateTime, Index, String, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column
+from app.db.base import Base
+
+
+class InventoryEvent(Base):
+    """
+    Reservation and restore events copied out of the per-product Redis streams,
+    so sell-through and hold-to-confirm latency can be queried without touching orders.
+    (flash_sale_id, product_id, stream_id) makes re-delivered stream entries a no-op.
+    """
+    __table_args__ = (
+        UniqueConstraint("flash_sale_id", "product_id", "stream_id"),
+        Index("ix_inventoryevent_sale_occurred_at", "flash_sale_id", "occurred_at"),
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    flash_sale_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    product_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    stream_id: Mapped[str] = mapped_column(String(32), nullable=False)
+    outcome: Mapped[str] = mapped_column(String(20), nullable=False)
+    user_hash: Mapped[str] = mapped_column(String(16), nullable=True)
+    order_id: Mapped[str] = mapped_column(String(255), nullable=True)
+    occurred_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
@@ -10,6 +10,7 @@ class OrderStatus(str, Enum):
     PAYMENT_IN_PROGRESS = "PAYMENT_IN_PROGRESS"
     CONFIRMED = "CONFIRMED"
     EXPIRED = "EXPIRED"
+    CANCELLED = "CANCELLED"
     FAILED = "FAILED"
 
 
@@ -3,6 +3,7 @@ from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from app.core.config import settings
 from app.db.base import Base
 from app.redis import redis_client
+from app.services.inventory import inventory_service, prefix_tag_for
 
 engine = create_async_engine(
     url=settings.DATABASE_URL,
@@ -33,14 +34,32 @@ async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
         print("created al tables")
+    # create_all leaves an existing orderstatus enum alone; ADD VALUE can't share a transaction
+    # with statements using the new value, so it runs on its own
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("ALTER TYPE orderstatus ADD VALUE IF NOT EXISTS 'CANCELLED'"))
 
 async def preload_inventory():
-    keys = await redis_client.keys("flashsale:*:stock")
-    if keys:
-        await redis_client.delete(*keys)
+    # Safe during a live sale: products already in Redis keep their live count, and units sold
+    # while the reload runs are carried across the atomic switch (see
+    # InventoryService.load_stock_generation). Products missing from Redis start from the last
+    # synced remaining_stock, or total_stock if the flusher never wrote one.
     session = async_session_factory()
     async with session.begin():
-       result =  await session.execute(text("SELECT * FROM flashsaleproduct"))      
-       for row in result:
-           await redis_client.set(f"flashsale:{{{row.flash_sale_id}:{row.product_id}}}:stock", row.total_stock) 
+       result =  await session.execute(text("SELECT * FROM flashsaleproduct"))
+       stock_levels = [(row.flash_sale_id, row.product_id,
+                        row.total_stock if row.remaining_stock is None else row.remaining_stock) for row in result]
+    await inventory_service.load_stock_generation(stock_levels, redis_client, keep_live=True)
 
+    # products no longer on sale lose their stock; unlink is single-key, so in cluster
+    # mode the pipeline is split per node and every node's batch runs in parallel
+    loaded = {prefix_tag_for(flash_sale_id, product_id) for flash_sale_id, product_id, _ in stock_levels}
+    pipe = redis_client.pipeline(transaction=False)
+    async for key in redis_client.scan_iter(match="flashsale:*:stock*"):
+        if isinstance(key, bytes):
+            key = key.decode()
+        prefix_tag = key.split(":stock")[0]
+        if prefix_tag not in loaded:
+            pipe.unlink(key, f"{prefix_tag}:gen")
+    await pipe.execute()
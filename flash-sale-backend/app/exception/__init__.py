@@ -1,4 +1,8 @@
 from .out_of_stock_exception import OutOfStockException
 from .user_already_purchased_exception import UserAlreadyPurchasedException
+from .lottery_allocation_exception import LotteryAllocationException
+from .lottery_closed_exception import LotteryClosedException
+from .rate_limited_exception import RateLimitedException
+from .user_not_eligible_exception import UserNotEligibleException
 
-__all__ = ["OutOfStockException", "UserAlreadyPurchasedException"]
\ No newline at end of file
+__all__ = ["OutOfStockException", "UserAlreadyPurchasedException", "LotteryAllocationException", "LotteryClosedException", "RateLimitedException", "UserNotEligibleException"]
\ No newline at end of file
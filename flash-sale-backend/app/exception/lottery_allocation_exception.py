@@ -0,0 +1,7 @@
+class LotteryAllocationException(Exception):
+    message = "Product is allocated by lottery"
+    def __init__(self, message: str = message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
@@ -0,0 +1,7 @@
+class LotteryClosedException(Exception):
+    message = "Lottery entry window is closed"
+    def __init__(self, message: str = message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
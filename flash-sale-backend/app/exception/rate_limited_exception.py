@@ -0,0 +1,7 @@
+class RateLimitedException(Exception):
+    message = "Too many requests"
+    def __init__(self, message: str = message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
@@ -0,0 +1,7 @@
+class UserNotEligibleException(Exception):
+    message = "User is not eligible for this sale"
+    def __init__(self, message: str = message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
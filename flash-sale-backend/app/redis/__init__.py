@@ -1,10 +1,19 @@
-from typing import AsyncGenerator
-from redis.asyncio import Redis
+from collections import defaultdict
+from typing import AsyncGenerator, Callable, Iterable, TypeVar
+from redis.asyncio import Redis, RedisCluster
+from redis.crc import key_slot
 from app.core.config import settings
 from redis.asyncio.connection import ConnectionPool
 
-redis_pool = ConnectionPool.from_url(settings.REDIS_URL)
-redis_client = Redis(connection_pool=redis_pool)
+T = TypeVar("T")
+
+if settings.REDIS_CLUSTER_MODE:
+    # the cluster client discovers the other nodes from the seed URL and keeps a pool per node
+    redis_pool = None
+    redis_client = RedisCluster.from_url(settings.REDIS_URL)
+else:
+    redis_pool = ConnectionPool.from_url(settings.REDIS_URL)
+    redis_client = Redis(connection_pool=redis_pool)
 
 async def get_redis() -> AsyncGenerator[Redis, None]:
     """
@@ -13,7 +22,29 @@ async def get_redis() -> AsyncGenerator[Redis, None]:
     """
     yield redis_client
 
+def group_by_slot(items: Iterable[T], key_fn: Callable[[T], str]) -> dict[int, list[T]]:
+    """
+    Group items by the hash slot of their key, so each group can go to its shard
+    as one pipelined or Lua call.
+    """
+    groups = defaultdict(list)
+    for item in items:
+        groups[key_slot(key_fn(item).encode())].append(item)
+    return groups
+
+def node_for_key(key: str) -> str:
+    """
+    Redis node serving `key`, as host:port.
+    """
+    if settings.REDIS_CLUSTER_MODE:
+        node = redis_client.get_node_from_key(key)
+        # the slot map is loaded lazily by the first command
+        return node.name if node is not None else "unknown"
+    kwargs = redis_pool.connection_kwargs
+    return f"{kwargs.get('host', 'localhost')}:{kwargs.get('port', 6379)}"
+
 async def close_redis():
     """Close Redis connections on app shutdown."""
-    await redis_client.close()
-    await redis_pool.disconnect()
\ No newline at end of file
+    await redis_client.aclose()
+    if redis_pool is not None:
+        await redis_pool.disconnect()
@@ -0,0 +1,8 @@
+from typing import List
+from pydantic import BaseModel, Field
+from app.schemas.restore_inventory_request import RestoreInventoryRequest
+class BulkRestoreInventoryRequest(BaseModel):
+    # explicit quantities to give back, e.g. after a partner returns stock
+    items: List[RestoreInventoryRequest] = Field(default_factory=list)
+    # orders cancelled by a partner; each one gives back the unit it reserved
+    order_ids: List[str] = Field(default_factory=list)
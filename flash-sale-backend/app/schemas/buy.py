@@ -1,5 +1,10 @@
+from typing import Optional
 from pydantic import BaseModel
 class BuyRequest(BaseModel):
     product_id: int
     user_id: str
-    flash_sale_id: int
\ No newline at end of file
+    flash_sale_id: int
+    # client generated id, re-sent unchanged when the client retries the same buy
+    request_id: Optional[str] = None
+    # caller's address, used for rate limiting
+    client_ip: Optional[str] = None
@@ -0,0 +1,8 @@
+from typing import List, Optional
+from pydantic import BaseModel
+class EligibilityRequest(BaseModel):
+    # products of the sale the list applies to
+    product_ids: List[int]
+    # users allowed to buy; everyone else is refused
+    user_ids: List[str]
+    false_positive_rate: Optional[float] = None
@@ -0,0 +1,91 @@
+"""
+Memory and lookup cost of the pre-sale eligibility filter.
+
+    python -m app.scripts.benchmark_eligibility --users 10000000 --lookups 20000
+
+Builds a filter for --users synthetic ids, loads it onto one benchmark product and
+reports its size in Redis. It then calls the real reservation script with stock at 0:
+eligible users get past the filter and stop at "sold out", unknown users stop at the
+filter. So the same run gives the lookup latency and the measured false-positive rate.
+Only the benchmark sale's keys are written; they are deleted at the end.
+"""
+import argparse
+import asyncio
+import time
+from collections.abc import Sequence
+from redis.asyncio import Redis
+from app.core.config import settings
+from app.exception import OutOfStockException, UserNotEligibleException
+from app.schemas.buy import BuyRequest
+from app.services.eligibility import eligibility_service
+from app.services.inventory import inventory_service, prefix_tag_for
+
+FLASH_SALE_ID = 999_999
+PRODUCT_ID = 1
+
+
+class SyntheticUsers(Sequence):
+    """user_0 .. user_{n-1} without holding millions of strings in memory."""
+
+    def __init__(self, count: int):
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return f"user_{index}"
+
+
+def percentile(samples: list[float], q: float) -> float:
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * q))]
+
+
+async def time_lookups(user_ids: list[str], redis: Redis) -> tuple[list[float], int]:
+    latencies, passed = [], 0
+    for user_id in user_ids:
+        started = time.perf_counter()
+        try:
+            await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=FLASH_SALE_ID, product_id=PRODUCT_ID, user_id=user_id), redis)
+        except OutOfStockException:
+            passed += 1
+        except UserNotEligibleException:
+            pass
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies, passed
+
+
+async def main(users: int, lookups: int, false_positive_rate: float):
+    redis = Redis.from_url(settings.REDIS_URL)
+    prefix_tag = prefix_tag_for(FLASH_SALE_ID, PRODUCT_ID)
+    try:
+        await redis.set(f"{prefix_tag}:stock", 0)
+        started = time.perf_counter()
+        sizing = await eligibility_service.load_eligibility(
+            FLASH_SALE_ID, [PRODUCT_ID], SyntheticUsers(users), redis, false_positive_rate)
+        print(f"build + load: {time.perf_counter() - started:.1f}s, {sizing}")
+        # a Redis string's overhead is a few dozen bytes, the bitmap is the whole cost
+        memory = await redis.strlen(f"{prefix_tag}:eligible")
+        print(f"redis memory per product: {memory / 1024 / 1024:.1f} MiB ({memory * 8 / users:.2f} bits/user)")
+
+        latencies, passed = await time_lookups([f"user_{i}" for i in range(0, users, max(1, users // lookups))][:lookups], redis)
+        print(f"eligible lookups:   p50 {percentile(latencies, 0.5):.3f}ms  p99 {percentile(latencies, 0.99):.3f}ms  passed {passed}/{len(latencies)}")
+        latencies, passed = await time_lookups([f"stranger_{i}" for i in range(lookups)], redis)
+        print(f"ineligible lookups: p50 {percentile(latencies, 0.5):.3f}ms  p99 {percentile(latencies, 0.99):.3f}ms  "
+              f"false positives {passed}/{len(latencies)} ({passed / len(latencies):.4%})")
+    finally:
+        keys = [key async for key in redis.scan_iter(match=f"{prefix_tag}:*")]
+        if keys:
+            await redis.delete(*keys)
+        await redis.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10_000_000)
+    parser.add_argument("--lookups", type=int, default=20_000)
+    parser.add_argument("--fp-rate", type=float, default=settings.ELIGIBILITY_FALSE_POSITIVE_RATE)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.lookups, args.fp_rate))
@@ -0,0 +1,58 @@
+import math
+from typing import Iterable, Sequence
+from redis.asyncio import Redis
+from app.core.config import settings
+from app.services.inventory import eligibility_hashes, prefix_tag_for
+
+# Pre-sale eligibility: a Bloom filter of the qualified user ids, checked first by the
+# reservation and lottery entry scripts. The filter is built once per sale and copied to
+# every product of the sale, so each script still only touches its own slot.
+# False positives let a few unqualified users through; qualified users are never refused.
+
+
+def bloom_parameters(expected_users: int, false_positive_rate: float) -> tuple[int, int]:
+    """Bit count m (a whole number of bytes) and hash count k for the target false-positive rate."""
+    expected_users = max(expected_users, 1)
+    m = math.ceil(-expected_users * math.log(false_positive_rate) / math.log(2) ** 2)
+    m = (m + 7) // 8 * 8
+    k = max(1, round(m / expected_users * math.log(2)))
+    return m, k
+
+
+def build_bloom_filter(user_ids: Iterable[str], m: int, k: int) -> bytes:
+    # bit offsets follow GETBIT: offset 0 is the most significant bit of the first byte
+    bits = bytearray(m // 8)
+    for user_id in user_ids:
+        h1, h2 = eligibility_hashes(user_id)
+        for i in range(k):
+            position = (h1 + i * h2) % m
+            bits[position >> 3] |= 0x80 >> (position & 7)
+    return bytes(bits)
+
+
+class EligibilityService:
+    async def load_eligibility(self, flash_sale_id: int, product_ids: list[int], user_ids: Sequence[str], redis: Redis,
+                               false_positive_rate: float = None) -> dict:
+        """
+        Restrict the sale's products to `user_ids`, replacing any previous list.
+        Each product gets its filter and sizing in one MULTI, so a buyer never sees a half-loaded filter.
+        """
+        m, k = bloom_parameters(len(user_ids), false_positive_rate or settings.ELIGIBILITY_FALSE_POSITIVE_RATE)
+        bloom = build_bloom_filter(user_ids, m, k)
+        for product_id in product_ids:
+            prefix_tag = prefix_tag_for(flash_sale_id, product_id)
+            pipe = redis.pipeline(transaction=True)
+            pipe.set(f"{prefix_tag}:eligible", bloom)
+            pipe.delete(f"{prefix_tag}:eligible:meta")
+            pipe.hset(f"{prefix_tag}:eligible:meta", mapping={"m": m, "k": k})
+            await pipe.execute()
+        return {"users": len(user_ids), "bits": m, "hashes": k, "bytes_per_product": len(bloom)}
+
+    async def clear_eligibility(self, flash_sale_id: int, product_ids: list[int], redis: Redis):
+        """Open the sale's products to everyone again."""
+        for product_id in product_ids:
+            prefix_tag = prefix_tag_for(flash_sale_id, product_id)
+            await redis.delete(f"{prefix_tag}:eligible:meta", f"{prefix_tag}:eligible")
+
+
+eligibility_service = EligibilityService()
@@ -1,55 +1,717 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import socket
+import time
+from collections import defaultdict
 from app.schemas.buy import BuyRequest
 from redis.asyncio import Redis
-from app.exception import OutOfStockException, UserAlreadyPurchasedException
+from app.core.config import settings
+from app.exception import OutOfStockException, UserAlreadyPurchasedException, LotteryAllocationException, RateLimitedException, UserNotEligibleException
 from app.db.models.order import Order, OrderStatus
 from uuid import uuid4
+from app.redis import group_by_slot
 from app.services.order_queue import order_queue
 from app.schemas.restore_inventory_request import RestoreInventoryRequest
+from app.services.redis_metrics import redis_metrics
+from app.services.rate_limiter import local_rate_limiter
+
+logger = logging.getLogger(__name__)
 
 # Redis Hash Tags: {tag} ensures all keys with same tag go to same shard in Redis Cluster
 # This is required for Lua scripts to work in cluster mode (avoids CROSSSLOT errors)
-# Key pattern: flashsale:{sale_id}:product:{product_id}:stock
-# Note: Redis uses FIRST {..} for sharding, so all products in same sale go to same shard
-LUA_SCRIPT_INVENTORY_CHECK_AND_DECREMENT = """
--- KEYS[1] = flash_sale_id
--- KEYS[2] = product_id
--- KEYS[3] = user_id
+# Key pattern: flashsale:{sale_id:product_id}:stock
+# Every per-product script takes the hash-tagged prefix as KEYS[1]: the cluster client routes
+# the call by it, and all keys the script builds from it live in the same slot.
+
+# Shared by every script that touches stock: the counter lives in a generation,
+# flashsale:{sale_id:product_id}:stock:<gen>, picked by the :gen pointer. A reload builds the
+# next generation beside the live one and flips the pointer (LUA_SCRIPT_SWITCH_STOCK_GENERATION).
+# Products never loaded that way keep the plain :stock key.
+LUA_RESOLVE_STOCK_KEY = """
+local function stock_key_for(prefix_tag)
+  local generation = redis.call('GET', prefix_tag .. ":gen")
+  if generation then
+    return prefix_tag .. ":stock:" .. generation
+  end
+  return prefix_tag .. ":stock"
+end
+"""
+
+# Shared by the scripts below: append a compact event to the product's capped analytics
+# stream, flashsale:{sale_id:product_id}:events. The stream lives in the product's slot;
+# sale and product are read back from the key and the entry id carries the timestamp.
+# Only buy attempts carry the user hash; later events for an order link back by order id.
+LUA_EMIT_INVENTORY_EVENT = """
+local function emit_event(prefix_tag, maxlen, outcome, user_hash, order_id)
+  local fields = {'o', outcome}
+  if user_hash then
+    table.insert(fields, 'u')
+    table.insert(fields, user_hash)
+  end
+  if order_id then
+    table.insert(fields, 'r')
+    table.insert(fields, order_id)
+  end
+  redis.call('XADD', prefix_tag .. ":events", 'MAXLEN', '~', maxlen, '*', unpack(fields))
+end
+"""
+
+# Shared by the buy paths: sales open only to pre-qualified users carry a Bloom filter
+# of their ids at flashsale:{sale_id:product_id}:eligible, sized by :eligible:meta {m, k}.
+# The caller hashes the user id (eligibility_hashes); bit i is (h1 + i * h2) mod m.
+# Products without a filter are open to everyone.
+LUA_CHECK_ELIGIBILITY = """
+local function is_eligible(prefix_tag, h1, h2)
+  local meta = redis.call('HMGET', prefix_tag .. ":eligible:meta", 'm', 'k')
+  if not meta[1] then
+    return true
+  end
+  local m, k = tonumber(meta[1]), tonumber(meta[2])
+  for i = 0, k - 1 do
+    if redis.call('GETBIT', prefix_tag .. ":eligible", (h1 + i * h2) % m) == 0 then
+      return false
+    end
+  end
+  return true
+end
+"""
+
+# GCRA: one key per client holding its theoretical arrival time (ms). The keys are global
+# (ratelimit:{ip:<ip>}, ratelimit:{user:<user_id>}), not per product, so a bot gets one budget
+# across every product. Each key is its own slot, so ReservationBatcher checks them in a
+# pipeline before the reservation script and passes the verdict along.
+LUA_SCRIPT_GCRA = """
+-- KEYS[1] = rate limit key
+-- ARGV[1] = emission interval (ms), ARGV[2] = burst
+-- Returns 1 if the request is allowed, 0 if the client is over its limit
+
+local clock = redis.call('TIME')
+local now_ms = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local interval_ms = tonumber(ARGV[1])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now_ms)
+if tat < now_ms then
+  tat = now_ms
+end
+local new_tat = tat + interval_ms
+if new_tat - now_ms > interval_ms * tonumber(ARGV[2]) then
+  return 0
+end
+redis.call('SET', KEYS[1], new_tat, 'PX', math.ceil(new_tat - now_ms))
+return 1
+"""
+
+LUA_SCRIPT_INVENTORY_CHECK_AND_DECREMENT = LUA_RESOLVE_STOCK_KEY + LUA_EMIT_INVENTORY_EVENT + LUA_CHECK_ELIGIBILITY + """
+-- Reserves for a batch of buyers of one product, in arrival order (see ReservationBatcher).
+-- KEYS[1] = prefix tag, flashsale:{sale_id:product_id}
 -- ARGV[1] = ttl (seconds)
+-- ARGV[2] = event stream max length
+-- ARGV[3] = instance whose stock lease "L" buyers are sold from ("" when leases are off)
+-- then 8 values per buyer:
+--   order_id generated for this attempt, client request id ("" when none), user_id,
+--   user hash for the event stream, the two eligibility hashes of the user,
+--   "L" if the instance took the unit from its lease or "C" to take it from the counter,
+--   and "1" if the buyer is over its global rate limit (LUA_SCRIPT_GCRA, run just before)
+-- Returns {status_1, order_id_1, status_2, order_id_2, ...}, order_id "" unless reserved or replayed
+
+local prefix_tag = KEYS[1]
+local ttl = ARGV[1]
+local maxlen = ARGV[2]
+local inventory_key = stock_key_for(prefix_tag)
+local holds_key = prefix_tag .. ":holds"
+local hold_users_key = prefix_tag .. ":holds:users"
+
+local clock = redis.call('TIME')
+-- only an undrawn lottery holds the product back; after the draw, returned units sell FCFS
+local lottery = redis.call('HGET', prefix_tag .. ":lottery", 'status') == 'open'
+local stock = tonumber(redis.call('GET', inventory_key) or "0")
+-- :leases is the fence for leased units: once the lease keeper reclaims a lease, none of it sells
+local leases_key = prefix_tag .. ":leases"
+local lease = 0
+if ARGV[3] ~= "" then
+  lease = tonumber(redis.call('HGET', leases_key, ARGV[3]) or "0")
+end
+local lease_used = 0
+
+local function reserve(order_id, request_id, user_id, user_hash, h1, h2, source, throttled)
+  local user_lock_key = prefix_tag .. ":user:" .. user_id
+  local request_key = prefix_tag .. ":request:" .. user_id .. ":" .. request_id
+
+  -- 0. Retry of a request we already reserved: hand back the original order_id.
+  --    Checked first, so a client retrying quickly isn't rate limited out of its own order
+  if request_id ~= "" then
+    local previous_order_id = redis.call('GET', request_key)
+    if previous_order_id then
+      return 2, previous_order_id  -- Replayed
+    end
+  end
+
+  -- E. Reject users the sale is not open to before any other work
+  if not is_eligible(prefix_tag, tonumber(h1), tonumber(h2)) then
+    return -5, ""
+  end
+
+  -- R. Turn away abusive clients before doing any inventory work
+  if throttled == "1" then
+    return -4, ""
+  end
+
+  -- 1. Lottery products are only allocated by the draw while the lottery is open
+  if lottery then
+    return -3, ""
+  end
+
+  -- 2. Prevent double buying, also within this batch
+  if redis.call('EXISTS', user_lock_key) == 1 then
+    emit_event(prefix_tag, maxlen, 'duplicate', user_hash)
+    return -2, ""  -- User already purchased
+  end
+
+  -- 3. Stock is read once per batch and counted down here, so the batch never oversells.
+  --    Leased units already left the counter when the lease was claimed
+  if source == "L" then
+    if lease <= 0 then
+      return -6, ""  -- Lease reclaimed, the instance sells this buyer from the counter instead
+    end
+    lease = lease - 1
+    lease_used = lease_used + 1
+  else
+    if stock <= 0 then
+      emit_event(prefix_tag, maxlen, 'sold_out', user_hash)
+      return -1, ""  -- Out of stock
+    end
+    stock = stock - 1
+  end
+
+  -- 4. Lock user to prevent duplicate purchases
+  redis.call('SET', user_lock_key, "1", "EX", ttl)
+
+  -- 5. Remember which order this request produced, so retries get the same answer
+  if request_id ~= "" then
+    redis.call('SET', request_key, order_id, "EX", ttl)
+  end
+
+  -- 6. Record the hold, scored by expiry, so the sweeper can give the unit back
+  --    if the order never gets confirmed
+  redis.call('ZADD', holds_key, tonumber(clock[1]) + tonumber(ttl), order_id)
+  redis.call('HSET', hold_users_key, order_id, user_id)
+
+  emit_event(prefix_tag, maxlen, 'reserved', user_hash, order_id)
+  return 1, order_id  -- Success
+end
+
+local results = {}
+local reserved = 0
+for i = 4, #ARGV, 8 do
+  local status, order_id = reserve(ARGV[i], ARGV[i + 1], ARGV[i + 2], ARGV[i + 3], ARGV[i + 4], ARGV[i + 5], ARGV[i + 6], ARGV[i + 7])
+  if status == 1 then
+    reserved = reserved + 1
+  end
+  table.insert(results, status)
+  table.insert(results, order_id)
+end
+
+-- one write to the hot counter for the whole batch, none if the lease covered it
+if reserved > lease_used then
+  redis.call('DECRBY', inventory_key, reserved - lease_used)
+end
+if lease_used > 0 then
+  redis.call('HINCRBY', leases_key, ARGV[3], -lease_used)
+end
+return results
+"""
+
+LUA_SCRIPT_RELEASE_HOLD = LUA_RESOLVE_STOCK_KEY + LUA_EMIT_INVENTORY_EVENT + """
+-- KEYS[1] = prefix tag, flashsale:{sale_id:product_id}
+-- ARGV[1] = order_id
+-- ARGV[2] = event stream max length
+
+local prefix_tag = KEYS[1]
+local holds_key = prefix_tag .. ":holds"
+local hold_users_key = prefix_tag .. ":holds:users"
+
+-- ZREM decides who owns the hold, so the sweeper and a payment failure never both restore it
+if redis.call('ZREM', holds_key, ARGV[1]) == 0 then
+  return 0  -- Already swept, released or confirmed
+end
+
+local user_id = redis.call('HGET', hold_users_key, ARGV[1])
+redis.call('HDEL', hold_users_key, ARGV[1])
+redis.call('INCR', stock_key_for(prefix_tag))
+if user_id then
+  redis.call('DEL', prefix_tag .. ":user:" .. user_id)
+end
+emit_event(prefix_tag, ARGV[2], 'released', nil, ARGV[1])
+return 1
+"""
+
+
+LUA_SCRIPT_SWEEP_EXPIRED_HOLDS = LUA_RESOLVE_STOCK_KEY + LUA_EMIT_INVENTORY_EVENT + """
+-- KEYS[1] = prefix tag, flashsale:{sale_id:product_id}
+-- ARGV[1] = max holds to release in this call
+-- ARGV[2] = event stream max length
+
+local prefix_tag = KEYS[1]
+local inventory_key = stock_key_for(prefix_tag)
+local holds_key = prefix_tag .. ":holds"
+local hold_users_key = prefix_tag .. ":holds:users"
+
+-- Confirmed orders have already been removed from the holds set, so whatever
+-- is still here past its expiry never reached payment
+local now = redis.call('TIME')
+local expired = redis.call('ZRANGEBYSCORE', holds_key, '-inf', now[1], 'LIMIT', 0, tonumber(ARGV[1]))
+for _, order_id in ipairs(expired) do
+  local user_id = redis.call('HGET', hold_users_key, order_id)
+  redis.call('ZREM', holds_key, order_id)
+  redis.call('HDEL', hold_users_key, order_id)
+  redis.call('INCR', inventory_key)
+  if user_id then
+    redis.call('DEL', prefix_tag .. ":user:" .. user_id)
+  end
+  emit_event(prefix_tag, ARGV[2], 'expired', nil, order_id)
+end
+return #expired
+"""
+
+LUA_SCRIPT_BULK_RESTORE = LUA_RESOLVE_STOCK_KEY + LUA_EMIT_INVENTORY_EVENT + """
+-- Every entry must share one hash slot, the caller groups them.
+-- KEYS[1] = prefix tag of any entry, only used to route the call to the slot's node
+-- ARGV[1] = event stream max length
+-- ARGV[2] = number of (flash_sale_id, product_id, quantity) triples that follow
+-- ARGV[3] = seconds a product's :cancelled marker set is kept
+-- then (flash_sale_id, product_id, order_id, was_confirmed) quadruples for cancelled orders
+-- Returns flat (flash_sale_id, product_id, stock) triples for every product touched
+
+local touched = {}
+local results = {}
+local function touch(flash_sale_id, product_id)
+  local id = flash_sale_id .. ":" .. product_id
+  if not touched[id] then
+    touched[id] = true
+    table.insert(results, flash_sale_id)
+    table.insert(results, product_id)
+    table.insert(results, false)
+  end
+end
+
+local maxlen = ARGV[1]
+local i = 4
+for _ = 1, tonumber(ARGV[2]) do
+  local prefix_tag = "flashsale:{" .. ARGV[i] .. ":" .. ARGV[i + 1] .. "}"
+  redis.call('INCRBY', stock_key_for(prefix_tag), ARGV[i + 2])
+  emit_event(prefix_tag, maxlen, 'restocked', nil, nil)
+  touch(ARGV[i], ARGV[i + 1])
+  i = i + 3
+end
+
+while i <= #ARGV do
+  local prefix_tag = "flashsale:{" .. ARGV[i] .. ":" .. ARGV[i + 1] .. "}"
+  local order_id = ARGV[i + 2]
+  -- the orders are only marked CANCELLED in the DB after this call, so a replay sends them
+  -- again; the marker makes sure each order's unit comes back once
+  local cancelled_key = prefix_tag .. ":cancelled"
+  local first_time = redis.call('SADD', cancelled_key, order_id) == 1
+  redis.call('EXPIRE', cancelled_key, ARGV[3])
+  if not first_time then
+    -- restored by an earlier call that failed before the DB update
+  elseif redis.call('ZREM', prefix_tag .. ":holds", order_id) == 1 then
+    -- still held: give the unit back and free the user, as release_hold does
+    local user_id = redis.call('HGET', prefix_tag .. ":holds:users", order_id)
+    redis.call('HDEL', prefix_tag .. ":holds:users", order_id)
+    redis.call('INCR', stock_key_for(prefix_tag))
+    if user_id then
+      redis.call('DEL', prefix_tag .. ":user:" .. user_id)
+    end
+    emit_event(prefix_tag, maxlen, 'cancelled', nil, order_id)
+  elseif ARGV[i + 3] == "1" then
+    -- confirmed orders no longer have a hold, the unit is still sold
+    redis.call('INCR', stock_key_for(prefix_tag))
+    emit_event(prefix_tag, maxlen, 'cancelled', nil, order_id)
+  end
+  -- otherwise the hold sweeper already gave the unit back
+  touch(ARGV[i], ARGV[i + 1])
+  i = i + 4
+end
+
+for j = 3, #results, 3 do
+  results[j] = redis.call('GET', stock_key_for("flashsale:{" .. results[j - 2] .. ":" .. results[j - 1] .. "}"))
+end
+return results
+"""
+
+LUA_SCRIPT_RESTORE_STOCK = LUA_RESOLVE_STOCK_KEY + """
+-- KEYS[1] = prefix tag, flashsale:{sale_id:product_id}
+-- ARGV[1] = quantity
+return redis.call('INCRBY', stock_key_for(KEYS[1]), ARGV[1])
+"""
+
+LUA_SCRIPT_GET_STOCK = LUA_RESOLVE_STOCK_KEY + """
+-- KEYS[1] = prefix tag, flashsale:{sale_id:product_id}
+return redis.call('GET', stock_key_for(KEYS[1]))
+"""
+
+LUA_SCRIPT_BUILD_STOCK_GENERATION = LUA_RESOLVE_STOCK_KEY + """
+-- KEYS[1] = prefix tag, flashsale:{sale_id:product_id}
+-- ARGV[1] = generation to build, ARGV[2] = stock to load
+-- ARGV[3] = seconds the new key lives unless it is switched to
+-- ARGV[4] = "1" to keep the live count of a product that already has one
+-- Returns {live key, live count} the generation was built against, {} if the product had no stock key
 
--- Hash tag ensures all keys go to same shard in Redis Cluster
--- Pattern: flashsale:{sale_id:product_id}:stock
-local prefix_tag = "flashsale:{" .. KEYS[1] .. ":" .. KEYS[2] .. "}"
-local inventory_key = prefix_tag .. ":stock"
-local user_lock_key = prefix_tag .. ":user:" .. KEYS[3]
+local live_key = stock_key_for(KEYS[1])
+local live = redis.call('GET', live_key)
+local stock = ARGV[2]
+if live and ARGV[4] == "1" then
+  stock = live
+end
+redis.call('SET', KEYS[1] .. ":stock:" .. ARGV[1], stock, 'EX', ARGV[3])
+if not live then
+  return {}
+end
+return {live_key, live}
+"""
 
--- 1. Prevent double buying
-local exists = redis.call('EXISTS', user_lock_key)
-if exists == 1 then 
-   return -2  -- User already purchased
+LUA_SCRIPT_SWITCH_STOCK_GENERATION = """
+-- KEYS[1] = prefix tag, flashsale:{sale_id:product_id}
+-- ARGV[1] = generation to switch to, already written at :stock:<gen>
+-- ARGV[2] = seconds the previous generation is kept before Redis expires it
+-- ARGV[3], ARGV[4] = live key and count the generation was built against ("" if none)
+
+local prefix_tag = KEYS[1]
+local next_key = prefix_tag .. ":stock:" .. ARGV[1]
+if redis.call('EXISTS', next_key) == 0 then
+  return 0  -- Not built, keep serving the live generation
+end
+-- buys and returns that hit the live generation after the build move across with the flip
+if ARGV[3] ~= "" and ARGV[3] ~= next_key then
+  local delta = tonumber(redis.call('GET', ARGV[3]) or ARGV[4]) - tonumber(ARGV[4])
+  if delta ~= 0 then
+    redis.call('INCRBY', next_key, delta)
+  end
 end
+local previous = redis.call('GET', prefix_tag .. ":gen")
+redis.call('SET', prefix_tag .. ":gen", ARGV[1])
+redis.call('PERSIST', next_key)
+local previous_key = prefix_tag .. ":stock"
+if previous then
+  previous_key = prefix_tag .. ":stock:" .. previous
+end
+if previous_key ~= next_key then
+  -- collected lazily; kept a while so a bad reload can be inspected
+  redis.call('EXPIRE', previous_key, ARGV[2])
+end
+return 1
+"""
+
+# Stock leases: an API instance takes a chunk of units off the central counter and allocates
+# them to buyers in-process (StockLeases). The units still leased are recorded per instance:
+#   flashsale:{sale_id:product_id}:leases         hash instance_id -> units still leased
+#   flashsale:{sale_id:product_id}:leases:expiry  zset instance_id -> unix time the lease is orphaned
+# A live instance renews its leases and gives idle ones back; the lease keeper of any instance
+# folds orphaned ones back into the counter.
+LUA_SCRIPT_CLAIM_LEASE = LUA_RESOLVE_STOCK_KEY + """
+-- KEYS[1] = prefix tag, flashsale:{sale_id:product_id}
+-- ARGV[1] = instance id, ARGV[2] = units wanted, ARGV[3] = lease ttl (seconds)
+-- ARGV[4] = no leases while the counter is at or below this (end of sale)
+-- Returns {units granted, stock left on the counter}
 
--- 2. Read current stock
-local stock = redis.call('GET', inventory_key)
-if not stock or tonumber(stock) <= 0 then
-  return -1  -- Out of stock
+local prefix_tag = KEYS[1]
+local inventory_key = stock_key_for(prefix_tag)
+local stock = tonumber(redis.call('GET', inventory_key) or "0")
+-- an undrawn lottery allocates its units by the draw, never to a lease
+if stock <= tonumber(ARGV[4]) or redis.call('HGET', prefix_tag .. ":lottery", 'status') == 'open' then
+  return {0, stock}
 end
+local granted = math.min(tonumber(ARGV[2]), stock - tonumber(ARGV[4]))
+redis.call('DECRBY', inventory_key, granted)
+redis.call('HINCRBY', prefix_tag .. ":leases", ARGV[1], granted)
+local now = redis.call('TIME')
+redis.call('ZADD', prefix_tag .. ":leases:expiry", tonumber(now[1]) + 2 * tonumber(ARGV[3]), ARGV[1])
+return {granted, stock - granted}
+"""
 
--- 3. Decrement stock
-redis.call('DECR', inventory_key)
+LUA_SCRIPT_RENEW_LEASE = """
+-- KEYS[1] = prefix tag, flashsale:{sale_id:product_id}
+-- ARGV[1] = instance id, ARGV[2] = lease ttl (seconds)
+-- XX: a lease that was already reclaimed stays reclaimed
+local now = redis.call('TIME')
+return redis.call('ZADD', KEYS[1] .. ":leases:expiry", 'XX', tonumber(now[1]) + 2 * tonumber(ARGV[2]), ARGV[1])
+"""
 
--- 4. Lock user to prevent duplicate purchases
-redis.call('SET', user_lock_key, "1", "EX", ARGV[1])
+LUA_SCRIPT_RETURN_LEASE = LUA_RESOLVE_STOCK_KEY + """
+-- KEYS[1] = prefix tag, flashsale:{sale_id:product_id}
+-- ARGV[1] = instance id whose whole lease goes back to the counter
+-- Returns the units given back
+local prefix_tag = KEYS[1]
+local units = tonumber(redis.call('HGET', prefix_tag .. ":leases", ARGV[1]) or "0")
+if units > 0 then
+  redis.call('INCRBY', stock_key_for(prefix_tag), units)
+end
+redis.call('HDEL', prefix_tag .. ":leases", ARGV[1])
+redis.call('ZREM', prefix_tag .. ":leases:expiry", ARGV[1])
+return units
+"""
 
-return 1  -- Success
+LUA_SCRIPT_RECLAIM_ORPHANED_LEASES = LUA_RESOLVE_STOCK_KEY + """
+-- KEYS[1] = prefix tag, flashsale:{sale_id:product_id}
+-- Returns the units folded back into the counter
+local prefix_tag = KEYS[1]
+local now = redis.call('TIME')
+local orphaned = redis.call('ZRANGEBYSCORE', prefix_tag .. ":leases:expiry", '-inf', now[1])
+local reclaimed = 0
+for _, instance_id in ipairs(orphaned) do
+  reclaimed = reclaimed + tonumber(redis.call('HGET', prefix_tag .. ":leases", instance_id) or "0")
+  redis.call('HDEL', prefix_tag .. ":leases", instance_id)
+  redis.call('ZREM', prefix_tag .. ":leases:expiry", instance_id)
+end
+if reclaimed > 0 then
+  redis.call('INCRBY', stock_key_for(prefix_tag), reclaimed)
+end
+return reclaimed
 """
 
+HOLDS_KEY_PATTERN = re.compile(r"^(flashsale:\{\d+:\d+\}):holds$")
+
+
+def prefix_tag_for(flash_sale_id, product_id) -> str:
+    return f"flashsale:{{{flash_sale_id}:{product_id}}}"
+
+
+def eligibility_hashes(user_id: str) -> tuple[int, int]:
+    """The two 32-bit hashes the eligibility Bloom filter derives its bit positions from."""
+    digest = hashlib.blake2b(user_id.encode(), digest_size=8).digest()
+    # odd h2 keeps the k positions distinct for any m
+    return int.from_bytes(digest[:4], "big"), int.from_bytes(digest[4:], "big") | 1
+
+
+def user_hash(user_id: str) -> str:
+    """Pseudonymous user id for the analytics event stream."""
+    return hashlib.sha1(user_id.encode()).hexdigest()[:16]
+
+
+def rate_limit_buckets(data: BuyRequest) -> list:
+    """Global GCRA buckets of a buy: (key, emission interval ms, burst) per client IP and user."""
+    buckets = [(f"ratelimit:{{user:{data.user_id}}}",
+                1000 / settings.RATE_LIMIT_USER_PER_SECOND, settings.RATE_LIMIT_USER_BURST)]
+    if data.client_ip:
+        buckets.insert(0, (f"ratelimit:{{ip:{data.client_ip}}}",
+                           1000 / settings.RATE_LIMIT_IP_PER_SECOND, settings.RATE_LIMIT_IP_BURST))
+    return buckets
+
+
+class StockLease:
+    """Units of one product this instance holds, allocated to buyers without a Redis call."""
+
+    def __init__(self):
+        self.units = 0
+        self.last_used = time.monotonic()
+
+
+class StockLeases:
+    """
+    This instance's stock leases, one per product. Units come off the central counter a chunk
+    at a time (the next chunk is claimed in the background before the lease runs dry) and are
+    handed to buyers in-process; the reservation script then only writes the user lock and hold.
+    When a claim gets nothing, the product is sold from the counter, or answered as sold out
+    without Redis if the counter is empty, for STOCK_LEASE_RECHECK_SECONDS.
+    The :leases balance in Redis fences every leased sale, so a stale local count can't oversell.
+    """
+
+    def __init__(self):
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self.leases: dict[str, StockLease] = {}
+        self.claims: dict[str, asyncio.Task] = {}
+        # prefix tag -> (monotonic time to try claiming again, True if the counter was empty)
+        self.unleased: dict[str, tuple[float, bool]] = {}
+
+    async def acquire(self, prefix_tag: str, redis: Redis) -> StockLease | None:
+        """Take one unit for a buyer; returns the lease it came from, None to sell from the counter."""
+        while True:
+            lease = self.leases.get(prefix_tag)
+            if lease is not None and lease.units > 0:
+                lease.units -= 1
+                lease.last_used = time.monotonic()
+                if lease.units < settings.STOCK_LEASE_CHUNK // 4:
+                    self._claim_soon(prefix_tag, redis)
+                return lease
+            retry_at, _ = self.unleased.get(prefix_tag, (0, False))
+            if time.monotonic() < retry_at:
+                return None
+            if await self._claim_soon(prefix_tag, redis) == 0:
+                return None
+
+    def release(self, prefix_tag: str, lease: StockLease):
+        """Give back a unit whose buyer was not reserved."""
+        if self.leases.get(prefix_tag) is lease:
+            lease.units += 1
+
+    def lost(self, prefix_tag: str, lease: StockLease):
+        """Forget a lease the reservation script found reclaimed."""
+        if self.leases.get(prefix_tag) is lease:
+            del self.leases[prefix_tag]
+
+    def sold_out(self, prefix_tag: str) -> bool:
+        retry_at, empty = self.unleased.get(prefix_tag, (0, False))
+        return empty and time.monotonic() < retry_at
+
+    def mark_sold_out(self, prefix_tag: str):
+        self.unleased[prefix_tag] = (time.monotonic() + settings.STOCK_LEASE_RECHECK_SECONDS, True)
+
+    def _claim_soon(self, prefix_tag: str, redis: Redis) -> asyncio.Task:
+        # one claim per product in flight; everyone waiting for units shares it
+        claim = self.claims.get(prefix_tag)
+        if claim is None:
+            claim = self.claims[prefix_tag] = asyncio.ensure_future(self._claim(prefix_tag, redis))
+            claim.add_done_callback(lambda task: self._claim_done(prefix_tag, task))
+        return claim
+
+    def _claim_done(self, prefix_tag: str, claim: asyncio.Task):
+        del self.claims[prefix_tag]
+        if not claim.cancelled() and claim.exception() is not None:
+            logger.error(f"Stock lease claim for {prefix_tag} failed: {claim.exception()}")
+
+    async def _claim(self, prefix_tag: str, redis: Redis) -> int:
+        async with redis_metrics.timed("claim_lease"):
+            granted, stock = await redis.eval(LUA_SCRIPT_CLAIM_LEASE, 1, prefix_tag, self.instance_id,
+                                              settings.STOCK_LEASE_CHUNK, settings.STOCK_LEASE_TTL_SECONDS,
+                                              settings.STOCK_LEASE_ENDGAME_UNITS)
+        granted, stock = int(granted), int(stock)
+        if granted == 0:
+            # end of sale, sold out or an open lottery
+            self.unleased[prefix_tag] = (time.monotonic() + settings.STOCK_LEASE_RECHECK_SECONDS, stock <= 0)
+            return 0
+        self.unleased.pop(prefix_tag, None)
+        self.leases.setdefault(prefix_tag, StockLease()).units += granted
+        return granted
+
+    async def renew(self, redis: Redis):
+        """Push back the orphan deadline of every lease this instance still holds."""
+        if not self.leases:
+            return
+        pipe = redis.pipeline(transaction=False)
+        for prefix_tag in self.leases:
+            pipe.eval(LUA_SCRIPT_RENEW_LEASE, 1, prefix_tag, self.instance_id, settings.STOCK_LEASE_TTL_SECONDS)
+        await pipe.execute()
+
+    async def return_idle(self, redis: Redis, return_all: bool = False) -> int:
+        """
+        Give back leases unused for STOCK_LEASE_TTL_SECONDS, and those of products no longer
+        leased, so the last units of a sale aren't stranded here. Returns the units given back.
+        """
+        now = time.monotonic()
+        returned = 0
+        for prefix_tag, lease in list(self.leases.items()):
+            if return_all or now - lease.last_used >= settings.STOCK_LEASE_TTL_SECONDS or prefix_tag in self.unleased:
+                del self.leases[prefix_tag]
+                returned += await redis.eval(LUA_SCRIPT_RETURN_LEASE, 1, prefix_tag, self.instance_id)
+        return returned
+
+    async def reclaim_orphaned(self, redis: Redis) -> int:
+        """Fold leases of instances that stopped renewing them (crashed, scaled in) back into the counters."""
+        reclaimed = 0
+        async for key in redis.scan_iter(match="flashsale:*:leases:expiry"):
+            if isinstance(key, bytes):
+                key = key.decode()
+            reclaimed += await redis.eval(LUA_SCRIPT_RECLAIM_ORPHANED_LEASES, 1, key[:-len(":leases:expiry")])
+        return reclaimed
+
+
+stock_leases = StockLeases()
+
+
+class ReservationBatcher:
+    """
+    Coalesces concurrent buys of one product into one reservation script call.
+    The first buyer of a product opens a RESERVATION_BATCH_WINDOW_MS window; everyone
+    arriving for that product meanwhile, up to RESERVATION_BATCH_MAX_SIZE, rides the same call.
+    """
+
+    def __init__(self):
+        self.pending: dict[str, list] = {}
+        self.flushing: set[asyncio.Task] = set()
+
+    async def submit(self, prefix_tag: str, buyer: list, buckets: list, redis: Redis):
+        """Queue one buyer's script values and rate limit buckets, and wait for its (status, order_id)."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self.pending.get(prefix_tag)
+        if batch is None:
+            batch = self.pending[prefix_tag] = []
+            loop.call_later(settings.RESERVATION_BATCH_WINDOW_MS / 1000, self._flush_soon, prefix_tag, batch, redis)
+        batch.append((buyer, buckets, future))
+        if len(batch) >= settings.RESERVATION_BATCH_MAX_SIZE:
+            self._flush_soon(prefix_tag, batch, redis)
+        return await future
+
+    def _flush_soon(self, prefix_tag: str, batch: list, redis: Redis):
+        # the window timer and a full batch can both fire; only the first one sends it
+        if self.pending.get(prefix_tag) is not batch:
+            return
+        del self.pending[prefix_tag]
+        task = asyncio.ensure_future(self._flush(prefix_tag, batch, redis))
+        self.flushing.add(task)
+        task.add_done_callback(self.flushing.discard)
+
+    async def _flush(self, prefix_tag: str, batch: list, redis: Redis):
+        # a buyer that went away still gets its hold; the hold sweeper returns it
+        try:
+            # the rate limit keys live in their own slots: one pipelined GCRA call per bucket, split per node in cluster mode
+            pipe = redis.pipeline(transaction=False)
+            for _, buckets, _ in batch:
+                for key, interval_ms, burst in buckets:
+                    pipe.eval(LUA_SCRIPT_GCRA, 1, key, interval_ms, burst)
+            async with redis_metrics.timed("rate_limit"):
+                allowed = iter(await pipe.execute())
+            args = []
+            for buyer, buckets, _ in batch:
+                throttled = 0 in [int(next(allowed)) for _ in buckets]
+                args += [*buyer, "1" if throttled else "0"]
+            async with redis_metrics.timed("reserve"):
+                result = await redis.eval(LUA_SCRIPT_INVENTORY_CHECK_AND_DECREMENT, 1, prefix_tag,
+                                          settings.RESERVATION_TTL_SECONDS,
+                                          settings.INVENTORY_EVENT_STREAM_MAXLEN,
+                                          stock_leases.instance_id if settings.STOCK_LEASE_ENABLED else "", *args)
+        except Exception as ex:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(ex)
+            return
+        for i, (_, _, future) in enumerate(batch):
+            if not future.done():
+                future.set_result((int(result[2 * i]), result[2 * i + 1]))
+
 
 class InventoryService:
+    def __init__(self):
+        self.batcher = ReservationBatcher()
+
     async def reserve_inventory(self, data: BuyRequest, redis: Redis):
-        result = await redis.eval(LUA_SCRIPT_INVENTORY_CHECK_AND_DECREMENT, 3, data.flash_sale_id, data.product_id, data.user_id, 600)
-        if result == 1:
+        # cheapest rejection first: no Redis call at all for a client already over its local budget
+        if data.client_ip and not local_rate_limiter.allow(data.client_ip):
+            raise RateLimitedException()
+        order_id = str(uuid4())
+        prefix_tag = prefix_tag_for(data.flash_sale_id, data.product_id)
+        redis_metrics.record_key(f"{prefix_tag}:stock")
+        lease = None
+        if settings.STOCK_LEASE_ENABLED:
+            lease = await stock_leases.acquire(prefix_tag, redis)
+            # a retry needs the script to find its order; everyone else hears sold out from here
+            if lease is None and not data.request_id and stock_leases.sold_out(prefix_tag):
+                raise OutOfStockException()
+        status, previous_order_id = await self._submit(data, order_id, prefix_tag, lease, redis)
+        if status == -6:
+            # the lease keeper reclaimed this instance's lease: sell from the counter instead
+            stock_leases.lost(prefix_tag, lease)
+            lease = None
+            status, previous_order_id = await self._submit(data, order_id, prefix_tag, lease, redis)
+        if lease is not None and status != 1:
+            stock_leases.release(prefix_tag, lease)
+        if status == -1 and settings.STOCK_LEASE_ENABLED:
+            stock_leases.mark_sold_out(prefix_tag)
+        if status == 1:
             order_event = {
-                "order_id": uuid4(),
+                "order_id": order_id,
                 "flash_sale_id": data.flash_sale_id,
                 "product_id": data.product_id,
                 "status": OrderStatus.PENDING,
@@ -59,22 +721,170 @@ class InventoryService:
                 "order_id": order_event["order_id"],
                 "message": "Order reserved successfully",
             }
-        elif result == -1:
+        elif status == 2:
+            # client retry: the order was already reserved and queued by the first attempt
+            if isinstance(previous_order_id, bytes):
+                previous_order_id = previous_order_id.decode()
+            return {
+                "order_id": previous_order_id,
+                "message": "Order reserved successfully",
+            }
+        elif status == -1:
             raise OutOfStockException()
-        elif result == -2:
+        elif status == -2:
             raise UserAlreadyPurchasedException()
+        elif status == -3:
+            raise LotteryAllocationException()
+        elif status == -4:
+            raise RateLimitedException()
+        elif status == -5:
+            raise UserNotEligibleException()
         else:
             raise Exception("Unknown error")
 
+    async def _submit(self, data: BuyRequest, order_id: str, prefix_tag: str, lease: StockLease | None, redis: Redis):
+        return await self.batcher.submit(prefix_tag, [
+            order_id, data.request_id or "", data.user_id,
+            user_hash(data.user_id), *eligibility_hashes(data.user_id),
+            "C" if lease is None else "L",
+        ], rate_limit_buckets(data), redis)
+
     async def restore_inventory(self, data: RestoreInventoryRequest, redis: Redis):
         product_id = data.product_id
         flash_sale_id = data.flash_sale_id
         quantity = data.quantity
-        stock_key = f"flashsale:{{{flash_sale_id}:{product_id}}}:stock"
-        pipe = redis.pipeline()
-        pipe.incrby(stock_key, quantity)
+        prefix_tag = prefix_tag_for(flash_sale_id, product_id)
+        redis_metrics.record_key(f"{prefix_tag}:stock")
+        pipe = redis.pipeline(transaction=False)
+        pipe.eval(LUA_SCRIPT_RESTORE_STOCK, 1, prefix_tag, quantity)
         pipe.delete(f"flashsale:{{{flash_sale_id}:{product_id}}}:user:*")
+        async with redis_metrics.timed("restore"):
+            await pipe.execute()
+
+    async def bulk_restore_inventory(self, items: list[RestoreInventoryRequest], cancelled_orders: list[dict], redis: Redis):
+        """
+        Restore stock for many products in one round trip.
+        `cancelled_orders` entries carry flash_sale_id, product_id, order_id and was_confirmed;
+        each order's unit is given back at most once, however often it is sent.
+        Entries are grouped by hash slot and each group is applied by one Lua call;
+        all calls go out in a single pipeline.
+        Returns the new stock level of every product touched.
+        """
+        quantities = defaultdict(int)
+        for item in items:
+            quantities[(item.flash_sale_id, item.product_id)] += item.quantity
+
+        entries = [(flash_sale_id, product_id, quantity, None) for (flash_sale_id, product_id), quantity in quantities.items()]
+        entries += [(order["flash_sale_id"], order["product_id"], None, order) for order in cancelled_orders]
+        groups = group_by_slot(entries, lambda entry: prefix_tag_for(entry[0], entry[1]))
+        if not groups:
+            return []
+
+        # in cluster mode the pipeline is split per node and the nodes run in parallel
+        pipe = redis.pipeline(transaction=False)
+        for group in groups.values():
+            items, orders = [], []
+            for flash_sale_id, product_id, quantity, order in group:
+                if order is None:
+                    items += [flash_sale_id, product_id, quantity]
+                else:
+                    orders += [flash_sale_id, product_id, order["order_id"], 1 if order["was_confirmed"] else 0]
+            routing_key = prefix_tag_for(group[0][0], group[0][1])
+            pipe.eval(LUA_SCRIPT_BULK_RESTORE, 1, routing_key, settings.INVENTORY_EVENT_STREAM_MAXLEN, len(items) // 3,
+                      settings.CANCELLED_ORDER_MARKER_TTL_SECONDS, *items, *orders)
+        async with redis_metrics.timed("bulk_restore"):
+            replies = await pipe.execute()
+
+        stock_levels = []
+        for reply in replies:
+            for j in range(0, len(reply), 3):
+                flash_sale_id, product_id, stock = reply[j:j + 3]
+                stock_levels.append({
+                    "flash_sale_id": int(flash_sale_id),
+                    "product_id": int(product_id),
+                    "stock": int(stock) if stock is not None else None,
+                })
+        return stock_levels
+
+    async def get_stock(self, flash_sale_id: int, product_id: int, redis: Redis):
+        """Live stock of a product, read from its current generation. None if it was never loaded."""
+        stock = await redis.eval(LUA_SCRIPT_GET_STOCK, 1, prefix_tag_for(flash_sale_id, product_id))
+        return int(stock) if stock is not None else None
+
+    async def load_stock_generation(self, stock_levels: list[tuple[int, int, int]], redis: Redis,
+                                    keep_live: bool = False) -> str:
+        """
+        Reload stock without a gap: write every (flash_sale_id, product_id, stock) into a new
+        generation, then flip each product's pointer to it in one script call.
+        Buyers see either the old or the new count, never a missing key, and units sold or
+        returned between the build and the flip are carried over to the new generation.
+        With keep_live, products that already have a count keep it and stock only seeds new ones.
+        Returns the generation id.
+        """
+        generation = str(time.time_ns())
+        # the unflipped keys expire on their own if the reload dies half way
+        pipe = redis.pipeline(transaction=False)
+        for flash_sale_id, product_id, stock in stock_levels:
+            pipe.eval(LUA_SCRIPT_BUILD_STOCK_GENERATION, 1, prefix_tag_for(flash_sale_id, product_id),
+                      generation, stock, settings.STOCK_GENERATION_GRACE_SECONDS, "1" if keep_live else "0")
+        baselines = await pipe.execute()
+
+        pipe = redis.pipeline(transaction=False)
+        for (flash_sale_id, product_id, _), baseline in zip(stock_levels, baselines):
+            live_key, live = baseline or ("", "")
+            pipe.eval(LUA_SCRIPT_SWITCH_STOCK_GENERATION, 1, prefix_tag_for(flash_sale_id, product_id),
+                      generation, settings.STOCK_GENERATION_GRACE_SECONDS, live_key, live)
         await pipe.execute()
+        return generation
+
+    async def confirm_hold(self, flash_sale_id: int, product_id: int, order_id: str, redis: Redis) -> bool:
+        """
+        Drop the hold of a confirmed order so the sweeper leaves its unit sold.
+        Returns False if the hold was already gone (swept before confirmation).
+        """
+        prefix_tag = prefix_tag_for(flash_sale_id, product_id)
+        redis_metrics.record_key(f"{prefix_tag}:stock")
+        pipe = redis.pipeline(transaction=False)
+        pipe.zrem(f"{prefix_tag}:holds", order_id)
+        pipe.hdel(f"{prefix_tag}:holds:users", order_id)
+        pipe.xadd(f"{prefix_tag}:events", {"o": "confirmed", "r": order_id},
+                  maxlen=settings.INVENTORY_EVENT_STREAM_MAXLEN, approximate=True)
+        async with redis_metrics.timed("confirm_hold"):
+            removed, _, _ = await pipe.execute()
+        return removed == 1
+
+    async def release_hold(self, flash_sale_id: int, product_id: int, order_id: str, redis: Redis) -> bool:
+        """
+        Give the unit of a failed order back to stock and release the user lock.
+        Safe to call more than once; only the first call restores stock.
+        """
+        redis_metrics.record_key(f"{prefix_tag_for(flash_sale_id, product_id)}:stock")
+        async with redis_metrics.timed("release_hold"):
+            result = await redis.eval(LUA_SCRIPT_RELEASE_HOLD, 1, prefix_tag_for(flash_sale_id, product_id), order_id,
+                                      settings.INVENTORY_EVENT_STREAM_MAXLEN)
+        return result == 1
+
+    async def sweep_expired_holds(self, redis: Redis) -> int:
+        """
+        Return stock for every hold past its expiry, one Lua call per batch.
+        In cluster mode scan_iter walks every primary.
+        """
+        released = 0
+        async for key in redis.scan_iter(match="flashsale:*:holds"):
+            if isinstance(key, bytes):
+                key = key.decode()
+            match = HOLDS_KEY_PATTERN.match(key)
+            if match is None:
+                continue
+            prefix_tag = match.group(1)
+            while True:
+                async with redis_metrics.timed("sweep_holds"):
+                    count = await redis.eval(LUA_SCRIPT_SWEEP_EXPIRED_HOLDS, 1, prefix_tag, settings.HOLD_SWEEP_BATCH_SIZE,
+                                             settings.INVENTORY_EVENT_STREAM_MAXLEN)
+                released += count
+                if count < settings.HOLD_SWEEP_BATCH_SIZE:
+                    break
+        return released
 
 
 inventory_service = InventoryService()
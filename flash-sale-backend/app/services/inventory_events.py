@@ -0,0 +1,135 @@
+import logging
+import re
+import socket
+from datetime import datetime, timezone
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+from sqlalchemy.dialects.postgresql import insert
+from app.core.config import settings
+from app.db.models.inventory_event import InventoryEvent
+from app.db.session import async_session_factory
+
+logger = logging.getLogger(__name__)
+
+EVENTS_KEY_PATTERN = re.compile(r"^flashsale:\{(\d+):(\d+)\}:events$")
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def parse_stream_entries(key: str, entries) -> list[dict]:
+    """Turn XREADGROUP entries of one product's stream into inventory event rows."""
+    match = EVENTS_KEY_PATTERN.match(key)
+    flash_sale_id, product_id = int(match.group(1)), int(match.group(2))
+    rows = []
+    for entry_id, fields in entries:
+        entry_id = _decode(entry_id)
+        fields = {_decode(name): _decode(value) for name, value in fields.items()}
+        rows.append({
+            "flash_sale_id": flash_sale_id,
+            "product_id": product_id,
+            "stream_id": entry_id,
+            "outcome": fields["o"],
+            "user_hash": fields.get("u"),
+            "order_id": fields.get("r"),
+            "occurred_at": datetime.fromtimestamp(int(entry_id.split("-")[0]) / 1000, tz=timezone.utc),
+        })
+    return rows
+
+
+class InventoryEventService:
+    """
+    Copies the per-product inventory event streams into the inventoryevent table.
+    Entries are acked only after their batch is committed; a crash in between
+    re-delivers them and the unique stream id turns the re-insert into a no-op.
+    """
+
+    def __init__(self, group: str):
+        self.group = group
+        self.consumer = socket.gethostname()
+        self.known_streams: set[str] = set()
+        self.pending_streams: set[str] = set()
+
+    async def _ensure_group(self, key: str, redis: Redis):
+        if key in self.known_streams:
+            return False
+        try:
+            await redis.xgroup_create(key, self.group, id="0", mkstream=True)
+        except ResponseError as ex:
+            if "BUSYGROUP" not in str(ex):
+                raise
+        self.known_streams.add(key)
+        return True
+
+    async def _read(self, key: str, redis: Redis) -> list:
+        """
+        Next batch of one stream. Streams with entries read but never acked (first sight in
+        this process, or a failed store) are re-read from the pending list until it drains.
+        """
+        if key in self.pending_streams:
+            reply = await redis.xreadgroup(self.group, self.consumer, {key: "0"}, count=settings.INVENTORY_EVENT_BATCH_SIZE)
+            entries = reply[0][1] if reply else []
+            if entries:
+                return entries
+            self.pending_streams.discard(key)
+        reply = await redis.xreadgroup(self.group, self.consumer, {key: ">"}, count=settings.INVENTORY_EVENT_BATCH_SIZE)
+        return reply[0][1] if reply else []
+
+    async def _store(self, rows: list[dict], acks: list, redis: Redis):
+        try:
+            if rows:
+                async with async_session_factory() as db:
+                    async with db.begin():
+                        for start in range(0, len(rows), settings.INVENTORY_EVENT_BATCH_SIZE):
+                            await db.execute(
+                                insert(InventoryEvent)
+                                .values(rows[start:start + settings.INVENTORY_EVENT_BATCH_SIZE])
+                                .on_conflict_do_nothing(index_elements=["flash_sale_id", "product_id", "stream_id"])
+                            )
+            # XACK is per stream, and each stream is its own slot
+            pipe = redis.pipeline(transaction=False)
+            for key, entry_ids in acks:
+                pipe.xack(key, self.group, *entry_ids)
+            await pipe.execute()
+        except Exception:
+            # read again from the pending list next pass, before trimming can catch up with them
+            self.pending_streams.update(key for key, _ in acks)
+            raise
+
+    async def consume(self, redis: Redis) -> int:
+        """
+        Drain every product stream, one batch per stream per round, until no stream has a full
+        batch left, so a hot product cannot outrun MAXLEN trimming. Returns the number of events stored.
+        """
+        keys = []
+        async for key in redis.scan_iter(match="flashsale:*:events"):
+            key = _decode(key)
+            if EVENTS_KEY_PATTERN.match(key) is None:
+                continue
+            if await self._ensure_group(key, redis):
+                # first time we see a stream in this process: pick up what a previous run read but never acked
+                self.pending_streams.add(key)
+            keys.append(key)
+
+        stored = 0
+        while keys:
+            rows, acks, unfinished = [], [], []
+            for key in keys:
+                entries = await self._read(key, redis)
+                if not entries:
+                    continue
+                # a pending entry trimmed off the stream comes back without fields: ack it and move on
+                rows += parse_stream_entries(key, [(entry_id, fields) for entry_id, fields in entries if fields])
+                acks.append((key, [entry_id for entry_id, _ in entries]))
+                if len(entries) >= settings.INVENTORY_EVENT_BATCH_SIZE or key in self.pending_streams:
+                    unfinished.append(key)
+            if not acks:
+                break
+            await self._store(rows, acks, redis)
+            stored += len(rows)
+            keys = unfinished
+        return stored
+
+
+inventory_event_service = InventoryEventService(group=settings.INVENTORY_EVENT_CONSUMER_GROUP)
@@ -0,0 +1,187 @@
+import json
+from uuid import uuid4
+from redis.asyncio import Redis
+from app.core.config import settings
+from app.db.models.order import OrderStatus
+from app.exception import LotteryClosedException, UserNotEligibleException
+from app.services.inventory import LUA_CHECK_ELIGIBILITY, LUA_EMIT_INVENTORY_EVENT, LUA_RESOLVE_STOCK_KEY, eligibility_hashes, inventory_service, prefix_tag_for
+from app.services.order_queue import order_queue
+from app.services.redis_metrics import redis_metrics
+
+# Lottery allocation for ultra-scarce stock.
+# Instead of every buyer racing DECR on the stock key, buyers are collected into a set
+# during the entry window (one SADD each) and a single draw hands out the stock.
+# While the lottery is open the FCFS reservation script refuses the product; once drawn,
+# units that come back later (expired holds, failed payments) are sold FCFS again.
+#
+# Keys (all under the product hash tag, so every script stays on one slot):
+#   flashsale:{sale:product}:lottery          hash {status: open|drawn, closes_at}
+#   flashsale:{sale:product}:lottery:entries  set of user ids, renamed to :losers by the draw
+#   flashsale:{sale:product}:lottery:winners  hash user_id -> order_id
+
+LUA_SCRIPT_OPEN_LOTTERY = """
+-- KEYS[1] = prefix tag, flashsale:{sale_id:product_id}
+-- ARGV[1] = entry window (seconds)
+
+local lottery_key = KEYS[1] .. ":lottery"
+if redis.call('EXISTS', lottery_key) == 1 then
+  return 0  -- Already opened
+end
+local now = redis.call('TIME')
+redis.call('HSET', lottery_key, 'status', 'open', 'closes_at', tonumber(now[1]) + tonumber(ARGV[1]))
+return 1
+"""
+
+
+LUA_SCRIPT_ENTER_LOTTERY = LUA_CHECK_ELIGIBILITY + """
+-- KEYS[1] = prefix tag, flashsale:{sale_id:product_id}
+-- ARGV[1] = user_id
+-- ARGV[2], ARGV[3] = eligibility hashes of the user
+
+if not is_eligible(KEYS[1], tonumber(ARGV[2]), tonumber(ARGV[3])) then
+  return -2
+end
+
+local lottery = redis.call('HMGET', KEYS[1] .. ":lottery", 'status', 'closes_at')
+local now = redis.call('TIME')
+if lottery[1] ~= 'open' or tonumber(now[1]) >= tonumber(lottery[2]) then
+  return -1  -- No lottery running, or its entry window is over
+end
+return redis.call('SADD', KEYS[1] .. ":lottery:entries", ARGV[1])  -- 1 entered, 0 already entered
+"""
+
+
+LUA_SCRIPT_DRAW_LOTTERY = LUA_RESOLVE_STOCK_KEY + LUA_EMIT_INVENTORY_EVENT + """
+-- KEYS[1] = prefix tag, flashsale:{sale_id:product_id}
+-- ARGV[1] = ttl (seconds) of the winners' holds and user locks
+-- ARGV[2] = event stream max length
+-- ARGV[3..n] = order ids to hand out, at least as many as the stock
+-- Returns {status, losers, user_1, order_1, user_2, order_2, ...};
+-- status -1 not open or already drawn, -2 entry window not over yet
+
+local prefix_tag = KEYS[1]
+local lottery_key = prefix_tag .. ":lottery"
+local inventory_key = stock_key_for(prefix_tag)
+local entries_key = prefix_tag .. ":lottery:entries"
+
+local lottery = redis.call('HMGET', lottery_key, 'status', 'closes_at')
+if lottery[1] ~= 'open' then
+  return {-1}  -- Not opened, or already drawn
+end
+local now = redis.call('TIME')
+if tonumber(now[1]) < tonumber(lottery[2]) then
+  return {-2}  -- Entrants could still join after the draw
+end
+
+local stock = tonumber(redis.call('GET', inventory_key) or "0")
+local winners = {}
+local count = math.min(stock, #ARGV - 2)
+if count > 0 then
+  winners = redis.call('SPOP', entries_key, count)
+end
+
+local expires_at = tonumber(now[1]) + tonumber(ARGV[1])
+local results = {1, 0}
+for i, user_id in ipairs(winners) do
+  local order_id = ARGV[i + 2]
+  -- same bookkeeping as a FCFS reservation, so the worker and hold sweeper treat winners alike
+  redis.call('DECR', inventory_key)
+  redis.call('SET', prefix_tag .. ":user:" .. user_id, "1", "EX", ARGV[1])
+  redis.call('ZADD', prefix_tag .. ":holds", expires_at, order_id)
+  redis.call('HSET', prefix_tag .. ":holds:users", order_id, user_id)
+  redis.call('HSET', prefix_tag .. ":lottery:winners", user_id, order_id)
+  emit_event(prefix_tag, ARGV[2], 'reserved', nil, order_id)
+  table.insert(results, user_id)
+  table.insert(results, order_id)
+end
+
+-- whoever is still in the entry set lost
+results[2] = redis.call('SCARD', entries_key)
+if results[2] > 0 then
+  redis.call('RENAME', entries_key, prefix_tag .. ":lottery:losers")
+end
+-- no longer 'open', so the reservation script stops refusing the product
+redis.call('HSET', lottery_key, 'status', 'drawn')
+return results
+"""
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class LotteryService:
+    async def open_lottery(self, flash_sale_id: int, product_id: int, redis: Redis, window_seconds: int = None) -> bool:
+        window_seconds = window_seconds or settings.LOTTERY_ENTRY_WINDOW_SECONDS
+        result = await redis.eval(LUA_SCRIPT_OPEN_LOTTERY, 1, prefix_tag_for(flash_sale_id, product_id), window_seconds)
+        return result == 1
+
+    async def enter_lottery(self, flash_sale_id: int, product_id: int, user_id: str, redis: Redis):
+        prefix_tag = prefix_tag_for(flash_sale_id, product_id)
+        redis_metrics.record_key(f"{prefix_tag}:lottery:entries")
+        async with redis_metrics.timed("enter_lottery"):
+            result = await redis.eval(LUA_SCRIPT_ENTER_LOTTERY, 1, prefix_tag, user_id, *eligibility_hashes(user_id))
+        if result == -1:
+            raise LotteryClosedException()
+        if result == -2:
+            raise UserNotEligibleException()
+        return {
+            "entered": True,
+            "message": "Entered lottery" if result == 1 else "Already entered",
+        }
+
+    async def draw_lottery(self, flash_sale_id: int, product_id: int, redis: Redis):
+        """
+        Allocate the product's stock to random entrants in one script call,
+        enqueue the winners' orders and publish the result for the losers.
+        Refused until the entry window has closed.
+        """
+        prefix_tag = prefix_tag_for(flash_sale_id, product_id)
+        # only the draw touches a lottery product's stock, so this count can't go stale
+        stock = await inventory_service.get_stock(flash_sale_id, product_id, redis) or 0
+        order_ids = [str(uuid4()) for _ in range(stock)]
+        async with redis_metrics.timed("draw_lottery"):
+            result = await redis.eval(LUA_SCRIPT_DRAW_LOTTERY, 1, prefix_tag, settings.RESERVATION_TTL_SECONDS,
+                                       settings.INVENTORY_EVENT_STREAM_MAXLEN, *order_ids)
+        if int(result[0]) == -2:
+            raise LotteryClosedException("Lottery entries are still open")
+        if int(result[0]) != 1:
+            raise LotteryClosedException("Lottery is not open for drawing")
+
+        losers = int(result[1])
+        winners = [(_decode(result[i]), _decode(result[i + 1])) for i in range(2, len(result), 2)]
+        for _, order_id in winners:
+            await order_queue.put({
+                "order_id": order_id,
+                "flash_sale_id": flash_sale_id,
+                "product_id": product_id,
+                "status": OrderStatus.PENDING,
+            })
+
+        # subscribers (push gateway) tell losers right away instead of letting them poll
+        await redis.publish(f"{prefix_tag}:lottery:results", json.dumps({
+            "flash_sale_id": flash_sale_id,
+            "product_id": product_id,
+            "winners": len(winners),
+            "losers": losers,
+        }))
+        return {"winners": len(winners), "losers": losers}
+
+    async def lottery_result(self, flash_sale_id: int, product_id: int, user_id: str, redis: Redis):
+        prefix_tag = prefix_tag_for(flash_sale_id, product_id)
+        pipe = redis.pipeline(transaction=False)
+        pipe.hget(f"{prefix_tag}:lottery", "status")
+        pipe.hget(f"{prefix_tag}:lottery:winners", user_id)
+        pipe.sismember(f"{prefix_tag}:lottery:losers", user_id)
+        pipe.sismember(f"{prefix_tag}:lottery:entries", user_id)
+        status, order_id, lost, entered = await pipe.execute()
+        if order_id is not None:
+            return {"result": "won", "order_id": _decode(order_id)}
+        if lost:
+            return {"result": "lost"}
+        if entered:
+            return {"result": "pending"}
+        return {"result": "not_entered", "lottery": _decode(status)}
+
+
+lottery_service = LotteryService()
@@ -0,0 +1,116 @@
+import json
+import random
+from redis.asyncio import Redis
+from app.core.config import settings
+from app.services.order_queue import order_queue
+
+# Failed order_worker events wait here instead of being retried inline, so one bad
+# event never stalls the worker loop. Both keys share a hash tag to stay on one slot.
+#   orders:{retry}:due   zset of event JSON scored by the unix time it is due again
+#   orders:{retry}:dead  hash order_id -> event JSON, for events out of attempts
+# A due event is claimed, not removed: its score moves past the visibility timeout and
+# the worker acks it once processed, so an event lost in a crash comes due again.
+RETRY_KEY = "orders:{retry}:due"
+DEAD_LETTER_KEY = "orders:{retry}:dead"
+
+
+# Key the worker stores the claimed zset member under, so it can ack or replace it.
+RETRY_ENTRY_FIELD = "retry_entry"
+
+
+LUA_SCRIPT_SCHEDULE_RETRY = """
+-- KEYS[1] = retry zset
+-- ARGV[1] = delay (seconds), ARGV[2] = event json
+-- ARGV[3] = claimed entry this attempt came from, '' for a first failure
+
+local now = redis.call('TIME')
+local due_at = tonumber(now[1]) + tonumber(now[2]) / 1000000 + tonumber(ARGV[1])
+redis.call('ZADD', KEYS[1], due_at, ARGV[2])
+if ARGV[3] ~= '' then
+  redis.call('ZREM', KEYS[1], ARGV[3])
+end
+return 1
+"""
+
+
+LUA_SCRIPT_DEAD_LETTER = """
+-- KEYS[1] = retry zset, KEYS[2] = dead letter hash
+-- ARGV[1] = order_id, ARGV[2] = event json, ARGV[3] = claimed entry or ''
+
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+if ARGV[3] ~= '' then
+  redis.call('ZREM', KEYS[1], ARGV[3])
+end
+return 1
+"""
+
+
+LUA_SCRIPT_CLAIM_DUE_RETRIES = """
+-- KEYS[1] = retry zset
+-- ARGV[1] = max events to claim, ARGV[2] = visibility timeout (seconds)
+-- Returns the events that are due, oldest first, and hides them for the visibility
+-- timeout. They stay in the zset until acked, so a crash only delays them.
+
+local now = redis.call('TIME')
+local now_ts = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now_ts, 'LIMIT', 0, tonumber(ARGV[1]))
+for _, entry in ipairs(due) do
+  redis.call('ZADD', KEYS[1], 'XX', now_ts + tonumber(ARGV[2]), entry)
+end
+return due
+"""
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Exponential backoff with equal jitter: half the capped delay is fixed,
+    the other half random, so retries of a burst of failures spread out.
+    """
+    delay = min(settings.ORDER_RETRY_MAX_DELAY_SECONDS, settings.ORDER_RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class OrderRetryService:
+    async def schedule_retry(self, event: dict, error: str, redis: Redis) -> bool:
+        """
+        Queue a failed event for another attempt, or dead-letter it once it is out of attempts.
+        Returns False when the event was dead-lettered.
+        """
+        claimed = event.get(RETRY_ENTRY_FIELD) or ""
+        attempts = event.get("attempts", 0) + 1
+        event = {key: value for key, value in event.items() if key != RETRY_ENTRY_FIELD}
+        event = {**event, "attempts": attempts, "last_error": error}
+        if attempts > settings.ORDER_RETRY_MAX_ATTEMPTS:
+            # the hold is never confirmed, so the hold sweeper gives the stock back
+            await redis.eval(LUA_SCRIPT_DEAD_LETTER, 2, RETRY_KEY, DEAD_LETTER_KEY, event["order_id"], json.dumps(event), claimed)
+            return False
+        await redis.eval(LUA_SCRIPT_SCHEDULE_RETRY, 1, RETRY_KEY, backoff_delay(attempts), json.dumps(event), claimed)
+        return True
+
+    async def claim_due(self, redis: Redis, limit: int = None) -> list[dict]:
+        """
+        Claim due events for processing. Each one carries its zset entry under RETRY_ENTRY_FIELD
+        and is handed out again after the visibility timeout unless acked or rescheduled first.
+        """
+        limit = limit or settings.ORDER_RETRY_PUMP_BATCH_SIZE
+        due = await redis.eval(LUA_SCRIPT_CLAIM_DUE_RETRIES, 1, RETRY_KEY, limit,
+                               settings.ORDER_RETRY_VISIBILITY_TIMEOUT_SECONDS)
+        return [{**json.loads(item), RETRY_ENTRY_FIELD: item if isinstance(item, str) else item.decode()} for item in due]
+
+    async def ack(self, event: dict, redis: Redis) -> None:
+        """Drop a processed retry from the zset. No-op for events that never failed."""
+        if event.get(RETRY_ENTRY_FIELD):
+            await redis.zrem(RETRY_KEY, event[RETRY_ENTRY_FIELD])
+
+    async def requeue_due(self, redis: Redis) -> int:
+        """Move due events back onto the order queue. Returns how many were moved."""
+        events = await self.claim_due(redis)
+        for event in events:
+            await order_queue.put(event)
+        return len(events)
+
+    async def dead_letters(self, redis: Redis) -> list[dict]:
+        return [json.loads(item) for item in (await redis.hgetall(DEAD_LETTER_KEY)).values()]
+
+
+order_retry_service = OrderRetryService()
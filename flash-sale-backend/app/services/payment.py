@@ -1,8 +1,13 @@
 import asyncio
 from random import random
+import httpx
+from app.core.config import settings
 
 
 class PaymentService:
+    def __init__(self):
+        self.client = None
+
     async def process_payment(self, order_id: str, idempotency_key: str):
         # while calling payment gateway, we will pass idempotency_key. this will help us to avoid duplicate payments.
         # Gateway	Idempotency Mechanism
@@ -11,8 +16,18 @@ class PaymentService:
         # Razorpay	X-Razorpay-Idempotency-Key header
         # Square	Idempotency-Key header
         # Adyen	rreference field (merchant order ID)
+        if settings.PAYMENT_GATEWAY_URL:
+            return await self._charge_gateway(order_id, idempotency_key)
         await asyncio.sleep(0.2)
         return random() > 0.1
 
+    async def _charge_gateway(self, order_id: str, idempotency_key: str) -> bool:
+        if self.client is None:
+            self.client = httpx.AsyncClient(base_url=settings.PAYMENT_GATEWAY_URL, timeout=settings.PAYMENT_GATEWAY_TIMEOUT_SECONDS)
+        # 5xx and timeouts raise, so the order worker retries with the same idempotency key
+        response = await self.client.post("/v1/payments", json={"order_id": order_id}, headers={"Idempotency-Key": idempotency_key})
+        response.raise_for_status()
+        return response.json()["status"] == "succeeded"
+
 
 payment_service = PaymentService()
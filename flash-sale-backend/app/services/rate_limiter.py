@@ -0,0 +1,36 @@
+import time
+from collections import OrderedDict
+from app.core.config import settings
+
+
+class LocalTokenBucket:
+    """
+    Per-client token buckets kept in process, checked before any Redis call.
+    Only the most recently seen `max_clients` buckets are kept; an evicted client
+    simply starts again with a full bucket.
+    """
+
+    def __init__(self, rate: float, burst: int, max_clients: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def allow(self, client: str) -> bool:
+        now = time.monotonic()
+        tokens, updated_at = self.buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[client] = (tokens, now)
+        if len(self.buckets) > self.max_clients:
+            self.buckets.popitem(last=False)
+        return allowed
+
+
+local_rate_limiter = LocalTokenBucket(
+    rate=settings.LOCAL_RATE_LIMIT_PER_SECOND,
+    burst=settings.LOCAL_RATE_LIMIT_BURST,
+    max_clients=settings.LOCAL_RATE_LIMIT_MAX_CLIENTS,
+)
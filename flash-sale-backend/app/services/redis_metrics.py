@@ -0,0 +1,122 @@
+import logging
+import time
+from contextlib import asynccontextmanager
+from random import random
+from redis.crc import key_slot
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SpaceSaving:
+    """
+    Space-saving top-k sketch.
+    Tracks at most `capacity` keys; a new key evicts the smallest counter and
+    inherits its count, so every estimate overshoots by at most `error`.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: dict[str, float] = {}
+        self.errors: dict[str, float] = {}
+
+    def offer(self, key: str, weight: float = 1):
+        if key in self.counts:
+            self.counts[key] += weight
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[key] = weight
+            self.errors[key] = 0
+            return
+        victim = min(self.counts, key=self.counts.get)
+        floor = self.counts.pop(victim)
+        self.errors.pop(victim)
+        self.counts[key] = floor + weight
+        self.errors[key] = floor
+
+    def top(self, n: int):
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return [(key, count, self.errors[key]) for key, count in ranked[:n]]
+
+
+class ScriptLatency:
+    def __init__(self):
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.slow_calls = 0
+
+    def record(self, elapsed_ms: float):
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if elapsed_ms >= settings.SLOW_REDIS_CALL_MS:
+            self.slow_calls += 1
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "avg_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "slow_calls": self.slow_calls,
+        }
+
+
+class RedisMetrics:
+    """
+    In-process view of the Redis traffic generated by InventoryService.
+    Key accesses are sampled into a space-saving sketch; every script call is timed.
+    Counters cover the current report window and are reset by rotate().
+    """
+
+    def __init__(self, sample_rate: float, top_k: int):
+        self.sample_rate = sample_rate
+        self.top_k = top_k
+        self._rotate()
+
+    def _rotate(self):
+        # keep extra counters so the reported top-k are not the ones being evicted
+        self.hot_keys = SpaceSaving(capacity=self.top_k * 4)
+        self.latencies: dict[str, ScriptLatency] = {}
+        self.window_started_at = time.time()
+
+    def record_key(self, key: str):
+        if self.sample_rate >= 1 or random() < self.sample_rate:
+            self.hot_keys.offer(key)
+
+    @asynccontextmanager
+    async def timed(self, script: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.latencies.setdefault(script, ScriptLatency()).record(elapsed_ms)
+            if elapsed_ms >= settings.SLOW_REDIS_CALL_MS:
+                logger.warning(f"Slow Redis call {script}: {elapsed_ms:.1f}ms")
+
+    def snapshot(self):
+        scale = 1 / self.sample_rate if self.sample_rate < 1 else 1
+        return {
+            "window_seconds": round(time.time() - self.window_started_at, 1),
+            "sample_rate": self.sample_rate,
+            "hot_keys": [
+                {
+                    "key": key,
+                    "estimated_count": round(count * scale),
+                    "max_overestimate": round(error * scale),
+                    "slot": key_slot(key.encode()),
+                }
+                for key, count, error in self.hot_keys.top(self.top_k)
+            ],
+            "scripts": {name: latency.as_dict() for name, latency in self.latencies.items()},
+        }
+
+    def rotate(self):
+        """Return the finished window's snapshot and start a new one."""
+        snapshot = self.snapshot()
+        self._rotate()
+        return snapshot
+
+
+redis_metrics = RedisMetrics(sample_rate=settings.REDIS_METRICS_SAMPLE_RATE, top_k=settings.HOT_KEY_TOP_K)
@@ -0,0 +1,105 @@
+import logging
+import re
+import time
+from redis.asyncio import Redis
+from sqlalchemy import text
+from app.core.config import settings
+from app.db.session import async_session_factory
+from app.services.inventory import LUA_SCRIPT_GET_STOCK, prefix_tag_for
+
+logger = logging.getLogger(__name__)
+
+# the plain key and every generation key (:stock:<gen>) of a product
+STOCK_KEY_PATTERN = re.compile(r"^flashsale:\{(\d+):(\d+)\}:stock(?::\d+)?$")
+
+
+def build_stock_update(rows: list[tuple[int, int, int]]):
+    """One set-based UPDATE for a batch of (flash_sale_id, product_id, remaining_stock) rows."""
+    values, params = [], {}
+    for i, (flash_sale_id, product_id, remaining_stock) in enumerate(rows):
+        values.append(f"(CAST(:s{i} AS BIGINT), CAST(:p{i} AS BIGINT), CAST(:r{i} AS INTEGER))")
+        params.update({f"s{i}": flash_sale_id, f"p{i}": product_id, f"r{i}": remaining_stock})
+    sql = f"""
+UPDATE flashsaleproduct AS fsp
+SET remaining_stock = v.remaining_stock, stock_synced_at = NOW()
+FROM (VALUES {", ".join(values)}) AS v(flash_sale_id, product_id, remaining_stock)
+WHERE fsp.flash_sale_id = v.flash_sale_id AND fsp.product_id = v.product_id
+"""
+    return text(sql), params
+
+
+class StockSyncService:
+    """
+    Write-behind copy of the Redis stock counters into flashsaleproduct.remaining_stock.
+    Only values that changed since the last write go out, plus any not rewritten for
+    STOCK_SYNC_MAX_STALENESS_SECONDS, so a recent stock_synced_at means the row is current.
+    """
+
+    def __init__(self):
+        # (flash_sale_id, product_id) -> (stock, monotonic time it was written)
+        self.last_written: dict[tuple[int, int], tuple[int, float]] = {}
+
+    def _is_due(self, flash_sale_id: int, product_id: int, stock: int, now: float) -> bool:
+        written = self.last_written.get((flash_sale_id, product_id))
+        return written is None or written[0] != stock or now - written[1] >= settings.STOCK_SYNC_MAX_STALENESS_SECONDS
+
+    async def _read_batch(self, products: list[tuple[int, int]], redis: Redis) -> list[tuple[int, int, int]]:
+        # one script call per product reads its live generation; the pipeline is split per node in cluster mode
+        pipe = redis.pipeline(transaction=False)
+        for flash_sale_id, product_id in products:
+            pipe.eval(LUA_SCRIPT_GET_STOCK, 1, prefix_tag_for(flash_sale_id, product_id))
+        values = await pipe.execute()
+        now = time.monotonic()
+        rows = []
+        for (flash_sale_id, product_id), value in zip(products, values):
+            if value is None:
+                continue
+            row = (flash_sale_id, product_id, int(value))
+            if self._is_due(*row, now):
+                rows.append(row)
+        return rows
+
+    async def collect(self, redis: Redis):
+        """Yield batches of stock rows that need writing."""
+        seen, products = set(), []
+        async for key in redis.scan_iter(match="flashsale:*:stock*", count=settings.STOCK_SYNC_BATCH_SIZE):
+            if isinstance(key, bytes):
+                key = key.decode()
+            match = STOCK_KEY_PATTERN.match(key)
+            if match is None:
+                continue
+            product = (int(match.group(1)), int(match.group(2)))
+            # during a reload a product has two generations
+            if product in seen:
+                continue
+            seen.add(product)
+            products.append(product)
+            if len(products) >= settings.STOCK_SYNC_BATCH_SIZE:
+                rows = await self._read_batch(products, redis)
+                if rows:
+                    yield rows
+                products = []
+        if products:
+            rows = await self._read_batch(products, redis)
+            if rows:
+                yield rows
+
+    def mark_written(self, rows: list[tuple[int, int, int]]):
+        now = time.monotonic()
+        for flash_sale_id, product_id, stock in rows:
+            self.last_written[(flash_sale_id, product_id)] = (stock, now)
+
+    async def flush(self, redis: Redis) -> int:
+        """Write every due stock value, one UPDATE per batch. Returns the number of rows sent."""
+        written = 0
+        async for rows in self.collect(redis):
+            statement, params = build_stock_update(rows)
+            async with async_session_factory() as db:
+                async with db.begin():
+                    await db.execute(statement, params)
+            self.mark_written(rows)
+            written += len(rows)
+        return written
+
+
+stock_sync_service = StockSyncService()
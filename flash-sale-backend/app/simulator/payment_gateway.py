@@ -0,0 +1,110 @@
+"""
+Local stand-in for the payment gateway, for end-to-end load tests.
+
+Run it next to the API and point the order worker at it:
+
+    uvicorn app.simulator.payment_gateway:app --port 8100
+    PAYMENT_GATEWAY_URL=http://localhost:8100 uvicorn app.app:app
+
+Payments take a log-normal latency, get declined or answered 503 at the configured
+rates, and are idempotent per Idempotency-Key. Every settled payment is followed by a
+signed webhook sent after a random delay, so webhooks arrive out of order, and a share
+of them are delivered twice.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import math
+import random
+from uuid import uuid4
+import httpx
+from fastapi import FastAPI, Header, HTTPException
+from pydantic import BaseModel
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+app = FastAPI(name="Payment Gateway Simulator", version="1.0.0")
+
+# idempotency key -> settled payment, and payments still being processed
+payments: dict[str, dict] = {}
+in_flight: dict[str, asyncio.Task] = {}
+webhook_client = httpx.AsyncClient(timeout=10)
+
+
+class ChargeRequest(BaseModel):
+    order_id: str
+
+
+def sign_payload(payload: bytes, secret: str) -> str:
+    """Signature the webhook route's verify_signature accepts."""
+    return "sha256=" + hmac.new(secret.encode(), payload, hashlib.sha256).hexdigest()
+
+
+def build_webhook(payment: dict) -> tuple[bytes, dict]:
+    event = {
+        "id": f"evt_{uuid4().hex}",
+        "type": "payment.succeeded" if payment["status"] == "succeeded" else "payment.failed",
+        "data": {"order_id": payment["order_id"], "payment_id": payment["payment_id"]},
+    }
+    body = json.dumps(event).encode()
+    return body, {"Content-Type": "application/json", "X-Webhook-Signature": sign_payload(body, settings.WEBHOOK_SECRET)}
+
+
+async def deliver_webhook(body: bytes, headers: dict):
+    await asyncio.sleep(random.uniform(0, settings.GATEWAY_SIM_WEBHOOK_MAX_DELAY_MS) / 1000)
+    try:
+        await webhook_client.post(settings.GATEWAY_SIM_WEBHOOK_URL, content=body, headers=headers)
+    except httpx.HTTPError as ex:
+        logger.warning(f"Webhook delivery failed: {ex}")
+
+
+def emit_webhook(payment: dict):
+    if not settings.GATEWAY_SIM_WEBHOOK_URL:
+        return
+    body, headers = build_webhook(payment)
+    deliveries = 2 if random.random() < settings.GATEWAY_SIM_WEBHOOK_DUPLICATE_RATE else 1
+    # each delivery sleeps independently, which is what reorders them
+    for _ in range(deliveries):
+        asyncio.create_task(deliver_webhook(body, headers))
+
+
+async def settle(order_id: str) -> dict:
+    latency_ms = settings.GATEWAY_SIM_LATENCY_MEDIAN_MS * math.exp(random.gauss(0, settings.GATEWAY_SIM_LATENCY_SIGMA))
+    await asyncio.sleep(latency_ms / 1000)
+    return {
+        "payment_id": f"pay_{uuid4().hex}",
+        "order_id": order_id,
+        "status": "failed" if random.random() < settings.GATEWAY_SIM_DECLINE_RATE else "succeeded",
+    }
+
+
+@app.post("/v1/payments")
+async def charge(data: ChargeRequest, idempotency_key: str = Header(..., alias="Idempotency-Key")):
+    if idempotency_key in payments:
+        return payments[idempotency_key]
+    if random.random() < settings.GATEWAY_SIM_ERROR_RATE:
+        # nothing recorded, the caller may retry with the same key
+        raise HTTPException(status_code=503, detail="Gateway unavailable")
+
+    # concurrent calls with one key share a single charge
+    task = in_flight.get(idempotency_key)
+    if task is None:
+        task = in_flight[idempotency_key] = asyncio.create_task(settle(data.order_id))
+    try:
+        payment = await task
+    finally:
+        in_flight.pop(idempotency_key, None)
+    if idempotency_key not in payments:
+        payments[idempotency_key] = payment
+        emit_webhook(payment)
+    return payments[idempotency_key]
+
+
+@app.get("/v1/payments/{idempotency_key}")
+async def get_payment(idempotency_key: str):
+    if idempotency_key not in payments:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    return payments[idempotency_key]
@@ -42,5 +42,9 @@ async def redis_client():
         socket_connect_timeout=2)
 
     yield redis
+    # rate limit buckets are global, not per sale, so no test fixture owns them
+    keys = await redis.keys("ratelimit:*")
+    if keys:
+        await redis.delete(*keys)
     await redis.aclose()
 
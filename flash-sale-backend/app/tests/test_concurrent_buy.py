@@ -2,6 +2,7 @@ import pytest
 from app.services.inventory import inventory_service
 from app.schemas.buy import BuyRequest
 from app.exception import OutOfStockException, UserAlreadyPurchasedException
+from app.services.redis_metrics import redis_metrics
 import asyncio
 
 
@@ -19,8 +20,7 @@ async def setup_inventory(redis_client):
     await redis_client.set(inventory_key, initial_quantity)
     yield {"flash_sale_id": flash_sale_id, "product_id": product_id, "initial_quantity": initial_quantity, "user_ids": user_ids}
 
-    await redis_client.delete(inventory_key)
-    keys = await redis_client.keys(f"flashsale:{{{flash_sale_id}:{product_id}}}:user:*")
+    keys = await redis_client.keys(f"flashsale:{{{flash_sale_id}:{product_id}}}:*")
     if keys:
         await redis_client.delete(*keys)
 
@@ -84,3 +84,45 @@ async def test_same_user_concurrent_buy(redis_client, setup_inventory):
     assert len(successful_results) == 1, f"Expected 1 successful result, got {len(successful_results)}. Results: {successful_results}"
     assert len(failed_results) == 1, f"Expected 1 failed result, got {len(failed_results)}. Results: {failed_results}"
     assert failed_results[0]["error"] == "user_already_purchased", f"Expected user_already_purchased error, got {failed_results[0]['error']}. Results: {failed_results}"
+
+
+async def test_same_request_id_retry_returns_original_order(redis_client, setup_inventory):
+    """
+    Test: a client retrying with the same request id gets the original order back instead of UserAlreadyPurchasedException.
+    """
+    flash_sale_id = setup_inventory["flash_sale_id"]
+    product_id = setup_inventory["product_id"]
+    user_id = setup_inventory["user_ids"][0]
+    data = BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id=user_id, request_id="req-1")
+
+    first = await inventory_service.reserve_inventory(data, redis=redis_client)
+    retry = await inventory_service.reserve_inventory(data, redis=redis_client)
+
+    assert retry["order_id"] == first["order_id"], f"Expected retry to return order {first['order_id']}, got {retry['order_id']}"
+    stock = await redis_client.get(f"flashsale:{{{flash_sale_id}:{product_id}}}:stock")
+    assert int(stock) == setup_inventory["initial_quantity"] - 1, f"Expected retry not to decrement stock again, got {stock}"
+
+    with pytest.raises(UserAlreadyPurchasedException):
+        await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id=user_id, request_id="req-2"), redis=redis_client)
+
+
+async def test_concurrent_buys_share_one_script_call(redis_client, setup_inventory):
+    """
+    Test: buys for one product arriving together are reserved in a single Redis call and still never oversell.
+    """
+    flash_sale_id = setup_inventory["flash_sale_id"]
+    product_id = setup_inventory["product_id"]
+    redis_metrics.rotate()
+
+    results = await asyncio.gather(*[
+        inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id=f"batch_user_{i}"), redis=redis_client)
+        for i in range(50)
+    ], return_exceptions=True)
+
+    reserved = [result for result in results if isinstance(result, dict)]
+    sold_out = [result for result in results if isinstance(result, OutOfStockException)]
+    assert len(reserved) == setup_inventory["initial_quantity"], f"Expected {setup_inventory['initial_quantity']} reservations, got {len(reserved)}"
+    assert len(sold_out) == 50 - len(reserved)
+    assert redis_metrics.latencies["reserve"].calls == 1, f"Expected one script call, got {redis_metrics.latencies['reserve'].calls}"
+    stock = await redis_client.get(f"flashsale:{{{flash_sale_id}:{product_id}}}:stock")
+    assert int(stock) == 0
@@ -0,0 +1,38 @@
+import pytest
+from app.exception import UserNotEligibleException
+from app.schemas.buy import BuyRequest
+from app.services.eligibility import eligibility_service
+from app.services.inventory import inventory_service, prefix_tag_for
+
+
+@pytest.fixture
+async def setup_inventory(redis_client):
+    flash_sale_id = 5555
+    product_ids = [1, 2]
+    for product_id in product_ids:
+        await redis_client.set(f"{prefix_tag_for(flash_sale_id, product_id)}:stock", 10)
+    yield {"flash_sale_id": flash_sale_id, "product_ids": product_ids}
+
+    for product_id in product_ids:
+        keys = await redis_client.keys(f"{prefix_tag_for(flash_sale_id, product_id)}:*")
+        if keys:
+            await redis_client.delete(*keys)
+
+
+async def test_only_eligible_users_can_reserve(redis_client, setup_inventory):
+    """
+    Test: with an eligibility list loaded, listed users reserve on every product and others are refused without touching stock.
+    """
+    flash_sale_id = setup_inventory["flash_sale_id"]
+    product_ids = setup_inventory["product_ids"]
+    await eligibility_service.load_eligibility(flash_sale_id, product_ids, [f"member_{i}" for i in range(100)], redis_client)
+
+    for product_id in product_ids:
+        await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="member_7"), redis=redis_client)
+        with pytest.raises(UserNotEligibleException):
+            await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="stranger"), redis=redis_client)
+        stock = await redis_client.get(f"{prefix_tag_for(flash_sale_id, product_id)}:stock")
+        assert int(stock) == 9, f"Expected only the member's reservation to take stock, got {stock}"
+
+    await eligibility_service.clear_eligibility(flash_sale_id, product_ids, redis_client)
+    await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_ids[0], user_id="stranger"), redis=redis_client)
@@ -0,0 +1,114 @@
+import pytest
+from app.services.inventory import inventory_service
+from app.schemas.buy import BuyRequest
+from app.schemas.restore_inventory_request import RestoreInventoryRequest
+from app.exception import UserAlreadyPurchasedException
+
+
+@pytest.fixture
+async def setup_inventory(redis_client):
+    """
+    Setup inventory for the test.
+    """
+    flash_sale_id = 2222
+    product_id = 654321
+    prefix_tag = f"flashsale:{{{flash_sale_id}:{product_id}}}"
+    await redis_client.set(f"{prefix_tag}:stock", 2)
+    yield {"flash_sale_id": flash_sale_id, "product_id": product_id, "prefix_tag": prefix_tag}
+
+    keys = await redis_client.keys(f"{prefix_tag}:*")
+    if keys:
+        await redis_client.delete(*keys)
+
+
+async def test_sweeper_returns_expired_holds_and_skips_confirmed(redis_client, setup_inventory):
+    """
+    Test: expired holds give their unit back and free the user, confirmed orders keep theirs.
+    """
+    flash_sale_id = setup_inventory["flash_sale_id"]
+    product_id = setup_inventory["product_id"]
+    prefix_tag = setup_inventory["prefix_tag"]
+
+    expired = await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="user_expired"), redis=redis_client)
+    confirmed = await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="user_confirmed"), redis=redis_client)
+    assert await inventory_service.confirm_hold(flash_sale_id, product_id, confirmed["order_id"], redis_client)
+
+    # push both holds into the past
+    await redis_client.zadd(f"{prefix_tag}:holds", {expired["order_id"]: 0})
+    await redis_client.zadd(f"{prefix_tag}:holds", {confirmed["order_id"]: 0}, xx=True)
+
+    await inventory_service.sweep_expired_holds(redis_client)
+
+    assert int(await redis_client.get(f"{prefix_tag}:stock")) == 1, "Expected only the unconfirmed hold to be returned"
+    assert await redis_client.zcard(f"{prefix_tag}:holds") == 0
+
+    # the swept user can buy again, the confirmed one can't
+    await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="user_expired"), redis=redis_client)
+    with pytest.raises(UserAlreadyPurchasedException):
+        await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="user_confirmed"), redis=redis_client)
+
+
+async def test_release_hold_restores_once(redis_client, setup_inventory):
+    """
+    Test: a failed payment and the sweeper racing on the same hold restore the unit only once.
+    """
+    flash_sale_id = setup_inventory["flash_sale_id"]
+    product_id = setup_inventory["product_id"]
+    prefix_tag = setup_inventory["prefix_tag"]
+
+    reserved = await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="user_failed"), redis=redis_client)
+
+    assert await inventory_service.release_hold(flash_sale_id, product_id, reserved["order_id"], redis_client)
+    assert not await inventory_service.release_hold(flash_sale_id, product_id, reserved["order_id"], redis_client)
+    await inventory_service.sweep_expired_holds(redis_client)
+
+    assert int(await redis_client.get(f"{prefix_tag}:stock")) == 2
+
+
+async def test_bulk_restore_respects_holds(redis_client, setup_inventory):
+    """
+    Test: bulk restore gives back explicit quantities, held and confirmed orders, but not orders the sweeper already returned.
+    """
+    flash_sale_id = setup_inventory["flash_sale_id"]
+    product_id = setup_inventory["product_id"]
+    prefix_tag = setup_inventory["prefix_tag"]
+
+    held = await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="user_held"), redis=redis_client)
+    confirmed = await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="user_confirmed"), redis=redis_client)
+    await inventory_service.confirm_hold(flash_sale_id, product_id, confirmed["order_id"], redis_client)
+
+    stock = await inventory_service.bulk_restore_inventory(
+        [RestoreInventoryRequest(flash_sale_id=flash_sale_id, product_id=product_id, quantity=5)],
+        [
+            {"flash_sale_id": flash_sale_id, "product_id": product_id, "order_id": held["order_id"], "was_confirmed": False},
+            {"flash_sale_id": flash_sale_id, "product_id": product_id, "order_id": confirmed["order_id"], "was_confirmed": True},
+            {"flash_sale_id": flash_sale_id, "product_id": product_id, "order_id": "already-swept", "was_confirmed": False},
+        ],
+        redis_client,
+    )
+
+    assert stock == [{"flash_sale_id": flash_sale_id, "product_id": product_id, "stock": 7}], f"Unexpected stock levels: {stock}"
+    assert await redis_client.exists(f"{prefix_tag}:user:user_held") == 0
+
+
+async def test_bulk_restore_replay_gives_orders_back_once(redis_client, setup_inventory):
+    """
+    Test: replaying a restore whose DB update failed doesn't give the same orders back twice.
+    """
+    flash_sale_id = setup_inventory["flash_sale_id"]
+    product_id = setup_inventory["product_id"]
+    prefix_tag = setup_inventory["prefix_tag"]
+
+    held = await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="user_held"), redis=redis_client)
+    confirmed = await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="user_confirmed"), redis=redis_client)
+    await inventory_service.confirm_hold(flash_sale_id, product_id, confirmed["order_id"], redis_client)
+    orders = [
+        {"flash_sale_id": flash_sale_id, "product_id": product_id, "order_id": held["order_id"], "was_confirmed": False},
+        {"flash_sale_id": flash_sale_id, "product_id": product_id, "order_id": confirmed["order_id"], "was_confirmed": True},
+    ]
+
+    await inventory_service.bulk_restore_inventory([], orders, redis_client)
+    stock = await inventory_service.bulk_restore_inventory([], orders, redis_client)
+
+    assert stock == [{"flash_sale_id": flash_sale_id, "product_id": product_id, "stock": 2}], f"Unexpected stock levels: {stock}"
+    assert await redis_client.scard(f"{prefix_tag}:cancelled") == 2
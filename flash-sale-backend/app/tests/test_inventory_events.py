@@ -0,0 +1,89 @@
+from contextlib import asynccontextmanager
+import pytest
+from sqlalchemy.dialects import postgresql
+from app.core.config import settings
+from app.exception import OutOfStockException
+from app.schemas.buy import BuyRequest
+from app.services.inventory import inventory_service, prefix_tag_for, user_hash
+from app.services.inventory_events import parse_stream_entries, InventoryEventService
+
+
+@pytest.fixture
+async def setup_inventory(redis_client):
+    flash_sale_id = 4444
+    product_id = 123456
+    await redis_client.set(f"{prefix_tag_for(flash_sale_id, product_id)}:stock", 1)
+    yield {"flash_sale_id": flash_sale_id, "product_id": product_id}
+
+    keys = await redis_client.keys(f"{prefix_tag_for(flash_sale_id, product_id)}:*")
+    if keys:
+        await redis_client.delete(*keys)
+
+
+async def test_reservation_outcomes_are_streamed(redis_client, setup_inventory):
+    """
+    Test: reserve, sold-out and release each leave one event in the product's stream, linked by order id.
+    """
+    flash_sale_id = setup_inventory["flash_sale_id"]
+    product_id = setup_inventory["product_id"]
+
+    reserved = await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="user_0"), redis=redis_client)
+    with pytest.raises(OutOfStockException):
+        await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="user_1"), redis=redis_client)
+    await inventory_service.release_hold(flash_sale_id, product_id, reserved["order_id"], redis_client)
+
+    key = f"{prefix_tag_for(flash_sale_id, product_id)}:events"
+    rows = parse_stream_entries(key, await redis_client.xrange(key))
+
+    assert [row["outcome"] for row in rows] == ["reserved", "sold_out", "released"]
+    assert rows[0]["user_hash"] == user_hash("user_0")
+    assert rows[1]["user_hash"] == user_hash("user_1")
+    assert rows[0]["order_id"] == rows[2]["order_id"] == reserved["order_id"]
+    assert all(row["flash_sale_id"] == flash_sale_id and row["product_id"] == product_id for row in rows)
+
+
+class RecordingSession:
+    """Stands in for the DB session: keeps the stream ids of every inserted row, or fails on demand."""
+
+    def __init__(self, stored: list, fail: bool):
+        self.stored = stored
+        self.fail = fail
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    @asynccontextmanager
+    async def begin(self):
+        yield
+
+    async def execute(self, statement):
+        if self.fail:
+            raise ConnectionError("db down")
+        params = statement.compile(dialect=postgresql.dialect()).params
+        self.stored += [value for name, value in params.items() if name.startswith("stream_id")]
+
+
+async def test_consumer_rereads_pending_entries_and_drains_the_stream(redis_client, setup_inventory, monkeypatch):
+    """
+    Test: entries of a failed store are read again on the next pass, and a stream longer than one batch is drained in one call.
+    """
+    monkeypatch.setattr(settings, "INVENTORY_EVENT_BATCH_SIZE", 2)
+    key = f"{prefix_tag_for(setup_inventory['flash_sale_id'], setup_inventory['product_id'])}:events"
+    for i in range(5):
+        await redis_client.xadd(key, {"o": "sold_out", "u": f"user-{i}"})
+    service = InventoryEventService(group="test-consumer")
+    stored, fail = [], True
+    monkeypatch.setattr("app.services.inventory_events.async_session_factory", lambda: RecordingSession(stored, fail))
+
+    with pytest.raises(ConnectionError):
+        await service.consume(redis_client)
+    assert key in service.pending_streams
+
+    fail = False
+    assert await service.consume(redis_client) == 5
+    assert sorted(stored) == sorted(entry_id.decode() for entry_id, _ in await redis_client.xrange(key))
+    assert (await redis_client.xpending(key, "test-consumer"))["pending"] == 0
+    assert await service.consume(redis_client) == 0
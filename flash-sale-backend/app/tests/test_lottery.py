@@ -0,0 +1,78 @@
+import pytest
+from app.services.inventory import inventory_service
+from app.services.lottery import lottery_service
+from app.schemas.buy import BuyRequest
+from app.exception import LotteryAllocationException, LotteryClosedException
+
+
+@pytest.fixture
+async def setup_lottery(redis_client):
+    """
+    Setup a lottery-allocated product with 3 units.
+    """
+    flash_sale_id = 3333
+    product_id = 777
+    prefix_tag = f"flashsale:{{{flash_sale_id}:{product_id}}}"
+    await redis_client.set(f"{prefix_tag}:stock", 3)
+    await lottery_service.open_lottery(flash_sale_id, product_id, redis_client, window_seconds=60)
+    yield {"flash_sale_id": flash_sale_id, "product_id": product_id, "prefix_tag": prefix_tag}
+
+    keys = await redis_client.keys(f"{prefix_tag}:*")
+    if keys:
+        await redis_client.delete(*keys)
+
+
+async def test_draw_allocates_stock_once(redis_client, setup_lottery):
+    """
+    Test: the draw hands out exactly the available stock, each winner gets a hold, everyone else lost.
+    """
+    flash_sale_id = setup_lottery["flash_sale_id"]
+    product_id = setup_lottery["product_id"]
+    prefix_tag = setup_lottery["prefix_tag"]
+    user_ids = [f"user_{i}" for i in range(10)]
+
+    for user_id in user_ids:
+        await lottery_service.enter_lottery(flash_sale_id, product_id, user_id, redis_client)
+    again = await lottery_service.enter_lottery(flash_sale_id, product_id, user_ids[0], redis_client)
+    assert again["message"] == "Already entered"
+
+    with pytest.raises(LotteryAllocationException):
+        await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="user_fcfs"), redis=redis_client)
+    with pytest.raises(LotteryClosedException):
+        await lottery_service.draw_lottery(flash_sale_id, product_id, redis_client)
+
+    # close the entry window
+    await redis_client.hset(f"{prefix_tag}:lottery", "closes_at", 0)
+    drawn = await lottery_service.draw_lottery(flash_sale_id, product_id, redis_client)
+    assert drawn == {"winners": 3, "losers": 7}
+    assert int(await redis_client.get(f"{prefix_tag}:stock")) == 0
+    assert await redis_client.zcard(f"{prefix_tag}:holds") == 3
+
+    results = [await lottery_service.lottery_result(flash_sale_id, product_id, user_id, redis_client) for user_id in user_ids]
+    assert sum(1 for result in results if result["result"] == "won") == 3
+    assert sum(1 for result in results if result["result"] == "lost") == 7
+
+    with pytest.raises(LotteryClosedException):
+        await lottery_service.enter_lottery(flash_sale_id, product_id, "user_late", redis_client)
+    with pytest.raises(LotteryClosedException):
+        await lottery_service.draw_lottery(flash_sale_id, product_id, redis_client)
+
+
+async def test_units_returned_after_the_draw_sell_fcfs(redis_client, setup_lottery):
+    """
+    Test: once drawn, the lottery no longer blocks the product, so a winner's released unit can be bought.
+    """
+    flash_sale_id = setup_lottery["flash_sale_id"]
+    product_id = setup_lottery["product_id"]
+    prefix_tag = setup_lottery["prefix_tag"]
+
+    for user_id in ["user_a", "user_b", "user_c", "user_d"]:
+        await lottery_service.enter_lottery(flash_sale_id, product_id, user_id, redis_client)
+    await redis_client.hset(f"{prefix_tag}:lottery", "closes_at", 0)
+    await lottery_service.draw_lottery(flash_sale_id, product_id, redis_client)
+
+    winner_order_id = (await redis_client.hvals(f"{prefix_tag}:lottery:winners"))[0].decode()
+    assert await inventory_service.release_hold(flash_sale_id, product_id, winner_order_id, redis_client)
+
+    reserved = await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="user_fcfs"), redis=redis_client)
+    assert reserved["order_id"]
@@ -0,0 +1,69 @@
+import pytest
+from app.core.config import settings
+from app.services.order_retry import order_retry_service, RETRY_KEY, DEAD_LETTER_KEY, RETRY_ENTRY_FIELD
+
+
+@pytest.fixture
+async def clean_retry_queue(redis_client, monkeypatch):
+    monkeypatch.setattr(settings, "ORDER_RETRY_BASE_DELAY_SECONDS", 0)
+    await redis_client.delete(RETRY_KEY, DEAD_LETTER_KEY)
+    yield
+    await redis_client.delete(RETRY_KEY, DEAD_LETTER_KEY)
+
+
+async def test_failed_event_is_retried_then_dead_lettered(redis_client, clean_retry_queue):
+    """
+    Test: a failing event comes back from the retry queue with its attempt count, and is dead-lettered once out of attempts.
+    """
+    event = {"order_id": "order-1", "flash_sale_id": 1, "product_id": 2, "status": "PENDING"}
+
+    for attempt in range(1, settings.ORDER_RETRY_MAX_ATTEMPTS + 1):
+        assert await order_retry_service.schedule_retry(event, "db down", redis_client)
+        due = await order_retry_service.claim_due(redis_client)
+        assert len(due) == 1, f"Expected the event to be due, got {due}"
+        event = due[0]
+        assert event["attempts"] == attempt
+
+    assert not await order_retry_service.schedule_retry(event, "db down", redis_client)
+    assert await order_retry_service.claim_due(redis_client) == []
+    dead = await order_retry_service.dead_letters(redis_client)
+    assert [item["order_id"] for item in dead] == ["order-1"]
+    assert dead[0]["last_error"] == "db down"
+
+
+async def test_event_is_not_due_before_its_backoff(redis_client, clean_retry_queue, monkeypatch):
+    monkeypatch.setattr(settings, "ORDER_RETRY_BASE_DELAY_SECONDS", 60)
+    await order_retry_service.schedule_retry({"order_id": "order-2"}, "timeout", redis_client)
+    assert await order_retry_service.claim_due(redis_client) == []
+    assert await redis_client.zcard(RETRY_KEY) == 1
+
+
+async def test_claimed_event_stays_queued_until_acked(redis_client, clean_retry_queue, monkeypatch):
+    """
+    Test: a claimed retry is hidden for the visibility timeout, comes back if never acked (worker crash), and is gone once acked.
+    """
+    await order_retry_service.schedule_retry({"order_id": "order-3"}, "gateway 503", redis_client)
+    claimed = await order_retry_service.claim_due(redis_client)
+    assert [event["order_id"] for event in claimed] == ["order-3"]
+    assert await order_retry_service.claim_due(redis_client) == [], "Expected the claimed event to be hidden"
+    assert await redis_client.zcard(RETRY_KEY) == 1, "Expected the claimed event to stay in the zset"
+
+    monkeypatch.setattr(settings, "ORDER_RETRY_VISIBILITY_TIMEOUT_SECONDS", 0)
+    await redis_client.zadd(RETRY_KEY, {claimed[0][RETRY_ENTRY_FIELD]: 0})
+    reclaimed = await order_retry_service.claim_due(redis_client)
+    assert [event["order_id"] for event in reclaimed] == ["order-3"], "Expected an unacked event to be handed out again"
+
+    await order_retry_service.ack(reclaimed[0], redis_client)
+    assert await redis_client.zcard(RETRY_KEY) == 0
+
+
+async def test_rescheduling_a_claimed_event_replaces_its_entry(redis_client, clean_retry_queue):
+    """
+    Test: failing a claimed retry again swaps its zset entry for the next attempt instead of leaving both behind.
+    """
+    await order_retry_service.schedule_retry({"order_id": "order-4"}, "db down", redis_client)
+    [event] = await order_retry_service.claim_due(redis_client)
+    assert await order_retry_service.schedule_retry(event, "db down", redis_client)
+    assert await redis_client.zcard(RETRY_KEY) == 1
+    [event] = await order_retry_service.claim_due(redis_client)
+    assert event["attempts"] == 2
@@ -0,0 +1,37 @@
+import asyncio
+import httpx
+import pytest
+from app.api.v1.routes_webhook import verify_signature
+from app.core.config import settings
+from app.simulator import payment_gateway
+
+
+@pytest.fixture
+async def gateway(monkeypatch):
+    monkeypatch.setattr(settings, "GATEWAY_SIM_LATENCY_MEDIAN_MS", 5)
+    monkeypatch.setattr(settings, "GATEWAY_SIM_ERROR_RATE", 0)
+    monkeypatch.setattr(settings, "GATEWAY_SIM_WEBHOOK_URL", "")
+    payment_gateway.payments.clear()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=payment_gateway.app), base_url="http://gateway") as client:
+        yield client
+
+
+async def test_same_idempotency_key_charges_once(gateway):
+    """
+    Test: concurrent and repeated calls with one idempotency key get the same payment back.
+    """
+    async def charge():
+        response = await gateway.post("/v1/payments", json={"order_id": "order-1"}, headers={"Idempotency-Key": "order-1"})
+        return response.json()
+
+    results = await asyncio.gather(*[charge() for _ in range(5)])
+    results.append(await charge())
+
+    assert len({result["payment_id"] for result in results}) == 1, f"Expected one payment, got {results}"
+    assert len(payment_gateway.payments) == 1
+
+
+def test_webhook_signature_is_accepted_by_webhook_route():
+    body, headers = payment_gateway.build_webhook({"payment_id": "pay_1", "order_id": "order-1", "status": "failed"})
+    assert verify_signature(body, headers["X-Webhook-Signature"], settings.WEBHOOK_SECRET)
+    assert b'"payment.failed"' in body
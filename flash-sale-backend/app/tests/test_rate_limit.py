@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+from app.core.config import settings
+from app.exception import RateLimitedException
+from app.schemas.buy import BuyRequest
+from app.services.inventory import inventory_service
+from app.services.rate_limiter import LocalTokenBucket
+
+
+@pytest.fixture
+async def setup_inventory(redis_client):
+    flash_sale_id = 3333
+    product_id = 123456
+    await redis_client.set(f"flashsale:{{{flash_sale_id}:{product_id}}}:stock", 1000)
+    yield {"flash_sale_id": flash_sale_id, "product_id": product_id}
+
+    keys = await redis_client.keys(f"flashsale:{{{flash_sale_id}:*}}:*")
+    if keys:
+        await redis_client.delete(*keys)
+
+
+async def test_ip_burst_is_throttled(redis_client, setup_inventory):
+    """
+    Test: one IP buying for many accounts gets 429 once its burst is spent, and stock is only taken for allowed requests.
+    """
+    flash_sale_id = setup_inventory["flash_sale_id"]
+    product_id = setup_inventory["product_id"]
+
+    results = await asyncio.gather(*[
+        inventory_service.reserve_inventory(
+            BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id=f"bot_{i}", client_ip="10.0.0.1"),
+            redis=redis_client)
+        for i in range(settings.RATE_LIMIT_IP_BURST + 10)
+    ], return_exceptions=True)
+    accepted = sum(1 for result in results if isinstance(result, dict))
+    throttled = sum(1 for result in results if isinstance(result, RateLimitedException))
+
+    # the bucket refills while the loop runs, so a few extra requests may get through
+    assert accepted >= settings.RATE_LIMIT_IP_BURST, f"Expected at least {settings.RATE_LIMIT_IP_BURST} accepted, got {accepted}"
+    assert throttled > 0, "Expected the IP to be throttled after its burst"
+    stock = await redis_client.get(f"flashsale:{{{flash_sale_id}:{product_id}}}:stock")
+    assert int(stock) == 1000 - accepted, f"Expected throttled requests to leave stock alone, got {stock}"
+
+
+async def test_ip_limit_is_shared_across_products(redis_client, setup_inventory):
+    """
+    Test: one IP spreading its buys over two products draws on a single budget, so it is throttled even though neither product alone exceeds the burst.
+    """
+    flash_sale_id = setup_inventory["flash_sale_id"]
+    product_id = setup_inventory["product_id"]
+    other_product_id = product_id + 1
+    await redis_client.set(f"flashsale:{{{flash_sale_id}:{other_product_id}}}:stock", 1000)
+
+    results = await asyncio.gather(*[
+        inventory_service.reserve_inventory(
+            BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id if i % 2 else other_product_id,
+                       user_id=f"bot_{i}", client_ip="10.0.0.2"),
+            redis=redis_client)
+        for i in range(settings.RATE_LIMIT_IP_BURST + 10)
+    ], return_exceptions=True)
+
+    accepted = sum(1 for result in results if isinstance(result, dict))
+    throttled = sum(1 for result in results if isinstance(result, RateLimitedException))
+    assert throttled > 0, "Expected the IP to be throttled across products"
+    stocks = [int(await redis_client.get(f"flashsale:{{{flash_sale_id}:{pid}}}:stock")) for pid in (product_id, other_product_id)]
+    assert sum(stocks) == 2000 - accepted, f"Expected throttled requests to leave stock alone, got {stocks}"
+
+
+def test_local_token_bucket_refuses_when_empty():
+    bucket = LocalTokenBucket(rate=0.001, burst=3, max_clients=2)
+    assert [bucket.allow("a") for _ in range(4)] == [True, True, True, False]
+    # evicting the oldest client resets its bucket
+    bucket.allow("b")
+    bucket.allow("c")
+    assert bucket.allow("a")
+
+
+async def test_retry_of_a_reserved_request_is_not_throttled(redis_client, setup_inventory):
+    """
+    Test: a user over their rate limit still gets the original order_id back when retrying a request that was reserved.
+    """
+    flash_sale_id = setup_inventory["flash_sale_id"]
+    product_id = setup_inventory["product_id"]
+    first = await inventory_service.reserve_inventory(
+        BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="user_retry", request_id="req-1"), redis=redis_client)
+
+    results = await asyncio.gather(*[
+        inventory_service.reserve_inventory(
+            BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="user_retry", request_id=f"other-{i}"), redis=redis_client)
+        for i in range(settings.RATE_LIMIT_USER_BURST + 5)
+    ], return_exceptions=True)
+    assert any(isinstance(result, RateLimitedException) for result in results), "Expected the user to be throttled"
+
+    retried = await inventory_service.reserve_inventory(
+        BuyRequest(flash_sale_id=flash_sale_id, product_id=product_id, user_id="user_retry", request_id="req-1"), redis=redis_client)
+    assert retried["order_id"] == first["order_id"]
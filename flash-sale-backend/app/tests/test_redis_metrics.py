@@ -0,0 +1,28 @@
+from app.services.redis_metrics import SpaceSaving
+
+
+def test_space_saving_keeps_heavy_hitters():
+    """
+    Test: a key dominating the traffic stays at the top even when the sketch is much smaller than the key space.
+    """
+    sketch = SpaceSaving(capacity=8)
+    for i in range(2000):
+        sketch.offer("flashsale:{1:42}:stock")
+        sketch.offer(f"flashsale:{{1:{i}}}:stock")
+
+    (top_key, count, error), = sketch.top(1)
+    assert top_key == "flashsale:{1:42}:stock"
+    assert count - error <= 2001 <= count, f"Expected the true count inside [{count - error}, {count}]"
+
+
+def test_hot_key_route_leaves_the_stored_report_untouched():
+    """
+    Test: annotating the last window with each key's node builds new dicts instead of writing into the shared report.
+    """
+    from app.api.v1.routes_admin import _with_shard
+
+    report = {"window_seconds": 30, "hot_keys": [{"key": "flashsale:{1:42}:stock", "estimated_count": 7}]}
+    annotated = _with_shard(report)
+
+    assert "node" in annotated["hot_keys"][0]
+    assert report["hot_keys"][0] == {"key": "flashsale:{1:42}:stock", "estimated_count": 7}
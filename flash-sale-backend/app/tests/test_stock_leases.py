@@ -0,0 +1,111 @@
+import pytest
+from app.core.config import settings
+from app.exception import OutOfStockException, UserAlreadyPurchasedException
+from app.schemas.buy import BuyRequest
+from app.services.inventory import inventory_service, prefix_tag_for, StockLeases, LUA_SCRIPT_CLAIM_LEASE
+from app.services.redis_metrics import redis_metrics
+
+
+@pytest.fixture
+async def setup_inventory(redis_client, monkeypatch):
+    monkeypatch.setattr(settings, "STOCK_LEASE_ENABLED", True)
+    monkeypatch.setattr(settings, "STOCK_LEASE_CHUNK", 10)
+    monkeypatch.setattr(settings, "STOCK_LEASE_ENDGAME_UNITS", 0)
+    leases = StockLeases()
+    monkeypatch.setattr("app.services.inventory.stock_leases", leases)
+    flash_sale_id = 7777
+    product_id = 1
+    prefix_tag = prefix_tag_for(flash_sale_id, product_id)
+    await redis_client.set(f"{prefix_tag}:stock", 100)
+    yield {"flash_sale_id": flash_sale_id, "product_id": product_id, "prefix_tag": prefix_tag, "leases": leases}
+
+    keys = await redis_client.keys(f"{prefix_tag}:*")
+    if keys:
+        await redis_client.delete(*keys)
+
+
+def buy(setup_inventory, user_id, **kwargs):
+    return BuyRequest(flash_sale_id=setup_inventory["flash_sale_id"], product_id=setup_inventory["product_id"], user_id=user_id, **kwargs)
+
+
+async def test_buys_are_served_from_a_lease(redis_client, setup_inventory):
+    """
+    Test: buys take a chunk off the central counter once, sell from it, and the unused rest goes back.
+    """
+    leases, prefix_tag = setup_inventory["leases"], setup_inventory["prefix_tag"]
+
+    for i in range(3):
+        await inventory_service.reserve_inventory(buy(setup_inventory, f"user_{i}"), redis=redis_client)
+    with pytest.raises(UserAlreadyPurchasedException):
+        await inventory_service.reserve_inventory(buy(setup_inventory, "user_0"), redis=redis_client)
+
+    assert int(await redis_client.get(f"{prefix_tag}:stock")) == 90, "Expected one chunk taken from the counter"
+    assert int(await redis_client.hget(f"{prefix_tag}:leases", leases.instance_id)) == 7
+    assert leases.leases[prefix_tag].units == 7, "Expected the rejected buyer's unit back in the lease"
+
+    assert await leases.return_idle(redis_client, return_all=True) == 7
+    assert int(await redis_client.get(f"{prefix_tag}:stock")) == 97
+
+
+async def test_duplicate_purchase_is_caught_across_instances(redis_client, setup_inventory, monkeypatch):
+    """
+    Test: a user who bought from one instance's lease is refused by another instance with its own lease.
+    """
+    await inventory_service.reserve_inventory(buy(setup_inventory, "user_a"), redis=redis_client)
+    other = StockLeases()
+    monkeypatch.setattr("app.services.inventory.stock_leases", other)
+
+    with pytest.raises(UserAlreadyPurchasedException):
+        await inventory_service.reserve_inventory(buy(setup_inventory, "user_a"), redis=redis_client)
+    assert other.leases[setup_inventory["prefix_tag"]].units == 10
+
+
+async def test_sold_out_is_answered_in_process(redis_client, setup_inventory):
+    """
+    Test: once the counter and the lease are empty, further buyers are refused without a reservation call, but retries still replay.
+    """
+    prefix_tag = setup_inventory["prefix_tag"]
+    await redis_client.set(f"{prefix_tag}:stock", 2)
+    first = await inventory_service.reserve_inventory(buy(setup_inventory, "user_0", request_id="req-0"), redis=redis_client)
+    await inventory_service.reserve_inventory(buy(setup_inventory, "user_1"), redis=redis_client)
+    with pytest.raises(OutOfStockException):
+        await inventory_service.reserve_inventory(buy(setup_inventory, "user_2"), redis=redis_client)
+
+    redis_metrics.rotate()
+    for i in range(3, 10):
+        with pytest.raises(OutOfStockException):
+            await inventory_service.reserve_inventory(buy(setup_inventory, f"user_{i}"), redis=redis_client)
+    assert "reserve" not in redis_metrics.latencies and "claim_lease" not in redis_metrics.latencies
+
+    retried = await inventory_service.reserve_inventory(buy(setup_inventory, "user_0", request_id="req-0"), redis=redis_client)
+    assert retried["order_id"] == first["order_id"]
+
+
+async def test_reclaimed_lease_is_never_sold(redis_client, setup_inventory):
+    """
+    Test: after the keeper reclaims a live instance's lease, its local units are refused by Redis and the buyer is sold from the counter.
+    """
+    leases, prefix_tag = setup_inventory["leases"], setup_inventory["prefix_tag"]
+    await inventory_service.reserve_inventory(buy(setup_inventory, "user_0"), redis=redis_client)
+    await redis_client.zadd(f"{prefix_tag}:leases:expiry", {leases.instance_id: 0})
+    assert await StockLeases().reclaim_orphaned(redis_client) == 9
+    assert leases.leases[prefix_tag].units == 9
+
+    await inventory_service.reserve_inventory(buy(setup_inventory, "user_1"), redis=redis_client)
+
+    leased = int(await redis_client.hget(f"{prefix_tag}:leases", leases.instance_id) or 0)
+    stock = int(await redis_client.get(f"{prefix_tag}:stock"))
+    assert stock + leased == 98, f"Expected two units sold in total, counter {stock} and lease {leased}"
+
+
+async def test_orphaned_lease_is_reclaimed(redis_client, setup_inventory):
+    """
+    Test: a lease whose instance stopped renewing it goes back to the counter.
+    """
+    prefix_tag = setup_inventory["prefix_tag"]
+    await redis_client.eval(LUA_SCRIPT_CLAIM_LEASE, 1, prefix_tag, "dead-instance", 10, 0, 5)
+    assert int(await redis_client.get(f"{prefix_tag}:stock")) == 90
+
+    assert await StockLeases().reclaim_orphaned(redis_client) >= 10
+    assert int(await redis_client.get(f"{prefix_tag}:stock")) == 100
+    assert await redis_client.hget(f"{prefix_tag}:leases", "dead-instance") is None
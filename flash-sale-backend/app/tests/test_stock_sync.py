@@ -0,0 +1,97 @@
+import pytest
+from app.schemas.buy import BuyRequest
+from app.core.config import settings
+from app.services.inventory import LUA_SCRIPT_BUILD_STOCK_GENERATION, LUA_SCRIPT_SWITCH_STOCK_GENERATION, inventory_service, prefix_tag_for
+from app.services.stock_sync import StockSyncService, build_stock_update
+
+
+@pytest.fixture
+async def setup_inventory(redis_client):
+    flash_sale_id = 6666
+    keys = [f"flashsale:{{{flash_sale_id}:{product_id}}}:stock" for product_id in range(3)]
+    for key in keys:
+        await redis_client.set(key, 10)
+    yield {"flash_sale_id": flash_sale_id, "keys": keys}
+    for product_id in range(3):
+        leftovers = await redis_client.keys(f"flashsale:{{{flash_sale_id}:{product_id}}}:*")
+        if leftovers:
+            await redis_client.delete(*leftovers)
+
+
+async def collect_rows(service, redis_client, flash_sale_id):
+    rows = [row async for batch in service.collect(redis_client) for row in batch]
+    return sorted(row for row in rows if row[0] == flash_sale_id)
+
+
+async def test_only_changed_stock_is_written_again(redis_client, setup_inventory):
+    """
+    Test: after a flush, only products whose stock moved are sent again.
+    """
+    flash_sale_id = setup_inventory["flash_sale_id"]
+    service = StockSyncService()
+
+    first = await collect_rows(service, redis_client, flash_sale_id)
+    assert first == [(flash_sale_id, 0, 10), (flash_sale_id, 1, 10), (flash_sale_id, 2, 10)]
+    service.mark_written(first)
+
+    assert await collect_rows(service, redis_client, flash_sale_id) == []
+    await redis_client.decr(setup_inventory["keys"][1])
+    assert await collect_rows(service, redis_client, flash_sale_id) == [(flash_sale_id, 1, 9)]
+
+
+def test_batch_update_is_one_statement():
+    statement, params = build_stock_update([(1, 2, 3), (1, 4, 5)])
+    assert str(statement).count("UPDATE") == 1
+    assert params == {"s0": 1, "p0": 2, "r0": 3, "s1": 1, "p1": 4, "r1": 5}
+
+
+async def test_reload_switches_stock_generation(redis_client, setup_inventory):
+    """
+    Test: a reload swaps every product to its new stock at once and leaves the old generation to expire.
+    """
+    flash_sale_id = setup_inventory["flash_sale_id"]
+    prefix_tag = prefix_tag_for(flash_sale_id, 0)
+    await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=0, user_id="user_0"), redis=redis_client)
+
+    generation = await inventory_service.load_stock_generation([(flash_sale_id, 0, 50), (flash_sale_id, 1, 60)], redis_client)
+
+    assert await inventory_service.get_stock(flash_sale_id, 0, redis_client) == 50
+    assert await inventory_service.get_stock(flash_sale_id, 1, redis_client) == 60
+    assert await redis_client.ttl(f"{prefix_tag}:stock") > 0, "Expected the replaced generation to be left to expire"
+    assert await redis_client.ttl(f"{prefix_tag}:stock:{generation}") == -1
+
+    await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=0, user_id="user_1"), redis=redis_client)
+    assert await inventory_service.get_stock(flash_sale_id, 0, redis_client) == 49
+    rows = await collect_rows(StockSyncService(), redis_client, flash_sale_id)
+    assert (flash_sale_id, 0, 49) in rows and len([row for row in rows if row[1] == 0]) == 1
+
+
+async def test_reload_during_a_sale_keeps_sold_units(redis_client, setup_inventory):
+    """
+    Test: a keep_live reload leaves sold units sold and only seeds products missing from Redis.
+    """
+    flash_sale_id = setup_inventory["flash_sale_id"]
+    await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=0, user_id="user_0"), redis=redis_client)
+    await redis_client.delete(setup_inventory["keys"][2])
+
+    await inventory_service.load_stock_generation([(flash_sale_id, 0, 10), (flash_sale_id, 2, 7)], redis_client, keep_live=True)
+
+    assert await inventory_service.get_stock(flash_sale_id, 0, redis_client) == 9
+    assert await inventory_service.get_stock(flash_sale_id, 2, redis_client) == 7
+
+
+async def test_switch_carries_buys_made_after_the_build(redis_client, setup_inventory):
+    """
+    Test: units sold on the old generation between the build and the flip are taken off the new one.
+    """
+    flash_sale_id = setup_inventory["flash_sale_id"]
+    prefix_tag = prefix_tag_for(flash_sale_id, 0)
+    baseline = await redis_client.eval(LUA_SCRIPT_BUILD_STOCK_GENERATION, 1, prefix_tag, "1", 50,
+                                       settings.STOCK_GENERATION_GRACE_SECONDS, "0")
+    await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=0, user_id="user_0"), redis=redis_client)
+    await inventory_service.reserve_inventory(BuyRequest(flash_sale_id=flash_sale_id, product_id=0, user_id="user_1"), redis=redis_client)
+
+    await redis_client.eval(LUA_SCRIPT_SWITCH_STOCK_GENERATION, 1, prefix_tag, "1",
+                            settings.STOCK_GENERATION_GRACE_SECONDS, *baseline)
+
+    assert await inventory_service.get_stock(flash_sale_id, 0, redis_client) == 48
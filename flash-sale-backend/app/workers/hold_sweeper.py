@@ -0,0 +1,22 @@
+import asyncio
+import logging
+from app.core.config import settings
+from app.redis import redis_client
+from app.services.inventory import inventory_service
+
+logger = logging.getLogger(__name__)
+
+
+async def hold_sweeper():
+    """
+    Periodically return stock held by reservations that never reached a confirmed order.
+    """
+    while True:
+        try:
+            released = await inventory_service.sweep_expired_holds(redis_client)
+            if released:
+                logger.info(f"Released {released} expired holds")
+        except Exception as ex:
+            # keep sweeping on the next tick, a missed pass only delays the restore
+            logger.error(f"Hold sweep failed: {ex}", exc_info=True)
+        await asyncio.sleep(settings.HOLD_SWEEP_INTERVAL_SECONDS)
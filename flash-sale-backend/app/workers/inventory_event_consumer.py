@@ -0,0 +1,22 @@
+import asyncio
+import logging
+from app.core.config import settings
+from app.redis import redis_client
+from app.services.inventory_events import inventory_event_service
+
+logger = logging.getLogger(__name__)
+
+
+async def inventory_event_consumer():
+    """
+    Periodically move inventory events from the Redis streams into the analytics table.
+    """
+    while True:
+        try:
+            stored = await inventory_event_service.consume(redis_client)
+            if stored:
+                logger.info(f"Stored {stored} inventory events")
+        except Exception as ex:
+            # unacked entries stay pending and are read again on the next pass
+            logger.error(f"Inventory event consumer failed: {ex}", exc_info=True)
+        await asyncio.sleep(settings.INVENTORY_EVENT_FLUSH_INTERVAL_SECONDS)
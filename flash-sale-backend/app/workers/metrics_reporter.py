@@ -0,0 +1,24 @@
+import asyncio
+import logging
+from app.core.config import settings
+from app.services.redis_metrics import redis_metrics
+
+logger = logging.getLogger(__name__)
+
+# last completed window, served by the admin API next to the live one
+last_report: dict = {}
+
+
+async def metrics_reporter():
+    """
+    Periodically log the top-K hot inventory keys and per-script Redis latency.
+    """
+    global last_report
+    while True:
+        await asyncio.sleep(settings.HOT_KEY_REPORT_INTERVAL_SECONDS)
+        last_report = redis_metrics.rotate()
+        if last_report["hot_keys"]:
+            hottest = ", ".join(f"{item['key']}~{item['estimated_count']}" for item in last_report["hot_keys"][:5])
+            logger.info(f"Hot inventory keys over {last_report['window_seconds']}s: {hottest}")
+        for script, latency in last_report["scripts"].items():
+            logger.info(f"Redis {script}: {latency}")
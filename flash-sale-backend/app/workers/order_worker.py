@@ -1,3 +1,5 @@
+import asyncio
+import logging
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql import text, update
 from app.services.order_queue import order_queue
@@ -5,25 +7,34 @@ from app.db.session import async_session_factory
 from app.db.models.order import Order, OrderStatus
 from app.services.payment import payment_service
 from app.services.inventory import inventory_service
-from app.schemas.restore_inventory_request import RestoreInventoryRequest
+from app.services.order_retry import order_retry_service, backoff_delay, RETRY_ENTRY_FIELD
+from app.core.config import settings
+from app.redis import redis_client
 
+logger = logging.getLogger(__name__)
 
 insert_order_sql = """
-INSERT INTO orders (order_id, flash_sale_id, product_id, status, created_at, updated_at) VALUES (:order_id, :flash_sale_id, :product_id, :status, NOW(), NOW())
+INSERT INTO "order" (order_id, flash_sale_id, product_id, status, created_at, updated_at) VALUES (:order_id, :flash_sale_id, :product_id, :status, NOW(), NOW())
 ON CONFLICT (order_id) DO NOTHING
 """
 
 update_order_to_payment_in_progress_sql = """
-UPDATE orders SET status = 'PAYMENT_IN_PROGRESS', updated_at = NOW() WHERE order_id = :order_id and status = 'PENDING'
+UPDATE "order" SET status = 'PAYMENT_IN_PROGRESS', updated_at = NOW() WHERE order_id = :order_id and status = 'PENDING'
+RETURNING order_id
 """
 
 
+select_order_status_sql = """
+SELECT status FROM "order" WHERE order_id = :order_id
+"""
+
 update_order_to_payment_success_sql = """
-UPDATE orders SET status = 'CONFIRMED', updated_at = NOW() WHERE order_id = :order_id and status = 'PAYMENT_IN_PROGRESS'
+UPDATE "order" SET status = 'CONFIRMED', updated_at = NOW() WHERE order_id = :order_id and status = 'PAYMENT_IN_PROGRESS'
 """
 
 update_order_to_payment_failed_sql = """
-UPDATE orders SET status = 'FAILED', updated_at = NOW() WHERE order_id = :order_id and status = 'PAYMENT_IN_PROGRESS'
+UPDATE "order" SET status = 'FAILED', updated_at = NOW() WHERE order_id = :order_id and status = 'PAYMENT_IN_PROGRESS'
+RETURNING order_id
 """
 
 # Notes:
@@ -37,57 +48,99 @@ UPDATE orders SET status = 'FAILED', updated_at = NOW() WHERE order_id = :order_
 
 # Webhook callback updates order status
 
-# Order status guard prevents re-payment
+# Order status guard prevents re-payment, and a replay resumes from the stored status
+
+
+async def process_order_event(event: dict):
+    """
+    Drive one order to a terminal state. A replayed event resumes from the order's current
+    status instead of starting over, so a failure anywhere below is safe to retry.
+    """
+    async with async_session_factory() as db:
+        # if event is replayed, nothing happens in this insert operation.
+        await db.execute(text(insert_order_sql), {
+            "order_id": event['order_id'],
+            "flash_sale_id": event['flash_sale_id'],
+            "product_id": event['product_id'],
+            "status": event['status'],
+        })
+        await db.commit()  # if worker crashes here, order will be in PENDING state
+    async with async_session_factory() as db:
+        # if event is replayed, nothing happens in this update operation if order is not in PENDING state.
+        result = await db.execute(text(update_order_to_payment_in_progress_sql), {
+            "order_id": event['order_id'],
+        })
+        row = result.fetchone()
+        status = OrderStatus.PAYMENT_IN_PROGRESS.value
+        if row is None:
+            # replay, or someone else already processed this order: pick up where it stopped
+            status = (await db.execute(text(select_order_status_sql), {"order_id": event['order_id']})).scalar_one()
+        await db.commit()
+    if status == OrderStatus.CONFIRMED.value:
+        # the confirm may have committed before confirm_hold failed; without it the sweeper sells the unit twice
+        await inventory_service.confirm_hold(event['flash_sale_id'], event['product_id'], event['order_id'], redis_client)
+        return
+    if status != OrderStatus.PAYMENT_IN_PROGRESS.value:
+        # FAILED, CANCELLED or EXPIRED: stock was already given back on the way there
+        return
+    # a replay lands here too and re-asks the gateway with the same idempotency key,
+    # which returns the original result instead of charging twice.
+    payment_result = await payment_service.process_payment(event['order_id'], idempotency_key=event['order_id'])
+    async with async_session_factory() as db:
+        if (not payment_result):
+            result = await db.execute(text(update_order_to_payment_failed_sql), {
+                "order_id": event['order_id'],
+            })
+            row = result.fetchone()
+            if row is not None:
+                # Someone else already processed this order
+                await inventory_service.release_hold(event['flash_sale_id'], event['product_id'], event['order_id'], redis_client)
+            await db.commit()
+        else:
+            await db.execute(text(update_order_to_payment_success_sql), {
+                "order_id": event['order_id'],
+            })
+            await db.commit()
+            # confirmed in time: stop the hold sweeper from returning this unit
+            await inventory_service.confirm_hold(event['flash_sale_id'], event['product_id'], event['order_id'], redis_client)
+
+
+async def retry_in_process(event: dict, error: str):
+    """
+    Last resort when Redis cannot take the retry: keep the event in memory and put it back
+    on the queue after its backoff. Lost on restart, but never dropped while the process lives.
+    """
+    attempts = event.get("attempts", 0) + 1
+    if attempts > settings.ORDER_RETRY_MAX_ATTEMPTS:
+        # the hold is never confirmed, so the hold sweeper gives the stock back
+        logger.error(f"Order event {event['order_id']} dropped after {attempts} attempts: {error}")
+        return
+    await asyncio.sleep(backoff_delay(attempts))
+    await order_queue.put({**event, "attempts": attempts, "last_error": error})
 
 
 async def order_worker():
     while True:
         event = await order_queue.get()
         try:
-            async with async_session_factory() as db:
-                # if event is replayed, nothing happens in this insert operation.
-                await db.execute(text(insert_order_sql, {
-                    "order_id": event['order_id'],
-                    "flash_sale_id": event['flash_sale_id'],
-                    "product_id": event['product_id'],
-                    "status": event['status'],
-                }))
-                await db.commit()  # if worker crashes here, order will be in PENDING state
-            async with async_session_factory() as db:
-                # if event is replayed, nothing happens in this update operation if order is not in PENDING state.
-                result = await db.execute(text(update_order_to_payment_in_progress_sql, {
-                    "order_id": event['order_id'],
-                }))
-                row = result.fetchone()
-                await db.commit()
-                if row is None:
-                    # Someone else already processed this order
-                    continue
-                # if worker crashes after db.commit(), order will be in PAYMENT_IN_PROGRESS state.
-                # this state will hanging as request will never reach payment gateway. and there is no way payment gateway will update the order status via webhook.
-                # we need reaper job to handle this state. clean up these orders and restore inventory.
-            payment_result = await payment_service.process_payment(event['order_id'], idempotency_key=event['order_id'])
-            # if worker crashes after payment_result, order will be in PAYMENT_IN_PROGRESS state.
-            # since request reached payment gateway, payment gateway will update the order status via webhook.
-            async with async_session_factory() as db:
-                if (not payment_result):
-                    result = await db.execute(text(update_order_to_payment_failed_sql, {
-                        "order_id": event['order_id'],
-                    }))
-                    row = result.fetchone()
-                    if row is not None:
-                        # Someone else already processed this order
-                        await inventory_service.restore_inventory(RestoreInventoryRequest(product_id=event['product_id'], flash_sale_id=event['flash_sale_id'], quantity=1))
-                    await db.commit()
-                else:
-                    await db.execute(text(update_order_to_payment_success_sql, {
-                        "order_id": event['order_id'],
-                    }))
-                    await db.commit()
+            await process_order_event(event)
         except Exception as ex:
-            # should i do stock rollback here?
-            # or should i do retries?
-            pass
+            # Retry later from the delayed queue instead of blocking this loop.
+            logger.warning(f"Order event {event['order_id']} failed (attempt {event.get('attempts', 0) + 1}): {ex}")
+            try:
+                if not await order_retry_service.schedule_retry(event, str(ex), redis_client):
+                    logger.error(f"Order event {event['order_id']} dead-lettered after {event.get('attempts', 0) + 1} attempts")
+            except Exception as retry_ex:
+                logger.error(f"Could not schedule retry for order {event['order_id']}: {retry_ex}", exc_info=True)
+                if not event.get(RETRY_ENTRY_FIELD):
+                    # a claimed retry comes due again on its own after the visibility timeout
+                    asyncio.create_task(retry_in_process(event, str(ex)))
+        else:
+            try:
+                await order_retry_service.ack(event, redis_client)
+            except Exception as ack_ex:
+                # the retry comes due again and replays as a no-op
+                logger.warning(f"Could not ack retry for order {event['order_id']}: {ack_ex}")
         finally:
             order_queue.task_done()
 
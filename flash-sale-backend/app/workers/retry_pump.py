@@ -0,0 +1,22 @@
+import asyncio
+import logging
+from app.core.config import settings
+from app.redis import redis_client
+from app.services.order_retry import order_retry_service
+
+logger = logging.getLogger(__name__)
+
+
+async def retry_pump():
+    """
+    Periodically feed failed order events whose backoff has elapsed back to the order worker.
+    """
+    while True:
+        try:
+            requeued = await order_retry_service.requeue_due(redis_client)
+            if requeued:
+                logger.info(f"Requeued {requeued} order events for retry")
+        except Exception as ex:
+            # due events stay in the zset, the next tick picks them up
+            logger.error(f"Retry pump failed: {ex}", exc_info=True)
+        await asyncio.sleep(settings.ORDER_RETRY_PUMP_INTERVAL_SECONDS)
@@ -0,0 +1,22 @@
+import asyncio
+import logging
+from app.core.config import settings
+from app.redis import redis_client
+from app.services.stock_sync import stock_sync_service
+
+logger = logging.getLogger(__name__)
+
+
+async def stock_flusher():
+    """
+    Periodically persist changed Redis stock counters to flashsaleproduct.remaining_stock.
+    """
+    while True:
+        try:
+            written = await stock_sync_service.flush(redis_client)
+            if written:
+                logger.debug(f"Flushed remaining stock for {written} products")
+        except Exception as ex:
+            # nothing is marked written, the next pass sends the same rows again
+            logger.error(f"Stock flush failed: {ex}", exc_info=True)
+        await asyncio.sleep(settings.STOCK_SYNC_INTERVAL_SECONDS)
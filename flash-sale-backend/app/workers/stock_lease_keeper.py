@@ -0,0 +1,24 @@
+import asyncio
+import logging
+from app.core.config import settings
+from app.redis import redis_client
+from app.services.inventory import stock_leases
+
+logger = logging.getLogger(__name__)
+
+
+async def stock_lease_keeper():
+    """
+    Periodically renew this instance's stock leases, give back the unused ones and reclaim the leases of dead instances.
+    """
+    while True:
+        await asyncio.sleep(settings.STOCK_LEASE_TTL_SECONDS / 3)
+        try:
+            await stock_leases.renew(redis_client)
+            returned = await stock_leases.return_idle(redis_client)
+            reclaimed = await stock_leases.reclaim_orphaned(redis_client)
+            if returned or reclaimed:
+                logger.info(f"Stock leases: returned {returned} units, reclaimed {reclaimed} from dead instances")
+        except Exception as ex:
+            # leases stay recorded in Redis, nothing is lost by skipping a pass
+            logger.error(f"Stock lease keeper failed: {ex}", exc_info=True)
@@ -1,12 +1,30 @@
-from fastapi import APIRouter, Depends, Header
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.core import get_db_session
 from app.schemas.wallet import CreateWalletRequest
-from app.schemas.transaction import CreditRequest, DebitRequest, TransferRequest
+from app.schemas.transaction import BulkTransferRequest, BulkTransferStatus, CreditRequest, DebitRequest, TransferRequest
 from app.crud.wallet_service import wallet_crud_service
-from app.schemas.wallet import WalletResponse, BalanceResponse
+from app.crud.bulk_transfer_service import bulk_transfer_crud_service
+from app.crud.plpgsql_wallet_service import plpgsql_wallet_service
+from app.crud.statement_service import statement_crud_service
+from app.services.group_commit_service import group_commit_engine
+from app.schemas.wallet import WalletResponse, BalanceResponse, SystemBalanceResponse, BalanceVerificationResponse, BalanceAtResponse
+from app.schemas.ledger_entry import LedgerEntryPage
+from app.core.config import settings
 router = APIRouter(prefix="/wallets")
 
+# no control characters: bulk transfers build their per-item keys with one (see item_idempotency_key)
+IDEMPOTENCY_KEY_PATTERN = r"^[^\x00-\x1f\x7f]+$"
+
+
+def money_movement_service():
+    # WALLET_ENGINE: the ORM path, or one PL/pgSQL function call per request
+    return plpgsql_wallet_service if settings.WALLET_ENGINE == "plpgsql" else wallet_crud_service
+
 
 @router.post("/", response_model=WalletResponse)
 async def create_wallet(request: CreateWalletRequest, db_session: AsyncSession = Depends(get_db_session)):
@@ -15,6 +33,13 @@ async def create_wallet(request: CreateWalletRequest, db_session: AsyncSession =
     return wallet
 
 
+# declared before /{wallet_id} so "system" isn't taken for a wallet id
+@router.get("/system/balance", response_model=SystemBalanceResponse)
+async def get_system_balance(db_session: AsyncSession = Depends(get_db_session)):
+    balance = await wallet_crud_service.get_system_balance(db_session=db_session)
+    return SystemBalanceResponse(balance=balance, buckets=settings.SYSTEM_ACCOUNT_BUCKETS)
+
+
 @router.get("/{wallet_id}", response_model=WalletResponse)
 async def get_wallet(wallet_id: str, db_session: AsyncSession = Depends(get_db_session)):
     wallet = await wallet_crud_service.get_wallet(walletId=wallet_id, db_session=db_session)
@@ -27,23 +52,72 @@ async def get_wallet_balance(wallet_id: str, db_session: AsyncSession = Depends(
     return BalanceResponse(account_id=wallet_id, balance=balance)
 
 
+@router.get("/{wallet_id}/balance/verify", response_model=BalanceVerificationResponse)
+async def verify_wallet_balance(wallet_id: str, db_session: AsyncSession = Depends(get_db_session)):
+    verification = await wallet_crud_service.verify_balance(walletId=wallet_id, db_session=db_session)
+    return verification
+
+
+@router.get("/{wallet_id}/balance/at", response_model=BalanceAtResponse)
+async def get_wallet_balance_at(wallet_id: str, time: datetime, db_session: AsyncSession = Depends(get_db_session)):
+    balance = await wallet_crud_service.get_balance_at(walletId=wallet_id, at=time, db_session=db_session)
+    return balance
+
+
+@router.get("/{wallet_id}/entries", response_model=LedgerEntryPage)
+async def get_wallet_entries(wallet_id: str,
+                             limit: int = Query(50, ge=1, le=500),
+                             cursor: Optional[str] = None,
+                             from_time: Optional[datetime] = None,
+                             to_time: Optional[datetime] = None,
+                             db_session: AsyncSession = Depends(get_db_session)):
+    page = await statement_crud_service.get_entries(walletId=wallet_id, db_session=db_session, limit=limit, cursor=cursor,
+                                                    from_time=from_time, to_time=to_time)
+    return page
+
+
+@router.get("/{wallet_id}/entries/export")
+async def export_wallet_entries(wallet_id: str,
+                                from_time: Optional[datetime] = None,
+                                to_time: Optional[datetime] = None,
+                                db_session: AsyncSession = Depends(get_db_session)):
+    chunks = await statement_crud_service.export_entries(walletId=wallet_id, db_session=db_session,
+                                                         from_time=from_time, to_time=to_time)
+    return StreamingResponse(chunks, media_type="text/csv",
+                             headers={"Content-Disposition": f'attachment; filename="statement-{wallet_id}.csv"'})
+
+
 @router.post("/{wallet_id}/credit")
 async def credit_wallet(wallet_id: str,
                         request: CreditRequest,
                         idempotency_key: str = Header(...,
-                                                      alias="Idempotency-Key"),
+                                                      alias="Idempotency-Key",
+                                                      pattern=IDEMPOTENCY_KEY_PATTERN),
                         db_session: AsyncSession = Depends(get_db_session)):
-    response = await wallet_crud_service.credit_wallet(walletId=wallet_id, data=request, db_session=db_session, idempotency_key=idempotency_key)
+    if settings.WALLET_GROUP_COMMIT_ENABLED:
+        return await group_commit_engine.credit_wallet(walletId=wallet_id, data=request, idempotency_key=idempotency_key)
+    response = await money_movement_service().credit_wallet(walletId=wallet_id, data=request, db_session=db_session, idempotency_key=idempotency_key)
     return response
 
 
 @router.post("/{wallet_id}/debit")
-async def debit_wallet(wallet_id: str, request: DebitRequest, idempotency_key: str = Header(..., alias="Idempotency-Key"), db_session: AsyncSession = Depends(get_db_session)):
-    response = await wallet_crud_service.debit_wallet(wallet_id=wallet_id, data=request, db_session=db_session, idempotency_key=idempotency_key)
+async def debit_wallet(wallet_id: str, request: DebitRequest, idempotency_key: str = Header(..., alias="Idempotency-Key", pattern=IDEMPOTENCY_KEY_PATTERN), db_session: AsyncSession = Depends(get_db_session)):
+    if settings.WALLET_GROUP_COMMIT_ENABLED:
+        return await group_commit_engine.debit_wallet(wallet_id=wallet_id, data=request, idempotency_key=idempotency_key)
+    response = await money_movement_service().debit_wallet(wallet_id=wallet_id, data=request, db_session=db_session, idempotency_key=idempotency_key)
     return response
 
 
 @router.post("/transfer")
-async def transfer_wallet(request: TransferRequest, idempotency_key: str = Header(..., alias="Idempotency-Key"), db_session: AsyncSession = Depends(get_db_session)):
-    response = await wallet_crud_service.transfer_wallet(idempotency_key=idempotency_key, data=request, db_session=db_session)
+async def transfer_wallet(request: TransferRequest, idempotency_key: str = Header(..., alias="Idempotency-Key", pattern=IDEMPOTENCY_KEY_PATTERN), db_session: AsyncSession = Depends(get_db_session)):
+    response = await money_movement_service().transfer_wallet(idempotency_key=idempotency_key, data=request, db_session=db_session)
+    return response
+
+
+@router.post("/transfer/bulk")
+async def transfer_bulk(request: BulkTransferRequest, idempotency_key: str = Header(..., alias="Idempotency-Key", pattern=IDEMPOTENCY_KEY_PATTERN), db_session: AsyncSession = Depends(get_db_session)):
+    response = await bulk_transfer_crud_service.transfer_bulk(idempotency_key=idempotency_key, data=request, db_session=db_session)
+    if response["status"] == BulkTransferStatus.REJECTED:
+        # nothing was applied; the per-item results say which items failed
+        return JSONResponse(status_code=422, content=jsonable_encoder(response))
     return response
@@ -1,8 +1,15 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.responses import JSONResponse
 from app.core.config import settings
-from app.db.core import init_db
+from app.db.core import async_session_factory, init_db
+from app.services.group_commit_service import group_commit_engine
+from app.services.idempotency_cache import idempotency_cache
+from app.services.idempotency_service import idempotency_cutoff
+from app.services.system_account_service import ensure_system_buckets
+from app.workers.balance_snapshotter import balance_snapshotter
+from app.workers.partition_maintainer import maintain_partitions, partition_maintainer
 import app.api.routes_health as routes_health
 import app.api.routes_wallet as routes_wallet
 from app.core.exceptions import WalletError
@@ -12,9 +19,23 @@ from app.core.exceptions import WalletError
 async def lifespan(app: FastAPI):
     print("🚀 Starting up...")
     await init_db()
+    # inserts fail without a partition for today, so this runs before serving (one instance at a time)
+    await maintain_partitions()
+    partition_maintainer_task = asyncio.create_task(partition_maintainer())
+    balance_snapshotter_task = asyncio.create_task(balance_snapshotter()) if settings.BALANCE_SNAPSHOT_ENABLED else None
+    async with async_session_factory() as db_session:
+        await ensure_system_buckets(db_session)
+    # loading the saved keys can take a while; until it finishes every request checks the table
+    warm_idempotency_cache = asyncio.create_task(idempotency_cache.warm(async_session_factory, since=idempotency_cutoff()))
     yield  # App runs here
     # SHUTDOWN
     print("🛑 Shutting down...")
+    await group_commit_engine.drain()
+    warm_idempotency_cache.cancel()
+    partition_maintainer_task.cancel()
+    if balance_snapshotter_task:
+        balance_snapshotter_task.cancel()
+    await idempotency_cache.close()
 
 
 def create_app():
@@ -0,0 +1,140 @@
+import logging
+from uuid import uuid4
+from sqlalchemy import insert, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.exceptions import InsufficientBalanceError, WalletError, WalletFrozenError, WalletNotFoundError
+from app.models.idempotency_key import IdempotencyKey
+from app.models.ledger_entry import EntryType, LedgerEntry
+from app.models.transaction import Transaction, TransactionStatus, TransactionType
+from app.models.wallet_account import AccountStatus, WalletAccount
+from app.schemas.transaction import BulkTransferMode, BulkTransferRequest, BulkTransferStatus
+from app.services.balance_service import apply_balance_deltas
+from app.services.idempotency_service import check_cached_idempotency, check_idempotency, compute_request_hash, remember_idempotency, replay_idempotency
+
+# A bulk transfer applies a list of transfers under one Idempotency-Key, in one transaction:
+# one idempotency lookup, one ordered FOR UPDATE over every account involved, multi-row inserts
+# and one set-based balance UPDATE, instead of a round trip per statement per transfer.
+# Item i is recorded as a TRANSFER with idempotency key "<key>\x1f<i>". Two requests with the same key
+# can apply different item sets (the second one runs against balances the first moved), so their item
+# keys need not collide: each batch holds a transaction-level advisory lock on its key from before the
+# lookup until it commits, and a duplicate waits, then finds the saved response.
+# The separator is the ASCII unit separator, a control character the routes refuse in an Idempotency-Key,
+# so no client-chosen key (say a single transfer keyed "abc:0") can land on an item key.
+ITEM_KEY_SEPARATOR = "\x1f"
+
+
+def item_idempotency_key(idempotency_key: str, index: int) -> str:
+    return f"{idempotency_key}{ITEM_KEY_SEPARATOR}{index}"
+
+
+class BulkTransferCrudService:
+
+    async def transfer_bulk(self, idempotency_key: str, data: BulkTransferRequest, db_session: AsyncSession):
+        request_hash = compute_request_hash(data.model_dump(mode="json"))
+        cached_response = await check_cached_idempotency(idempotency_key=idempotency_key, request_hash=request_hash)
+        if cached_response:
+            return cached_response
+        try:
+            async with db_session.begin():
+                await db_session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"),
+                                         {"name": f"bulk_transfer:{idempotency_key}"})
+                # under the lock the table is the only word: the filter can't know a key another instance just saved
+                cached_response = await check_idempotency(idempotency_key=idempotency_key, request_hash=request_hash,
+                                                          db_session=db_session, trust_filter=False)
+                if cached_response:
+                    return cached_response
+
+                # lock every account in id order with a single statement (same order as transfers, so no deadlocks)
+                account_ids = {transfer.source_account_id for transfer in data.transfers} | {transfer.destination_account_id for transfer in data.transfers}
+                get_accounts_result = await db_session.execute(select(WalletAccount)
+                                                               .where(WalletAccount.id.in_(account_ids))
+                                                               .order_by(WalletAccount.id)
+                                                               .with_for_update())
+                accounts = {account.id: account for account in get_accounts_result.scalars()}
+
+                # validate and stage each item against the batch's running balances
+                balances = {account_id: account.cached_balance for account_id, account in accounts.items()}
+                results, transactions, ledger_entries = [], [], []
+                for index, transfer in enumerate(data.transfers):
+                    try:
+                        source = accounts.get(transfer.source_account_id)
+                        destination = accounts.get(transfer.destination_account_id)
+                        if source is None or destination is None:
+                            raise WalletNotFoundError()
+                        if source.status != AccountStatus.ACTIVE or destination.status != AccountStatus.ACTIVE:
+                            raise WalletFrozenError()
+                        if balances[source.id] < transfer.amount:
+                            raise InsufficientBalanceError()
+                    except WalletError as e:
+                        results.append({"index": index, "status": TransactionStatus.FAILED, "amount": transfer.amount, "error": e.message})
+                        continue
+                    transaction_id = uuid4()
+                    balances[source.id] -= transfer.amount
+                    balances[destination.id] += transfer.amount
+                    transactions.append({
+                        "id": transaction_id,
+                        "source_account_id": source.id,
+                        "destination_account_id": destination.id,
+                        "transaction_type": TransactionType.TRANSFER,
+                        "idempotency_key": item_idempotency_key(idempotency_key, index),
+                        "amount": transfer.amount,
+                        "status": TransactionStatus.COMPLETED,
+                    })
+                    ledger_entries.append({
+                        "account_id": source.id,
+                        "transaction_id": transaction_id,
+                        "amount": transfer.amount,
+                        "running_balance": balances[source.id],
+                        "entry_type": EntryType.DEBIT,
+                    })
+                    ledger_entries.append({
+                        "account_id": destination.id,
+                        "transaction_id": transaction_id,
+                        "amount": transfer.amount,
+                        "running_balance": balances[destination.id],
+                        "entry_type": EntryType.CREDIT,
+                    })
+                    results.append({"index": index, "status": TransactionStatus.COMPLETED, "amount": transfer.amount,
+                                    "transaction_id": str(transaction_id)})
+
+                failed = len(data.transfers) - len(transactions)
+                if not transactions or (failed and data.mode == BulkTransferMode.ALL_OR_NOTHING):
+                    # nothing is written and the key isn't saved, so the batch can be fixed and resent
+                    if data.mode == BulkTransferMode.ALL_OR_NOTHING:
+                        for result in results:
+                            if result["status"] == TransactionStatus.COMPLETED:
+                                result.pop("transaction_id")
+                                result["status"] = TransactionStatus.FAILED
+                                result["error"] = "Not applied: another item in the batch failed"
+                    return {"status": BulkTransferStatus.REJECTED, "mode": data.mode, "applied": 0, "failed": len(data.transfers), "results": results}
+
+                response = {
+                    "status": BulkTransferStatus.PARTIAL if failed else BulkTransferStatus.COMPLETED,
+                    "mode": data.mode,
+                    "applied": len(transactions),
+                    "failed": failed,
+                    "results": results,
+                }
+                await db_session.execute(insert(Transaction), transactions)
+                await db_session.execute(insert(LedgerEntry), ledger_entries)
+                await db_session.execute(insert(IdempotencyKey), [{"key": idempotency_key, "request_hash": request_hash, "request_json": response}])
+                await apply_balance_deltas({
+                    account_id: balance - accounts[account_id].cached_balance
+                    for account_id, balance in balances.items()
+                    if balance != accounts[account_id].cached_balance
+                }, db_session)
+            await remember_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, response=response)
+            return response
+        except IntegrityError:
+            # a duplicate of this batch committed first
+            return await replay_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, db_session=db_session)
+
+        except Exception as e:
+            logging.error(f"failed to apply bulk transfer: {e}", exc_info=True)
+            if isinstance(e, WalletError):
+                raise e
+            raise WalletError("failed to apply bulk transfer")
+
+
+bulk_transfer_crud_service = BulkTransferCrudService()
@@ -0,0 +1,83 @@
+import logging
+from uuid import UUID
+from sqlalchemy import BigInteger, func, literal, select
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.exceptions import IdempotencyConflictError, InsufficientBalanceError, WalletError, WalletFrozenError, WalletNotFoundError
+from app.schemas.transaction import CreditRequest, DebitRequest, TransferRequest
+from app.services.idempotency_service import check_cached_idempotency, compute_request_hash, idempotency_cutoff, remember_idempotency, replay_idempotency
+from app.services.system_account_service import system_bucket_for
+
+# WALLET_ENGINE=plpgsql: each money movement is one call to a function created by migration
+# 166b063cdaea (wallet_credit, wallet_debit, wallet_transfer), run as a single autocommit
+# statement. Idempotency check, ordered locking, balance checks, inserts and the saved
+# response all happen server side, so row locks are held for one statement instead of
+# across six or more client round trips. Responses and saved keys match the ORM path,
+# so the engine can be switched back and forth.
+
+# SQLSTATEs raised by the functions
+FUNCTION_ERRORS = {
+    "WL404": WalletNotFoundError,
+    "WL403": WalletFrozenError,
+    "WL422": InsufficientBalanceError,
+    "WL409": IdempotencyConflictError,
+}
+
+
+def wallet_uuid(wallet_id) -> UUID:
+    try:
+        return UUID(str(wallet_id))
+    except ValueError:
+        # not a UUID, so no such wallet
+        raise WalletNotFoundError()
+
+
+class PlpgsqlWalletService:
+
+    async def credit_wallet(self, walletId: UUID, idempotency_key: str, data: CreditRequest, db_session: AsyncSession):
+        request_hash = compute_request_hash(data.model_dump())
+        call = func.wallet_credit(wallet_uuid(walletId), literal(data.amount, BigInteger), idempotency_key, request_hash, idempotency_cutoff(),
+                                  system_bucket_for(idempotency_key), settings.SYSTEM_ACCOUNT_BUCKETS, type_=JSONB)
+        return await self._call("credit wallet", idempotency_key, request_hash, call, db_session)
+
+    async def debit_wallet(self, wallet_id: UUID, idempotency_key: str, data: DebitRequest, db_session: AsyncSession):
+        request_hash = compute_request_hash(data.model_dump())
+        call = func.wallet_debit(wallet_uuid(wallet_id), literal(data.amount, BigInteger), idempotency_key, request_hash, idempotency_cutoff(),
+                                 system_bucket_for(idempotency_key), settings.SYSTEM_ACCOUNT_BUCKETS, type_=JSONB)
+        return await self._call("debit wallet", idempotency_key, request_hash, call, db_session)
+
+    async def transfer_wallet(self, idempotency_key: str, data: TransferRequest, db_session: AsyncSession):
+        request_hash = compute_request_hash(data.model_dump())
+        call = func.wallet_transfer(data.source_account_id, data.destination_account_id, literal(data.amount, BigInteger), idempotency_key,
+                                    request_hash, idempotency_cutoff(), type_=JSONB)
+        return await self._call("transfer wallet", idempotency_key, request_hash, call, db_session)
+
+    async def _call(self, operation: str, idempotency_key: str, request_hash: str, call, db_session: AsyncSession):
+        cached_response = await check_cached_idempotency(idempotency_key=idempotency_key, request_hash=request_hash)
+        if cached_response:
+            return cached_response
+        try:
+            # the function is atomic on its own; autocommit saves the BEGIN and COMMIT round trips
+            await db_session.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+            response = (await db_session.execute(select(call))).scalar_one()
+            await remember_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, response=response)
+            return response
+        except IntegrityError:
+            # another request with this key committed first; the unique constraint is the source of truth
+            return await replay_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, db_session=db_session)
+        except DBAPIError as e:
+            error = FUNCTION_ERRORS.get(getattr(e.orig, "sqlstate", None))
+            if error is not None:
+                raise error()
+            logging.error(f"failed to {operation}: {e}", exc_info=True)
+            raise WalletError(f"failed to {operation}")
+        except WalletError as e:
+            raise e
+        except Exception as e:
+            logging.error(f"failed to {operation}: {e}", exc_info=True)
+            raise WalletError(f"failed to {operation}")
+
+
+plpgsql_wallet_service = PlpgsqlWalletService()
@@ -0,0 +1,98 @@
+import base64
+import csv
+import io
+import logging
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.exceptions import WalletError, WalletNotFoundError
+from app.crud.wallet_service import wallet_crud_service
+from app.db.core import async_session_factory
+from app.models.ledger_entry import LedgerEntry
+
+# Account statements, newest first, with keyset pagination on (account_id, created_at, id):
+# a page continues strictly after the last (created_at, id) it returned, so page 1000 costs
+# the same index range scan as page 1. The covering index
+# ix_ledger_entries_account_statement answers it without touching the heap.
+
+STATEMENT_COLUMNS = (LedgerEntry.id, LedgerEntry.transaction_id, LedgerEntry.entry_type,
+                     LedgerEntry.amount, LedgerEntry.running_balance, LedgerEntry.created_at)
+
+
+def encode_cursor(created_at: datetime, entry_id: UUID) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{entry_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    try:
+        created_at, entry_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), UUID(entry_id)
+    except Exception:
+        raise WalletError("Invalid cursor", status_code=400)
+
+
+def statement_query(wallet_id: UUID, from_time: Optional[datetime], to_time: Optional[datetime]):
+    query = (select(*STATEMENT_COLUMNS)
+             .where(LedgerEntry.account_id == wallet_id)
+             .order_by(LedgerEntry.created_at.desc(), LedgerEntry.id.desc()))
+    # bounds on created_at also prune the ledger partitions outside the range
+    if from_time is not None:
+        query = query.where(LedgerEntry.created_at >= from_time)
+    if to_time is not None:
+        query = query.where(LedgerEntry.created_at < to_time)
+    return query
+
+
+class StatementCrudService:
+    async def get_entries(self, walletId: UUID, db_session: AsyncSession, limit: int, cursor: Optional[str] = None,
+                          from_time: Optional[datetime] = None, to_time: Optional[datetime] = None):
+        wallet = await wallet_crud_service.get_wallet(walletId=walletId, db_session=db_session)
+        try:
+            query = statement_query(wallet.id, from_time, to_time)
+            if cursor:
+                created_at, entry_id = decode_cursor(cursor)
+                query = query.where(tuple_(LedgerEntry.created_at, LedgerEntry.id) < tuple_(created_at, entry_id))
+            # one extra row tells us whether there is a next page
+            result = await db_session.execute(query.limit(limit + 1))
+            rows = result.all()
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+            return {"entries": rows, "next_cursor": next_cursor}
+        except WalletError as e:
+            raise e
+        except Exception as e:
+            logging.error(f"failed to get ledger entries: {e}", exc_info=True)
+            raise WalletError("failed to get ledger entries")
+
+    async def export_entries(self, walletId: UUID, db_session: AsyncSession,
+                             from_time: Optional[datetime] = None, to_time: Optional[datetime] = None):
+        """Validate the wallet, then return an async generator of CSV chunks for the whole statement."""
+        wallet = await wallet_crud_service.get_wallet(walletId=walletId, db_session=db_session)
+        query = statement_query(wallet.id, from_time, to_time)
+
+        async def rows_as_csv():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(["id", "transaction_id", "entry_type", "amount", "running_balance", "created_at"])
+            # its own session: the request's session is closed once the response starts streaming
+            async with async_session_factory() as export_session:
+                # server-side cursor; only one batch of rows is held in memory at a time
+                result = await export_session.stream(query.execution_options(yield_per=1000))
+                async for partition in result.partitions():
+                    for row in partition:
+                        writer.writerow([row.id, row.transaction_id, row.entry_type.value, row.amount,
+                                         row.running_balance, row.created_at.isoformat()])
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+
+        return rows_as_csv()
+
+
+statement_crud_service = StatementCrudService()
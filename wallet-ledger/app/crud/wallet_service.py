@@ -1,6 +1,8 @@
 import logging
+from datetime import datetime
 from uuid import UUID
 from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.schemas.wallet import CreateWalletRequest
 from app.schemas.transaction import CreditRequest, DebitRequest, TransferRequest
@@ -9,8 +11,10 @@ from app.models.idempotency_key import IdempotencyKey
 from app.core.exceptions import InsufficientBalanceError, WalletError, WalletNotFoundError, WalletFrozenError
 from app.models.transaction import Transaction, TransactionStatus, TransactionType
 from app.models.ledger_entry import EntryType, LedgerEntry
-from app.services.idempotency_service import check_idempotency, save_idempotency, compute_request_hash
+from app.services.idempotency_service import REPLAYABLE_ERRORS, check_cached_idempotency, check_idempotency, compute_request_hash, remember_idempotency, replay_idempotency, replay_or_raise, save_idempotency
 from app.services.balance_service import optimistic_credit, optimistic_debit, optimistic_debit_system_account, optimistic_credit_system_account
+from app.services.system_account_service import get_system_balance, lock_system_bucket, system_bucket_for
+from app.services.snapshot_service import replay_balance
 
 
 class WalletCrudService:
@@ -56,11 +60,58 @@ class WalletCrudService:
             raise WalletError("failed to get balance")
         pass
 
+    async def verify_balance(self, walletId: UUID, db_session: AsyncSession):
+        try:
+            # one REPEATABLE READ snapshot, so cached_balance and the ledger are read at the same moment
+            await db_session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            wallet = await self.get_wallet(walletId=walletId, db_session=db_session)
+            replayed = await replay_balance(wallet.id, db_session)
+            return {
+                "account_id": wallet.id,
+                "cached_balance": wallet.cached_balance,
+                "ledger_balance": replayed["balance"],
+                "drift": wallet.cached_balance - replayed["balance"],
+                "snapshot_at": replayed["snapshot_at"],
+                "replayed_entries": replayed["replayed_entries"],
+            }
+        except WalletError as e:
+            raise e
+        except Exception as e:
+            logging.error(f"failed to verify balance: {e}", exc_info=True)
+            raise WalletError("failed to verify balance")
+
+    async def get_balance_at(self, walletId: UUID, at: datetime, db_session: AsyncSession):
+        try:
+            wallet = await self.get_wallet(walletId=walletId, db_session=db_session)
+            replayed = await replay_balance(wallet.id, db_session, at=at)
+            return {
+                "account_id": wallet.id,
+                "at": at,
+                "balance": replayed["balance"],
+                "snapshot_at": replayed["snapshot_at"],
+                "replayed_entries": replayed["replayed_entries"],
+            }
+        except WalletError as e:
+            raise e
+        except Exception as e:
+            logging.error(f"failed to get balance at {at}: {e}", exc_info=True)
+            raise WalletError("failed to get balance")
+
+    async def get_system_balance(self, db_session: AsyncSession):
+        try:
+            return await get_system_balance(db_session=db_session)
+        except Exception as e:
+            logging.error(f"failed to get system balance: {e}", exc_info=True)
+            raise WalletError("failed to get system balance")
+
     async def credit_wallet(self, walletId: UUID, idempotency_key: str, data: CreditRequest, db_session: AsyncSession):
+        request_hash = compute_request_hash(data.model_dump())
+        cached_response = await check_cached_idempotency(idempotency_key=idempotency_key, request_hash=request_hash)
+        if cached_response:
+            return cached_response
         try:
             async with db_session.begin():
                 # Step 1: Check idempotency FIRST (before locking -- it's just a read)
-                request_hash = compute_request_hash(data.model_dump())
                 cached_response = await check_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, db_session=db_session)
                 if cached_response:
                     return cached_response
@@ -74,12 +125,9 @@ class WalletCrudService:
 
                  # Step 3: You need a SYSTEM account as the source
                  #  (the money comes from somewhere)
-                 #  For now, you can query it or hardcode a known system account ID
+                 #  Lock one SYSTEM bucket, falling over to a free sibling if it is busy
 
-                get_system_account_result = await db_session.execute(select(WalletAccount).where(WalletAccount.account_type == AccountType.SYSTEM).with_for_update())
-                system_account = get_system_account_result.scalar_one_or_none()
-                if system_account is None:
-                    raise WalletNotFoundError()
+                system_account = await lock_system_bucket(bucket=system_bucket_for(idempotency_key), db_session=db_session)
 
                 # db_session.add(IdempotencyKey())
                 # Step 4: Create the Transaction
@@ -129,7 +177,13 @@ class WalletCrudService:
                 #     request_json=response,
                 # ))
                 await save_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, request_json=response, db_session=db_session)
+            await remember_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, response=response)
             return response
+        except IntegrityError:
+            # another request with this key committed first; the unique constraint is the source of truth
+            return await replay_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, db_session=db_session)
+        except REPLAYABLE_ERRORS as e:
+            return await replay_or_raise(idempotency_key=idempotency_key, request_hash=request_hash, error=e, db_session=db_session)
         except WalletError as e:
             raise e
         except Exception as e:
@@ -137,10 +191,13 @@ class WalletCrudService:
             raise WalletError("Failed to credit wallet")
 
     async def debit_wallet(self, wallet_id: UUID, idempotency_key: str, data: DebitRequest, db_session: AsyncSession):
+        request_hash = compute_request_hash(data.model_dump())
+        cached_response = await check_cached_idempotency(idempotency_key=idempotency_key, request_hash=request_hash)
+        if cached_response:
+            return cached_response
         try:
             async with db_session.begin():
                 # check idempotency
-                request_hash = compute_request_hash(data.model_dump())
                 cached_response = await check_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, db_session=db_session)
                 if cached_response:
                     return cached_response
@@ -154,10 +211,7 @@ class WalletCrudService:
                 if wallet.cached_balance < data.amount:
                     raise InsufficientBalanceError()
 
-                get_system_account_result = await db_session.execute(select(WalletAccount).where(WalletAccount.account_type == AccountType.SYSTEM))
-                system_account = get_system_account_result.scalar_one_or_none()
-                if system_account is None:
-                    raise WalletError("System account not found")
+                system_account = await lock_system_bucket(bucket=system_bucket_for(idempotency_key), db_session=db_session)
 
                 # create the transaction
                 transaction = Transaction(
@@ -200,7 +254,13 @@ class WalletCrudService:
                 # create idemoptency record
                 await save_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, request_json=response, db_session=db_session)
 
+            await remember_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, response=response)
             return response
+        except IntegrityError:
+            # another request with this key committed first; the unique constraint is the source of truth
+            return await replay_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, db_session=db_session)
+        except REPLAYABLE_ERRORS as e:
+            return await replay_or_raise(idempotency_key=idempotency_key, request_hash=request_hash, error=e, db_session=db_session)
 
         except Exception as e:
             logging.error(f"failed to debit wallet: {e}", exc_info=True)
@@ -209,10 +269,13 @@ class WalletCrudService:
             raise WalletError("failed to debit wallet")
 
     async def transfer_wallet(self, idempotency_key: str, data: TransferRequest, db_session: AsyncSession):
+        request_hash = compute_request_hash(data.model_dump())
+        cached_response = await check_cached_idempotency(idempotency_key=idempotency_key, request_hash=request_hash)
+        if cached_response:
+            return cached_response
         try:
             async with db_session.begin():
                 # check for idempotency
-                request_hash = compute_request_hash(data.model_dump())
                 cached_response = await check_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, db_session=db_session)
                 if cached_response:
                     return cached_response
@@ -292,7 +355,13 @@ class WalletCrudService:
                 }
                 # create the idempotency key
                 await save_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, request_json=response, db_session=db_session)
+            await remember_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, response=response)
             return response
+        except IntegrityError:
+            # another request with this key committed first; the unique constraint is the source of truth
+            return await replay_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, db_session=db_session)
+        except REPLAYABLE_ERRORS as e:
+            return await replay_or_raise(idempotency_key=idempotency_key, request_hash=request_hash, error=e, db_session=db_session)
 
         except Exception as e:
             logging.error(f"failed to transfer wallet {e}", exc_info=True)
@@ -301,16 +370,19 @@ class WalletCrudService:
             raise WalletError("failed to transfer wallet")
 
     async def credit_wallet_optimistic(self, walletId: UUID, idempotency_key: str, data: CreditRequest, db_session: AsyncSession):
+        request_hash = compute_request_hash(data.model_dump())
+        cached_response = await check_cached_idempotency(idempotency_key=idempotency_key, request_hash=request_hash)
+        if cached_response:
+            return cached_response
         try:
             async with db_session.begin():
                 # check idempency
-                request_hash = compute_request_hash(data.model_dump())
                 cached_response = await check_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, db_session=db_session)
                 if cached_response:
                     return cached_response
                 # credit the wallet
                 (new_balance, new_version) = await optimistic_credit(wallet_id=walletId, amount=data.amount, max_retries=3, db_session=db_session)
-                system_account_result = await optimistic_debit_system_account(amount=data.amount, max_retries=3, db_session=db_session)
+                system_account_result = await optimistic_debit_system_account(amount=data.amount, max_retries=3, db_session=db_session, bucket=system_bucket_for(idempotency_key))
                 # create the transaction
                 transaction = Transaction(
                     source_account_id=system_account_result["system_account_id"],
@@ -346,7 +418,13 @@ class WalletCrudService:
                 }
                 # create the idempotency key
                 await save_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, request_json=response, db_session=db_session)
+            await remember_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, response=response)
             return response
+        except IntegrityError:
+            # another request with this key committed first; the unique constraint is the source of truth
+            return await replay_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, db_session=db_session)
+        except REPLAYABLE_ERRORS as e:
+            return await replay_or_raise(idempotency_key=idempotency_key, request_hash=request_hash, error=e, db_session=db_session)
         except WalletError as e:
             raise e
         except Exception as e:
@@ -355,16 +433,19 @@ class WalletCrudService:
             raise WalletError("failed to credit wallet optimistic")
 
     async def debit_wallet_optimistic(self, wallet_id: UUID, idempotency_key: str, data: DebitRequest, db_session: AsyncSession):
+        request_hash = compute_request_hash(data.model_dump())
+        cached_response = await check_cached_idempotency(idempotency_key=idempotency_key, request_hash=request_hash)
+        if cached_response:
+            return cached_response
         try:
             async with db_session.begin():
                 # check idempency
-                request_hash = compute_request_hash(data.model_dump())
                 cached_response = await check_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, db_session=db_session)
                 if cached_response:
                     return cached_response
                 # debit the wallet
                 (new_balance, new_version) = await optimistic_debit(wallet_id=wallet_id, amount=data.amount, max_retries=3, db_session=db_session)
-                system_account_result = await optimistic_credit_system_account(amount=data.amount, max_retries=3, db_session=db_session)
+                system_account_result = await optimistic_credit_system_account(amount=data.amount, max_retries=3, db_session=db_session, bucket=system_bucket_for(idempotency_key))
                 # create the transaction
                 transaction = Transaction(
                     source_account_id=wallet_id,
@@ -399,7 +480,13 @@ class WalletCrudService:
                 }
                 # create the idempotency key
                 await save_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, request_json=response, db_session=db_session)
+            await remember_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, response=response)
             return response
+        except IntegrityError:
+            # another request with this key committed first; the unique constraint is the source of truth
+            return await replay_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, db_session=db_session)
+        except REPLAYABLE_ERRORS as e:
+            return await replay_or_raise(idempotency_key=idempotency_key, request_hash=request_hash, error=e, db_session=db_session)
         except WalletError as e:
             raise e
         except Exception as e:
@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from app.core.config import settings
 from app.db.base import Base
@@ -29,4 +31,26 @@ async def get_db_session():
 
 async def init_db():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
+
+
+@asynccontextmanager
+async def advisory_lock(name: str, wait: bool = True):
+    """
+    Hold a session-level Postgres advisory lock for a job only one instance may run at a time.
+    wait=False yields False instead of blocking when another instance holds it.
+    """
+    async with engine.connect() as conn:
+        # outside a transaction, so holding the lock pins no snapshot
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        if wait:
+            await conn.execute(text("SELECT pg_advisory_lock(hashtext(:name))"), {"name": name})
+            acquired = True
+        else:
+            acquired = (await conn.execute(text("SELECT pg_try_advisory_lock(hashtext(:name))"), {"name": name})).scalar_one()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                await conn.execute(text("SELECT pg_advisory_unlock(hashtext(:name))"), {"name": name})
+
@@ -4,5 +4,6 @@ from .wallet_account import WalletAccount as WalletAccount
 from .ledger_entry import LedgerEntry as LedgerEntry
 from .idempotency_key import IdempotencyKey as IdempotencyKey
 from .transaction import Transaction as Transaction
+from .balance_snapshot import BalanceSnapshot as BalanceSnapshot
 
-__all__ = ["WalletAccount", "LedgerEntry", "IdempotencyKey", "Transaction"]
+__all__ = ["WalletAccount", "LedgerEntry", "IdempotencyKey", "Transaction", "BalanceSnapshot"]
@@ -0,0 +1,25 @@
+from datetime import datetime, timezone
+import uuid
+from sqlalchemy import BigInteger, DateTime, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Mapped, mapped_column
+from app.db.base import Base
+
+
+class BalanceSnapshot(Base):
+    __tablename__ = "balance_snapshots"
+    __table_args__ = (
+        Index("ix_balance_snapshots_account_position", "account_id", "last_entry_created_at", "last_entry_id"),
+    )
+    id: Mapped[uuid.UUID] = mapped_column(
+        UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    account_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey(
+        "wallet_accounts.id"), nullable=False)
+    # sum of every entry of the account up to and including the position below
+    balance = mapped_column(BigInteger, nullable=False)
+    entry_count = mapped_column(BigInteger, nullable=False)
+    # position of the last covered entry, in the ledger's (created_at, id) order
+    last_entry_created_at = mapped_column(DateTime(timezone=True), nullable=False)
+    last_entry_id = mapped_column(UUID(as_uuid=True), nullable=False)
+    created_at = mapped_column(DateTime(
+        timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
@@ -1,4 +1,5 @@
-from sqlalchemy import String
+from datetime import datetime, timezone
+from sqlalchemy import DateTime, String
 from sqlalchemy.orm import Mapped, mapped_column
 from app.db.base import Base
 from sqlalchemy.dialects.postgresql import JSONB
@@ -6,6 +7,15 @@ from sqlalchemy.dialects.postgresql import JSONB
 from .mixins.timestamp import TimestampMixin 
 class IdempotencyKey(Base, TimestampMixin):
     __tablename__ = "idempotency_keys"
+    # range-partitioned by day on created_at; Postgres requires the partition key in the primary key,
+    # so uniqueness of `key` alone is backed by the unique transactions.idempotency_key, and for bulk
+    # keys by the advisory lock bulk transfers take on the key. Lookups read the first row of a key
+    # (saved_idempotency_key), so a duplicate can't break its replays
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
     key: Mapped[str] =  mapped_column(String, primary_key=True)
     request_hash: Mapped[str] =  mapped_column(String, nullable=False)
-    request_json: Mapped[dict] = mapped_column(JSONB, nullable=False)
\ No newline at end of file
+    request_json: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    created_at = mapped_column(DateTime(timezone=True),
+                               primary_key=True,
+                               default=lambda: datetime.now(timezone.utc),
+                               nullable=False)
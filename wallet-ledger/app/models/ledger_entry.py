@@ -1,7 +1,7 @@
 from datetime import datetime, timezone
 from enum import Enum
 import uuid
-from sqlalchemy import BigInteger, ForeignKey, String, Enum as SAEnum, DateTime
+from sqlalchemy import BigInteger, ForeignKey, Index, String, Enum as SAEnum, DateTime
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import Mapped, mapped_column
 from app.db.base import Base
@@ -15,6 +15,16 @@ class EntryType(str, Enum):
 
 class LedgerEntry(Base):
     __tablename__ = "ledger_entries"
+    # range-partitioned by month on created_at (see partition_service); the BRIN index serves
+    # time-range scans for almost no space, the covering B-tree serves one account's history
+    __table_args__ = (
+        Index("ix_ledger_entries_created_at_brin", "created_at", postgresql_using="brin",
+              postgresql_with={"autosummarize": "on"}),
+        # statement pages are index-only scans: keyset columns plus everything the page returns
+        Index("ix_ledger_entries_account_statement", "account_id", "created_at", "id",
+              postgresql_include=["transaction_id", "entry_type", "amount", "running_balance"]),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
     id: Mapped[uuid.UUID] = mapped_column(
         UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     account_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey(
@@ -24,5 +34,6 @@ class LedgerEntry(Base):
     # the account's balance after this entry)
     running_balance = mapped_column(BigInteger, nullable=False)
     entry_type = mapped_column(SAEnum(EntryType), nullable=False)
+    # part of the primary key because it is the partition key
     created_at = mapped_column(DateTime(
-        timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+        timezone=True), primary_key=True, default=lambda: datetime.now(timezone.utc), nullable=False)
@@ -1,6 +1,6 @@
 from enum import Enum
 import uuid
-from sqlalchemy import BigInteger, String, Enum as SAEnum
+from sqlalchemy import BigInteger, Index, String, Enum as SAEnum, text
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.dialects.postgresql import UUID
 from app.db.base import Base
@@ -16,9 +16,16 @@ class AccountStatus(str, Enum):
     CLOSED = "CLOSED"    
 class WalletAccount(Base, TimestampMixin):
     __tablename__ = "wallet_accounts"
+    __table_args__ = (
+        # one SYSTEM row per bucket
+        Index("uq_wallet_accounts_system_bucket", "bucket", unique=True,
+              postgresql_where=text("account_type = 'SYSTEM'")),
+    )
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id: Mapped[str] = mapped_column(String, unique=True, nullable=False)
     account_type: Mapped[AccountType] = mapped_column(SAEnum(AccountType), default=AccountType.USER_ACCOUNT, nullable=False)
     status: Mapped[AccountStatus] = mapped_column(SAEnum(AccountStatus), default=AccountStatus.ACTIVE, nullable=False)
     cached_balance: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
-    version: Mapped[int] = mapped_column(default=0, nullable=False)
\ No newline at end of file
+    version: Mapped[int] = mapped_column(default=0, nullable=False)
+    # SYSTEM bucket index; always 0 for user and merchant wallets
+    bucket: Mapped[int] = mapped_column(default=0, server_default="0", nullable=False)
@@ -0,0 +1,22 @@
+from datetime import datetime
+from typing import Optional
+import uuid
+from pydantic import BaseModel
+from app.models.ledger_entry import EntryType
+
+
+class LedgerEntryResponse(BaseModel):
+    id: uuid.UUID
+    transaction_id: uuid.UUID
+    entry_type: EntryType
+    amount: int
+    running_balance: int
+    created_at: datetime
+    class Config:
+        from_attributes = True
+
+
+class LedgerEntryPage(BaseModel):
+    entries: list[LedgerEntryResponse]
+    # pass back as ?cursor= for the next (older) page; None on the last page
+    next_cursor: Optional[str] = None
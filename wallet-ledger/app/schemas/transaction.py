@@ -1,7 +1,9 @@
 from datetime import datetime
+from enum import Enum
 from typing import Optional
 import uuid
 from pydantic import BaseModel, Field
+from app.core.config import settings
 from app.models.transaction import TransactionStatus, TransactionType
 
 
@@ -28,6 +30,22 @@ class TransferRequest(BaseModel):
     metadata: Optional[dict] = None
 
 
+class BulkTransferMode(str, Enum):
+    ALL_OR_NOTHING = "ALL_OR_NOTHING"  # any failing item rejects the whole batch
+    BEST_EFFORT = "BEST_EFFORT"        # failing items are skipped, the rest are applied
+
+
+class BulkTransferStatus(str, Enum):
+    COMPLETED = "COMPLETED"  # every item applied
+    PARTIAL = "PARTIAL"      # best effort: some items failed
+    REJECTED = "REJECTED"    # nothing applied
+
+
+class BulkTransferRequest(BaseModel):
+    transfers: list[TransferRequest] = Field(min_length=1, max_length=settings.BULK_TRANSFER_MAX_ITEMS)
+    mode: BulkTransferMode = BulkTransferMode.ALL_OR_NOTHING
+
+
 class TransactionResponse(BaseModel):
     id: uuid.UUID
     transaction_type: TransactionType
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Optional
 from uuid import UUID
 from pydantic import BaseModel
 from app.models.wallet_account import AccountStatus, AccountType
@@ -24,3 +25,25 @@ class WalletResponse(WalletRequestBase):
 class BalanceResponse(BaseModel):
     account_id: UUID
     balance: int
+
+
+class SystemBalanceResponse(BaseModel):
+    balance: int
+    buckets: int
+
+
+class BalanceVerificationResponse(BaseModel):
+    account_id: UUID
+    cached_balance: int
+    ledger_balance: int
+    drift: int
+    snapshot_at: Optional[datetime] = None
+    replayed_entries: int
+
+
+class BalanceAtResponse(BaseModel):
+    account_id: UUID
+    at: datetime
+    balance: int
+    snapshot_at: Optional[datetime] = None
+    replayed_entries: int
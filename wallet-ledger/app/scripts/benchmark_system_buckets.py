@@ -0,0 +1,79 @@
+"""
+Credit throughput against the number of SYSTEM account buckets.
+
+    python -m app.scripts.benchmark_system_buckets --buckets 1 2 4 8 16 --concurrency 32 --seconds 10
+
+For every bucket count, --concurrency workers credit their own wallet in a loop for
+--seconds, so the only row they can contend on is the SYSTEM side of the credit.
+With one bucket every top-up queues on the same lock; credits/second should grow with
+the bucket count until the pool or the database runs out of headroom.
+Run it against a scratch database: the wallets, transactions and ledger entries it
+writes are kept, and the run ends by checking SUM(cached_balance) = 0.
+"""
+import argparse
+import asyncio
+import time
+from uuid import uuid4
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app.core.config import settings
+from app.crud.wallet_service import wallet_crud_service
+from app.models.wallet_account import AccountType, WalletAccount
+from app.schemas.transaction import CreditRequest
+from app.schemas.wallet import CreateWalletRequest
+from app.services.system_account_service import ensure_system_buckets
+
+
+async def credit_loop(session_factory, wallet_id, deadline: float, optimistic: bool) -> tuple[int, int]:
+    credit = wallet_crud_service.credit_wallet_optimistic if optimistic else wallet_crud_service.credit_wallet
+    done, failed = 0, 0
+    async with session_factory() as db_session:
+        while time.perf_counter() < deadline:
+            try:
+                await credit(walletId=wallet_id, idempotency_key=str(uuid4()), data=CreditRequest(amount=1), db_session=db_session)
+                done += 1
+            except Exception:
+                # optimistic mode gives up after max_retries conflicts
+                failed += 1
+    return done, failed
+
+
+async def run(session_factory, buckets: int, concurrency: int, seconds: float, optimistic: bool):
+    settings.SYSTEM_ACCOUNT_BUCKETS = buckets
+    async with session_factory() as db_session:
+        await ensure_system_buckets(db_session)
+    wallet_ids = []
+    async with session_factory() as db_session:
+        for _ in range(concurrency):
+            wallet = await wallet_crud_service.create_wallet(db_session=db_session, data=CreateWalletRequest(
+                user_id=f"bench-{uuid4()}", account_type=AccountType.USER_ACCOUNT))
+            wallet_ids.append(wallet.id)
+
+    deadline = time.perf_counter() + seconds
+    results = await asyncio.gather(*(credit_loop(session_factory, wallet_id, deadline, optimistic) for wallet_id in wallet_ids))
+    done = sum(result[0] for result in results)
+    failed = sum(result[1] for result in results)
+    print(f"buckets {buckets:>3}: {done / seconds:>9.1f} credits/s  ({done} ok, {failed} failed)")
+
+
+async def main(bucket_counts: list[int], concurrency: int, seconds: float, optimistic: bool):
+    engine = create_async_engine(settings.DATABASE_URL, pool_size=concurrency, max_overflow=0)
+    session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=True)
+    try:
+        for buckets in bucket_counts:
+            await run(session_factory, buckets, concurrency, seconds, optimistic)
+        async with session_factory() as db_session:
+            total = (await db_session.execute(select(func.coalesce(func.sum(WalletAccount.cached_balance), 0)))).scalar_one()
+        print(f"reconciliation: SUM(cached_balance) = {total} ({'ok' if total == 0 else 'BROKEN'})")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--buckets", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--optimistic", action="store_true", help="use credit_wallet_optimistic instead of the FOR UPDATE path")
+    args = parser.parse_args()
+    asyncio.run(main(args.buckets, args.concurrency, args.seconds, args.optimistic))
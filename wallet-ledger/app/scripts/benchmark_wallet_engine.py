@@ -0,0 +1,82 @@
+"""
+Transfers/second for the ORM path against the PL/pgSQL functions (WALLET_ENGINE).
+
+    python -m app.scripts.benchmark_wallet_engine --engines orm plpgsql --concurrency 32 --seconds 10
+
+Each of --concurrency workers owns a pair of wallets and transfers 1 back and forth between
+them for --seconds, so workers never contend with each other and the difference between the
+engines is the round trips per request and how long the row locks are held.
+Needs the migrations applied (the functions come from 166b063cdaea). Run it against a
+scratch database: the wallets, transactions and ledger entries it writes are kept.
+"""
+import argparse
+import asyncio
+import time
+from uuid import uuid4
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app.core.config import settings
+from app.crud.plpgsql_wallet_service import plpgsql_wallet_service
+from app.crud.wallet_service import wallet_crud_service
+from app.models.wallet_account import AccountType
+from app.schemas.transaction import CreditRequest, TransferRequest
+from app.schemas.wallet import CreateWalletRequest
+from app.services.system_account_service import ensure_system_buckets
+
+ENGINES = {"orm": wallet_crud_service, "plpgsql": plpgsql_wallet_service}
+
+
+async def transfer_loop(session_factory, service, pair, deadline: float) -> tuple[int, int]:
+    done, failed = 0, 0
+    source, destination = pair
+    while time.perf_counter() < deadline:
+        try:
+            # a fresh session per request, like the API
+            async with session_factory() as db_session:
+                await service.transfer_wallet(idempotency_key=str(uuid4()), db_session=db_session,
+                                              data=TransferRequest(source_account_id=source, destination_account_id=destination, amount=1))
+            done += 1
+        except Exception:
+            failed += 1
+        source, destination = destination, source
+    return done, failed
+
+
+async def create_pairs(session_factory, count: int) -> list[tuple]:
+    pairs = []
+    async with session_factory() as db_session:
+        for _ in range(count):
+            pair = []
+            for _ in range(2):
+                wallet = await wallet_crud_service.create_wallet(db_session=db_session, data=CreateWalletRequest(
+                    user_id=f"bench-{uuid4()}", account_type=AccountType.USER_ACCOUNT))
+                await wallet_crud_service.credit_wallet(walletId=wallet.id, idempotency_key=str(uuid4()),
+                                                        data=CreditRequest(amount=1_000_000), db_session=db_session)
+                pair.append(wallet.id)
+            pairs.append(tuple(pair))
+    return pairs
+
+
+async def main(engines: list[str], concurrency: int, seconds: float):
+    engine = create_async_engine(settings.DATABASE_URL, pool_size=concurrency, max_overflow=0)
+    session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=True)
+    try:
+        async with session_factory() as db_session:
+            await ensure_system_buckets(db_session)
+        pairs = await create_pairs(session_factory, concurrency)
+        for name in engines:
+            deadline = time.perf_counter() + seconds
+            results = await asyncio.gather(*(transfer_loop(session_factory, ENGINES[name], pair, deadline) for pair in pairs))
+            done = sum(result[0] for result in results)
+            failed = sum(result[1] for result in results)
+            print(f"{name:>8}: {done / seconds:>9.1f} transfers/s  ({done} ok, {failed} failed)")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", nargs="+", choices=sorted(ENGINES), default=["orm", "plpgsql"])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.engines, args.concurrency, args.seconds))
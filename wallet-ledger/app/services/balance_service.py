@@ -1,6 +1,8 @@
 from uuid import UUID
-from sqlalchemy import select, update
+from sqlalchemy import BigInteger, column, select, update, values
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
 from app.models.wallet_account import AccountStatus, AccountType, WalletAccount
 from app.core.exceptions import InsufficientBalanceError, WalletError, WalletNotFoundError, WalletFrozenError
 
@@ -36,9 +38,11 @@ async def optimistic_credit(wallet_id: UUID, amount, max_retries: int, db_sessio
     raise WalletError("Too much contention, please retry")
 
 
-async def optimistic_debit_system_account(amount, max_retries: int, db_session: AsyncSession):
+async def optimistic_debit_system_account(amount, max_retries: int, db_session: AsyncSession, bucket: int = 0):
     for attempt in range(max_retries):
-        system_account_result = await db_session.execute(select(WalletAccount).where(WalletAccount.account_type == AccountType.SYSTEM))
+        system_account_result = await db_session.execute(select(WalletAccount)
+                                                         .where(WalletAccount.account_type == AccountType.SYSTEM)
+                                                         .where(WalletAccount.bucket == bucket))
         system_account = system_account_result.scalar_one_or_none()
         if system_account is None:
             raise WalletNotFoundError()
@@ -57,15 +61,17 @@ async def optimistic_debit_system_account(amount, max_retries: int, db_session:
         if update_result.rowcount == 1:
             # returning tuple
             return {"new_balance": new_balance, "new_version": current_version + 1, "system_account_id": system_account.id}
-        # Version conflict -- someone else updated first
-        # Expire the cached object so next read gets fresh data
+        # Version conflict -- someone else updated this bucket first, retry on its sibling
         db_session.expire(system_account)
+        bucket = (bucket + 1) % settings.SYSTEM_ACCOUNT_BUCKETS
     raise WalletError("Too much contention, please retry")
 
 
-async def optimistic_credit_system_account(amount, max_retries: int, db_session: AsyncSession):
+async def optimistic_credit_system_account(amount, max_retries: int, db_session: AsyncSession, bucket: int = 0):
     for attempt in range(max_retries):
-        system_account_result = await db_session.execute(select(WalletAccount).where(WalletAccount.account_type == AccountType.SYSTEM))
+        system_account_result = await db_session.execute(select(WalletAccount)
+                                                         .where(WalletAccount.account_type == AccountType.SYSTEM)
+                                                         .where(WalletAccount.bucket == bucket))
         system_account = system_account_result.scalar_one_or_none()
         if system_account is None:
             raise WalletNotFoundError()
@@ -84,9 +90,9 @@ async def optimistic_credit_system_account(amount, max_retries: int, db_session:
         if update_result.rowcount == 1:
             # returning tuple
             return {"new_balance": new_balance, "new_version": current_version + 1, "system_account_id": system_account.id}
-        # Version conflict -- someone else updated first
-        # Expire the cached object so next read gets fresh data
+        # Version conflict -- someone else updated this bucket first, retry on its sibling
         db_session.expire(system_account)
+        bucket = (bucket + 1) % settings.SYSTEM_ACCOUNT_BUCKETS
     raise WalletError("Too much contention, please retry")
 
 
@@ -125,3 +131,15 @@ async def optimistic_debit(wallet_id: UUID, amount, max_retries: int, db_session
         db_session.expire(wallet_account)
 
     raise WalletError("Too much contention, please retry")
+
+
+async def apply_balance_deltas(deltas: dict[UUID, int], db_session: AsyncSession):
+    # one set-based UPDATE ... FROM (VALUES ...) for many accounts; callers hold the row locks
+    if not deltas:
+        return
+    delta_rows = values(column("id", PG_UUID(as_uuid=True)), column("delta", BigInteger), name="deltas").data(list(deltas.items()))
+    await db_session.execute(update(WalletAccount)
+                             .where(WalletAccount.id == delta_rows.c.id)
+                             .values(cached_balance=WalletAccount.cached_balance + delta_rows.c.delta,
+                                     version=WalletAccount.version + 1)
+                             .execution_options(synchronize_session=False))
@@ -0,0 +1,263 @@
+import asyncio
+import logging
+from uuid import UUID, uuid4
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.exceptions import IdempotencyConflictError, InsufficientBalanceError, WalletFrozenError, WalletNotFoundError
+from app.db.core import async_session_factory
+from app.models.idempotency_key import IdempotencyKey
+from app.models.ledger_entry import EntryType, LedgerEntry
+from app.models.transaction import Transaction, TransactionStatus, TransactionType
+from app.models.wallet_account import AccountStatus, WalletAccount
+from app.schemas.transaction import CreditRequest, DebitRequest
+from app.services.balance_service import apply_balance_deltas
+from app.services.idempotency_cache import idempotency_cache
+from app.services.idempotency_service import REPLAYABLE_ERRORS, check_cached_idempotency, compute_request_hash, idempotency_cutoff, remember_idempotency
+from app.services.system_account_service import lock_system_bucket, system_bucket_for
+
+
+class PendingOperation:
+    def __init__(self, transaction_type: TransactionType, wallet_id, idempotency_key: str, data, future: asyncio.Future):
+        self.transaction_type = transaction_type
+        self.wallet_id = wallet_id
+        self.idempotency_key = idempotency_key
+        self.data = data
+        self.request_hash = compute_request_hash(data.model_dump())
+        self.future = future
+
+
+class GroupCommitEngine:
+    """
+    Opt-in group commit for credits and debits (WALLET_GROUP_COMMIT_ENABLED).
+    Operations are queued in process; the first one opens a GROUP_COMMIT_WINDOW_MS window and
+    everything arriving meanwhile, up to GROUP_COMMIT_MAX_BATCH, is applied in one DB transaction:
+    one idempotency lookup, one ordered FOR UPDATE over all wallets, multi-row inserts and a single
+    set-based balance UPDATE. Each caller still gets its own response or error.
+    """
+
+    def __init__(self):
+        self.pending: list[PendingOperation] | None = None
+        self.flushing: set[asyncio.Task] = set()
+
+    async def credit_wallet(self, walletId: UUID, idempotency_key: str, data: CreditRequest):
+        return await self.submit(TransactionType.CREDIT, walletId, idempotency_key, data)
+
+    async def debit_wallet(self, wallet_id: UUID, idempotency_key: str, data: DebitRequest):
+        return await self.submit(TransactionType.DEBIT, wallet_id, idempotency_key, data)
+
+    async def submit(self, transaction_type: TransactionType, wallet_id, idempotency_key: str, data):
+        loop = asyncio.get_running_loop()
+        operation = PendingOperation(transaction_type, wallet_id, idempotency_key, data, loop.create_future())
+        # replays answered from the cache never join a batch
+        cached_response = await check_cached_idempotency(idempotency_key=idempotency_key, request_hash=operation.request_hash)
+        if cached_response:
+            return cached_response
+        batch = self.pending
+        if batch is None:
+            batch = self.pending = []
+            loop.call_later(settings.GROUP_COMMIT_WINDOW_MS / 1000, self._flush_soon, batch)
+        batch.append(operation)
+        if len(batch) >= settings.GROUP_COMMIT_MAX_BATCH:
+            self._flush_soon(batch)
+        return await operation.future
+
+    def _flush_soon(self, batch: list[PendingOperation]):
+        # the window timer and a full batch can both fire; only the first one flushes it
+        if self.pending is not batch:
+            return
+        self.pending = None
+        task = asyncio.ensure_future(self._flush(batch))
+        self.flushing.add(task)
+        task.add_done_callback(self.flushing.discard)
+
+    async def drain(self):
+        if self.pending is not None:
+            self._flush_soon(self.pending)
+        if self.flushing:
+            await asyncio.gather(*self.flushing, return_exceptions=True)
+
+    async def _flush(self, batch: list[PendingOperation]):
+        try:
+            async with async_session_factory() as db_session:
+                outcomes, saved = await self._apply(batch, db_session)
+        except Exception as e:
+            # e.g. a key committed by another instance between our lookup and commit;
+            # the per-request path sorts each operation out on its own
+            logging.error(f"group commit of {len(batch)} operations failed, applying them one by one: {e}", exc_info=True)
+            await asyncio.gather(*(self._apply_one(operation) for operation in batch))
+            return
+        for operation, outcome in zip(batch, outcomes):
+            if operation.future.done():
+                continue
+            if isinstance(outcome, Exception):
+                operation.future.set_exception(outcome)
+            else:
+                operation.future.set_result(outcome)
+        for row in saved:
+            await remember_idempotency(idempotency_key=row["key"], request_hash=row["request_hash"], response=row["request_json"])
+
+    async def _apply_one(self, operation: PendingOperation):
+        # imported here: wallet_service is the regular path and must not depend on this module
+        from app.crud.wallet_service import wallet_crud_service
+        try:
+            async with async_session_factory() as db_session:
+                if operation.transaction_type == TransactionType.CREDIT:
+                    result = await wallet_crud_service.credit_wallet(walletId=operation.wallet_id, idempotency_key=operation.idempotency_key,
+                                                                     data=operation.data, db_session=db_session)
+                else:
+                    result = await wallet_crud_service.debit_wallet(wallet_id=operation.wallet_id, idempotency_key=operation.idempotency_key,
+                                                                    data=operation.data, db_session=db_session)
+        except Exception as e:
+            if not operation.future.done():
+                operation.future.set_exception(e)
+            return
+        if not operation.future.done():
+            operation.future.set_result(result)
+
+    async def _apply(self, batch: list[PendingOperation], db_session: AsyncSession):
+        """
+        Apply the batch in one transaction. Returns a response or exception per operation,
+        and the idempotency rows that were committed.
+        """
+        outcomes: list = [None] * len(batch)
+        async with db_session.begin():
+            # Step 1: one idempotency lookup for the whole batch, skipped for keys the filter has never seen
+            saved_keys = {}
+            maybe_saved = {operation.idempotency_key for operation in batch if idempotency_cache.maybe_seen(operation.idempotency_key)}
+            if maybe_saved:
+                get_keys_result = await db_session.execute(select(IdempotencyKey)
+                                                           .where(IdempotencyKey.key.in_(maybe_saved))
+                                                           .where(IdempotencyKey.created_at >= idempotency_cutoff())
+                                                           .order_by(IdempotencyKey.created_at))
+                for row in get_keys_result.scalars():
+                    # the first save of a key is its answer (see saved_idempotency_key)
+                    saved_keys.setdefault(row.key, row)
+
+            # Step 2: lock every wallet in id order with a single statement (same order as transfers, so no deadlocks)
+            wallet_ids = {}
+            for i, operation in enumerate(batch):
+                try:
+                    wallet_ids[i] = UUID(str(operation.wallet_id))
+                except ValueError:
+                    outcomes[i] = WalletNotFoundError()
+            get_wallets_result = await db_session.execute(select(WalletAccount)
+                                                          .where(WalletAccount.id.in_(set(wallet_ids.values())))
+                                                          .order_by(WalletAccount.id)
+                                                          .with_for_update())
+            wallets = {wallet.id: wallet for wallet in get_wallets_result.scalars()}
+
+            # Step 3: validate and stage each operation against the batch's running balances
+            system_account = None
+            balances: dict[UUID, int] = {}
+            claimed: dict[str, int] = {}
+            transactions, ledger_entries, idempotency_rows = [], [], []
+            for i, operation in enumerate(batch):
+                if outcomes[i] is not None:
+                    continue
+                saved = saved_keys.get(operation.idempotency_key)
+                if saved is not None:
+                    outcomes[i] = saved.request_json if saved.request_hash == operation.request_hash else IdempotencyConflictError()
+                    continue
+                if operation.idempotency_key in claimed:
+                    first = claimed[operation.idempotency_key]
+                    # the same request twice in one batch is a replay of the first
+                    outcomes[i] = ("replay", first) if batch[first].request_hash == operation.request_hash else IdempotencyConflictError()
+                    continue
+                claimed[operation.idempotency_key] = i
+
+                wallet = wallets.get(wallet_ids[i])
+                if wallet is None:
+                    outcomes[i] = WalletNotFoundError()
+                    continue
+                if wallet.status is not AccountStatus.ACTIVE:
+                    outcomes[i] = WalletFrozenError()
+                    continue
+                amount = operation.data.amount
+                wallet_balance = balances.get(wallet.id, wallet.cached_balance)
+                if operation.transaction_type == TransactionType.DEBIT and wallet_balance < amount:
+                    outcomes[i] = InsufficientBalanceError()
+                    continue
+                if system_account is None:
+                    # wallets first, then one SYSTEM bucket for the whole batch
+                    system_account = await lock_system_bucket(bucket=system_bucket_for(operation.idempotency_key), db_session=db_session)
+                system_balance = balances.get(system_account.id, system_account.cached_balance)
+
+                transaction_id = uuid4()
+                if operation.transaction_type == TransactionType.CREDIT:
+                    source, destination = system_account.id, wallet.id
+                    balances[wallet.id] = wallet_balance + amount
+                    balances[system_account.id] = system_balance - amount
+                else:
+                    source, destination = wallet.id, system_account.id
+                    balances[wallet.id] = wallet_balance - amount
+                    balances[system_account.id] = system_balance + amount
+                transactions.append({
+                    "id": transaction_id,
+                    "source_account_id": source,
+                    "destination_account_id": destination,
+                    "transaction_type": operation.transaction_type,
+                    "idempotency_key": operation.idempotency_key,
+                    "amount": amount,
+                    "status": TransactionStatus.COMPLETED,
+                })
+                ledger_entries.append({
+                    "account_id": source,
+                    "transaction_id": transaction_id,
+                    "amount": amount,
+                    "running_balance": balances[source],
+                    "entry_type": EntryType.DEBIT,
+                })
+                ledger_entries.append({
+                    "account_id": destination,
+                    "transaction_id": transaction_id,
+                    "amount": amount,
+                    "running_balance": balances[destination],
+                    "entry_type": EntryType.CREDIT,
+                })
+                response = {
+                    "transaction_id": str(transaction_id),
+                    "amount": amount,
+                    "status": TransactionStatus.COMPLETED,
+                }
+                idempotency_rows.append({
+                    "key": operation.idempotency_key,
+                    "request_hash": operation.request_hash,
+                    "request_json": response,
+                })
+                outcomes[i] = response
+
+            # Step 3b: a failure on a key the filter let step 1 skip may be the retry of a request another
+            # instance already applied, so check those keys before answering from the current balances
+            unchecked = {batch[i].idempotency_key for i, outcome in enumerate(outcomes)
+                         if isinstance(outcome, REPLAYABLE_ERRORS) and batch[i].idempotency_key not in maybe_saved}
+            if unchecked:
+                get_keys_result = await db_session.execute(select(IdempotencyKey)
+                                                           .where(IdempotencyKey.key.in_(unchecked))
+                                                           .where(IdempotencyKey.created_at >= idempotency_cutoff())
+                                                           .order_by(IdempotencyKey.created_at))
+                saved_keys = {}
+                for row in get_keys_result.scalars():
+                    saved_keys.setdefault(row.key, row)
+                for i, operation in enumerate(batch):
+                    saved = saved_keys.get(operation.idempotency_key)
+                    if saved is not None and isinstance(outcomes[i], REPLAYABLE_ERRORS):
+                        outcomes[i] = saved.request_json if saved.request_hash == operation.request_hash else IdempotencyConflictError()
+
+            # Step 4: multi-row inserts and one set-based balance update
+            if transactions:
+                await db_session.execute(insert(Transaction), transactions)
+                await db_session.execute(insert(LedgerEntry), ledger_entries)
+                await db_session.execute(insert(IdempotencyKey), idempotency_rows)
+                await apply_balance_deltas({
+                    account_id: balance - (system_account.cached_balance if account_id == system_account.id else wallets[account_id].cached_balance)
+                    for account_id, balance in balances.items()
+                }, db_session)
+
+        for i, outcome in enumerate(outcomes):
+            if isinstance(outcome, tuple):
+                outcomes[i] = outcomes[outcome[1]]
+        return outcomes, idempotency_rows
+
+
+group_commit_engine = GroupCommitEngine()
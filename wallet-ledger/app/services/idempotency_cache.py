@@ -0,0 +1,118 @@
+import hashlib
+import json
+import logging
+import math
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from app.core.config import settings
+from app.models.idempotency_key import IdempotencyKey
+
+# Two cache tiers in front of idempotency_keys, plus a negative filter:
+#   local LRU -> Redis (optional, shared between instances) -> idempotency_keys table
+# A hit on either tier answers a replay without opening a DB transaction.
+# The Bloom filter holds every key this instance knows was saved; a key it has never
+# seen skips the SELECT entirely. Keys saved by other instances can be missing from it,
+# so it only gates the table, never Redis (the tier that knows other instances' keys), and
+# a miss can't change the answer: the unique transactions.idempotency_key rejects a retry's
+# insert (see replay_idempotency), and one that fails validation is looked up before the
+# error is returned (see replay_or_raise).
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, false_positive_rate: float):
+        self.size = max(8, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class IdempotencyCache:
+    def __init__(self):
+        self.entries: OrderedDict[str, tuple[str, dict]] = OrderedDict()
+        self.seen = BloomFilter(settings.IDEMPOTENCY_FILTER_CAPACITY, settings.IDEMPOTENCY_FILTER_FALSE_POSITIVE_RATE)
+        # until warm() has loaded the saved keys the filter can't vouch for anything
+        self.ready = False
+        self.redis = None
+        if settings.IDEMPOTENCY_REDIS_URL:
+            try:
+                from redis.asyncio import Redis
+            except ImportError:
+                logging.warning("IDEMPOTENCY_REDIS_URL is set but the redis package is not installed; using the local cache only")
+            else:
+                self.redis = Redis.from_url(settings.IDEMPOTENCY_REDIS_URL)
+
+    def maybe_seen(self, idempotency_key: str) -> bool:
+        return not self.ready or idempotency_key in self.seen
+
+    async def get(self, idempotency_key: str):
+        """Return (request_hash, response) for a completed key, or None if neither tier has it."""
+        entry = self.entries.get(idempotency_key)
+        if entry is not None:
+            self.entries.move_to_end(idempotency_key)
+            return entry
+        if self.redis is None:
+            return None
+        try:
+            cached = await self.redis.get(f"idempotency:{idempotency_key}")
+        except Exception as e:
+            # the cache is only an optimisation, the table still answers
+            logging.warning(f"idempotency redis lookup failed: {e}")
+            return None
+        if cached is None:
+            return None
+        cached = json.loads(cached)
+        entry = (cached["request_hash"], cached["response"])
+        self._put_local(idempotency_key, entry)
+        return entry
+
+    async def put(self, idempotency_key: str, request_hash: str, response: dict):
+        self.seen.add(idempotency_key)
+        self._put_local(idempotency_key, (request_hash, response))
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(f"idempotency:{idempotency_key}",
+                                 json.dumps({"request_hash": request_hash, "response": response}),
+                                 ex=settings.IDEMPOTENCY_CACHE_TTL_SECONDS)
+        except Exception as e:
+            logging.warning(f"idempotency redis write failed: {e}")
+
+    def _put_local(self, idempotency_key: str, entry: tuple[str, dict]):
+        self.entries[idempotency_key] = entry
+        self.entries.move_to_end(idempotency_key)
+        if len(self.entries) > settings.IDEMPOTENCY_CACHE_SIZE:
+            self.entries.popitem(last=False)
+
+    async def warm(self, session_factory: async_sessionmaker, since: datetime):
+        """Load every key saved since `since` into the negative filter, then start trusting it."""
+        try:
+            async with session_factory() as db_session:
+                result = await db_session.stream_scalars(select(IdempotencyKey.key)
+                                                         .where(IdempotencyKey.created_at >= since)
+                                                         .execution_options(yield_per=10_000))
+                async for idempotency_key in result:
+                    self.seen.add(idempotency_key)
+            self.ready = True
+        except Exception as e:
+            logging.error(f"failed to load idempotency keys, every request will check the table: {e}", exc_info=True)
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.aclose()
+
+
+idempotency_cache = IdempotencyCache()
@@ -1,21 +1,68 @@
 import hashlib
 import json
 import logging
+from datetime import datetime, timedelta, timezone
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.idempotency_key import IdempotencyKey
-from app.core.exceptions import IdempotencyConflictError, WalletError
+from app.core.config import settings
+from app.core.exceptions import DuplicateTransactionError, IdempotencyConflictError, InsufficientBalanceError, WalletError, WalletFrozenError, WalletNotFoundError
+from app.services.idempotency_cache import idempotency_cache
+from app.services.partition_service import PartitionedTable
+
+idempotency_partitions = PartitionedTable("idempotency_keys", "day")
+
+# Validation failures a retry can run into once its first attempt has moved the balances on
+# (or the account was frozen or closed since). check_idempotency may have skipped the table on
+# the filter's word, so these are answered from the saved response first (see replay_or_raise).
+REPLAYABLE_ERRORS = (InsufficientBalanceError, WalletNotFoundError, WalletFrozenError)
+
+
+def idempotency_cutoff() -> datetime:
+    # keys older than this are expired: not looked up, and their partitions get dropped
+    return datetime.now(timezone.utc) - timedelta(days=settings.IDEMPOTENCY_RETENTION_DAYS)
+
+
+def saved_idempotency_key(idempotency_key: str):
+    # the partition key is part of the primary key, so `key` alone is not unique in this table;
+    # should a key ever be saved twice, the first save is the answer
+    return (select(IdempotencyKey)
+            .where(IdempotencyKey.key == idempotency_key)
+            .where(IdempotencyKey.created_at >= idempotency_cutoff())
+            .order_by(IdempotencyKey.created_at)
+            .limit(1))
 
 
 def compute_request_hash(request_data: dict) -> str:
-    serialized = json.dumps(request_data, sort_keys=True)
+    # default=str covers the UUIDs in transfer requests; requests without them hash exactly as before
+    serialized = json.dumps(request_data, sort_keys=True, default=str)
     return hashlib.sha256(serialized.encode()).hexdigest()
 
 
-async def check_idempotency(idempotency_key: str, request_hash: str, db_session: AsyncSession):
+async def check_cached_idempotency(idempotency_key: str, request_hash: str):
+    # answered from the LRU/Redis tiers, before any DB transaction is opened
+    cached = await idempotency_cache.get(idempotency_key)
+    if cached is None:
+        return None
+    cached_request_hash, response = cached
+    if cached_request_hash != request_hash:
+        raise IdempotencyConflictError()
+    return response
+
+
+async def remember_idempotency(idempotency_key: str, request_hash: str, response: dict):
+    # call only after the transaction that saved the key has committed
+    await idempotency_cache.put(idempotency_key, request_hash, response)
+
+
+async def check_idempotency(idempotency_key: str, request_hash: str, db_session: AsyncSession, trust_filter: bool = True):
     try:
-        get_idempotency_key = await db_session.execute(select(IdempotencyKey).where(IdempotencyKey.key == idempotency_key))
-        idempotency_row = get_idempotency_key.scalar_one_or_none()
+        if trust_filter and not idempotency_cache.maybe_seen(idempotency_key):
+            # never saved as far as this instance knows; the unique transactions.idempotency_key
+            # catches a retry that gets as far as its insert, replay_or_raise one that fails validation
+            return None
+        get_idempotency_key = await db_session.execute(saved_idempotency_key(idempotency_key))
+        idempotency_row = get_idempotency_key.scalars().first()
         if idempotency_row is None:
             return None
         if idempotency_row.request_hash != request_hash:
@@ -40,3 +87,29 @@ async def save_idempotency(idempotency_key: str, request_hash: str, request_json
     except Exception as e:
         logging.error(f"failed to save idempotency: {e}", exc_info=True)
         raise WalletError("failed to save idempotency")
+
+
+async def replay_idempotency(idempotency_key: str, request_hash: str, db_session: AsyncSession):
+    # the insert lost a race on the unique key: whoever won already saved the response
+    try:
+        get_idempotency_key = await db_session.execute(saved_idempotency_key(idempotency_key))
+        idempotency_row = get_idempotency_key.scalars().first()
+    except Exception as e:
+        logging.error(f"failed to replay idempotency: {e}", exc_info=True)
+        raise WalletError("failed to check idempotency")
+    if idempotency_row is None:
+        # the transaction exists but its saved response has passed IDEMPOTENCY_RETENTION_DAYS
+        raise DuplicateTransactionError()
+    if idempotency_row.request_hash != request_hash:
+        raise IdempotencyConflictError()
+    await remember_idempotency(idempotency_key, request_hash, idempotency_row.request_json)
+    return idempotency_row.request_json
+
+
+async def replay_or_raise(idempotency_key: str, request_hash: str, error: WalletError, db_session: AsyncSession):
+    # the request failed validation, but it may be the retry of one another instance already applied
+    saved_response = await check_idempotency(idempotency_key=idempotency_key, request_hash=request_hash, db_session=db_session, trust_filter=False)
+    if saved_response is None:
+        raise error
+    await remember_idempotency(idempotency_key, request_hash, saved_response)
+    return saved_response
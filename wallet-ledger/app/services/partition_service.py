@@ -0,0 +1,114 @@
+import logging
+from datetime import date, datetime, time, timedelta, timezone
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# Range partitions on created_at, one child table per day or per month:
+#   idempotency_keys_p20261019   [2026-10-19 00:00 UTC, 2026-10-20 00:00 UTC)
+#   ledger_entries_p202610       [2026-10-01 00:00 UTC, 2026-11-01 00:00 UTC)
+# Partitions are created ahead of time by the maintainer worker so inserts never
+# find a missing range, and expired ones are detached concurrently and dropped
+# instead of DELETEd, which costs no table bloat and doesn't block writers.
+# Partitions whose name doesn't follow this pattern (e.g. ledger_entries_legacy) are left alone.
+
+
+class PartitionedTable:
+    def __init__(self, table_name: str, granularity: str):
+        if granularity not in ("day", "month"):
+            raise ValueError(f"unsupported partition granularity: {granularity}")
+        self.table_name = table_name
+        self.granularity = granularity
+
+    def period_start(self, day: date) -> date:
+        return day if self.granularity == "day" else day.replace(day=1)
+
+    def next_period(self, start: date) -> date:
+        if self.granularity == "day":
+            return start + timedelta(days=1)
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+    def partition_name(self, start: date) -> str:
+        suffix = start.strftime("%Y%m%d" if self.granularity == "day" else "%Y%m")
+        return f"{self.table_name}_p{suffix}"
+
+    def partition_start(self, partition_name: str) -> date | None:
+        suffix = partition_name.removeprefix(f"{self.table_name}_p")
+        try:
+            parsed = datetime.strptime(suffix, "%Y%m%d" if self.granularity == "day" else "%Y%m")
+        except ValueError:
+            return None  # not one of ours (e.g. a legacy or hand-made partition)
+        return parsed.date()
+
+    def periods(self, first: date, last: date):
+        start = self.period_start(first)
+        while start <= last:
+            yield start
+            start = self.next_period(start)
+
+    def create_partition_sql(self, start: date) -> str:
+        lower = datetime.combine(start, time.min, tzinfo=timezone.utc).isoformat()
+        upper = datetime.combine(self.next_period(start), time.min, tzinfo=timezone.utc).isoformat()
+        return (f"CREATE TABLE IF NOT EXISTS {self.partition_name(start)} PARTITION OF {self.table_name} "
+                f"FOR VALUES FROM ('{lower}') TO ('{upper}')")
+
+
+async def list_partitions(table: PartitionedTable, engine: AsyncEngine, pending_detach: bool = False) -> list[str]:
+    """
+    The table's partitions. pending_detach=True lists only those a DETACH ... CONCURRENTLY
+    was interrupted on, which stay half-detached until finalized.
+    """
+    async with engine.connect() as conn:
+        result = await conn.execute(text("""
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = :table_name AND (NOT :pending_detach OR pg_inherits.inhdetachpending)
+        """), {"table_name": table.table_name, "pending_detach": pending_detach})
+        return [row[0] for row in result]
+
+
+async def ensure_partitions(table: PartitionedTable, engine: AsyncEngine, ahead: int, behind: int = 0):
+    """Create the partitions from `behind` periods ago up to `ahead` periods from today (UTC)."""
+    today = datetime.now(timezone.utc).date()
+    first = today
+    for _ in range(behind):
+        first = table.period_start(first) - timedelta(days=1)
+    last = today
+    for _ in range(ahead):
+        last = table.next_period(table.period_start(last))
+    async with engine.begin() as conn:
+        for start in table.periods(first, last):
+            try:
+                async with conn.begin_nested():
+                    await conn.execute(text(table.create_partition_sql(start)))
+            except DBAPIError as e:
+                # the range is already covered by a partition we didn't name, e.g. ledger_entries_legacy
+                if "would overlap" not in str(e):
+                    raise
+
+
+async def drop_partitions_before(table: PartitionedTable, engine: AsyncEngine, cutoff: datetime, drop: bool = True) -> list[str]:
+    """
+    Detach every partition whose whole range is older than `cutoff`, and drop it unless
+    drop=False, which leaves it as a standalone table to archive or compress.
+    """
+    dropped = []
+    pending = set(await list_partitions(table, engine, pending_detach=True))
+    for partition_name in sorted(await list_partitions(table, engine)):
+        start = table.partition_start(partition_name)
+        if start is None or datetime.combine(table.next_period(start), time.min, tzinfo=timezone.utc) > cutoff:
+            continue
+        # DETACH ... CONCURRENTLY can't run inside a transaction block
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            if partition_name in pending:
+                # an earlier detach was interrupted (crash, cancelled statement); a new one would fail
+                await conn.execute(text(f"ALTER TABLE {table.table_name} DETACH PARTITION {partition_name} FINALIZE"))
+            else:
+                await conn.execute(text(f"ALTER TABLE {table.table_name} DETACH PARTITION {partition_name} CONCURRENTLY"))
+            if drop:
+                await conn.execute(text(f"DROP TABLE {partition_name}"))
+        logging.info(f"{'dropped' if drop else 'detached'} expired partition {partition_name}")
+        dropped.append(partition_name)
+    return dropped
@@ -0,0 +1,120 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+from sqlalchemy import case, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from app.core.config import settings
+from app.models.balance_snapshot import BalanceSnapshot
+from app.models.ledger_entry import EntryType, LedgerEntry
+from app.models.wallet_account import WalletAccount
+
+# Balance snapshots bound the cost of replaying an account's ledger.
+# A snapshot records the sum of an account's entries up to a (created_at, id) position;
+# the balance at any later point is that sum plus the entries after the position,
+# read from the (account_id, created_at, id) index. Each new snapshot is built from the
+# previous one, so the job never rescans history.
+#
+# created_at is stamped before commit, so an entry can become visible after a later-stamped
+# one. Snapshots therefore stop BALANCE_SNAPSHOT_SAFETY_LAG_SECONDS in the past, well beyond
+# the longest write transaction, so no entry can still appear behind a snapshot's position.
+
+SIGNED_AMOUNT = case((LedgerEntry.entry_type == EntryType.CREDIT, LedgerEntry.amount), else_=-LedgerEntry.amount)
+
+
+def snapshot_horizon() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(seconds=settings.BALANCE_SNAPSHOT_SAFETY_LAG_SECONDS)
+
+
+async def latest_snapshot(account_id: UUID, db_session: AsyncSession, at: datetime | None = None):
+    query = select(BalanceSnapshot).where(BalanceSnapshot.account_id == account_id)
+    if at is not None:
+        query = query.where(BalanceSnapshot.last_entry_created_at <= at)
+    result = await db_session.execute(query.order_by(BalanceSnapshot.last_entry_created_at.desc(),
+                                                     BalanceSnapshot.last_entry_id.desc()).limit(1))
+    return result.scalar_one_or_none()
+
+
+def entries_after(account_id: UUID, snapshot: BalanceSnapshot | None, upto: datetime | None):
+    conditions = [LedgerEntry.account_id == account_id]
+    if snapshot is not None:
+        conditions.append(tuple_(LedgerEntry.created_at, LedgerEntry.id)
+                          > tuple_(snapshot.last_entry_created_at, snapshot.last_entry_id))
+    if upto is not None:
+        conditions.append(LedgerEntry.created_at <= upto)
+    return conditions
+
+
+async def replay_balance(account_id: UUID, db_session: AsyncSession, at: datetime | None = None) -> dict:
+    """Balance of the account from its ledger, as of `at` (default: everything committed)."""
+    snapshot = await latest_snapshot(account_id, db_session, at=at)
+    result = await db_session.execute(select(func.coalesce(func.sum(SIGNED_AMOUNT), 0), func.count())
+                                      .where(*entries_after(account_id, snapshot, at)))
+    replayed_sum, replayed_entries = result.one()
+    return {
+        "balance": (snapshot.balance if snapshot else 0) + int(replayed_sum),
+        "snapshot_at": snapshot.last_entry_created_at if snapshot else None,
+        "replayed_entries": replayed_entries,
+    }
+
+
+async def build_snapshot(account_id: UUID, db_session: AsyncSession, upto: datetime, min_new_entries: int):
+    """Extend the account's latest snapshot up to `upto` if enough entries have arrived since."""
+    previous = await latest_snapshot(account_id, db_session)
+    conditions = entries_after(account_id, previous, upto)
+    result = await db_session.execute(select(func.coalesce(func.sum(SIGNED_AMOUNT), 0), func.count())
+                                      .where(*conditions))
+    new_sum, new_entries = result.one()
+    if new_entries == 0 or new_entries < min_new_entries:
+        return None
+    last_entry = (await db_session.execute(select(LedgerEntry.created_at, LedgerEntry.id)
+                                           .where(*conditions)
+                                           .order_by(LedgerEntry.created_at.desc(), LedgerEntry.id.desc())
+                                           .limit(1))).one()
+    snapshot = BalanceSnapshot(
+        account_id=account_id,
+        balance=(previous.balance if previous else 0) + int(new_sum),
+        entry_count=(previous.entry_count if previous else 0) + new_entries,
+        last_entry_created_at=last_entry.created_at,
+        last_entry_id=last_entry.id,
+    )
+    db_session.add(snapshot)
+    return snapshot
+
+
+async def active_accounts(db_session: AsyncSession, since: datetime, upto: datetime) -> list[UUID]:
+    # a time-bounded scan: partition pruning plus the BRIN index on created_at
+    result = await db_session.execute(select(LedgerEntry.account_id).distinct()
+                                      .where(LedgerEntry.created_at > since)
+                                      .where(LedgerEntry.created_at <= upto))
+    return list(result.scalars())
+
+
+async def all_accounts(db_session: AsyncSession, after: UUID | None, limit: int) -> list[UUID]:
+    query = select(WalletAccount.id).order_by(WalletAccount.id).limit(limit)
+    if after is not None:
+        query = query.where(WalletAccount.id > after)
+    return list((await db_session.execute(query)).scalars())
+
+
+async def snapshot_accounts(account_ids: list[UUID], session_factory: async_sessionmaker, upto: datetime) -> int:
+    written = 0
+    for start in range(0, len(account_ids), settings.BALANCE_SNAPSHOT_BATCH_SIZE):
+        async with session_factory() as db_session:
+            async with db_session.begin():
+                for account_id in account_ids[start:start + settings.BALANCE_SNAPSHOT_BATCH_SIZE]:
+                    if await build_snapshot(account_id, db_session, upto, settings.BALANCE_SNAPSHOT_MIN_NEW_ENTRIES):
+                        written += 1
+    return written
+
+
+async def snapshot_all_accounts(session_factory: async_sessionmaker, upto: datetime) -> int:
+    """Full pass over every account, in id order; used once at startup to cover anything missed."""
+    written, after = 0, None
+    while True:
+        async with session_factory() as db_session:
+            account_ids = await all_accounts(db_session, after, settings.BALANCE_SNAPSHOT_BATCH_SIZE)
+        if not account_ids:
+            return written
+        written += await snapshot_accounts(account_ids, session_factory, upto)
+        after = account_ids[-1]
+        logging.debug(f"balance snapshots: full pass reached account {after}")
@@ -0,0 +1,76 @@
+import logging
+import zlib
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.models.wallet_account import AccountStatus, AccountType, WalletAccount
+from app.core.exceptions import WalletError, WalletNotFoundError
+
+# The SYSTEM account is stored as SYSTEM_ACCOUNT_BUCKETS rows (bucket 0..N-1).
+# Every credit/debit moves money against one bucket, so N top-ups can hold
+# SYSTEM locks at the same time instead of queueing on a single row.
+# The platform's SYSTEM balance is the sum of the buckets, and since every bucket
+# is an ordinary account, SUM(all cached_balances) = 0 still holds.
+
+
+def system_bucket_for(idempotency_key: str) -> int:
+    # hashing the key spreads requests evenly and keeps a retried request on the same bucket
+    return zlib.crc32(idempotency_key.encode()) % settings.SYSTEM_ACCOUNT_BUCKETS
+
+
+def system_bucket_user_id(bucket: int) -> str:
+    # bucket 0 keeps the id of the original single SYSTEM account
+    if bucket == 0:
+        return settings.SYSTEM_ACCOUNT_USER_ID
+    return f"{settings.SYSTEM_ACCOUNT_USER_ID}:{bucket}"
+
+
+async def ensure_system_buckets(db_session: AsyncSession):
+    """Create any missing SYSTEM bucket rows. Safe to run from several instances at once."""
+    try:
+        async with db_session.begin():
+            for bucket in range(settings.SYSTEM_ACCOUNT_BUCKETS):
+                await db_session.execute(insert(WalletAccount).values(
+                    user_id=system_bucket_user_id(bucket),
+                    account_type=AccountType.SYSTEM,
+                    status=AccountStatus.ACTIVE,
+                    cached_balance=0,
+                    version=0,
+                    bucket=bucket,
+                ).on_conflict_do_nothing())
+    except Exception as e:
+        logging.error(f"failed to create system buckets: {e}", exc_info=True)
+        raise WalletError("failed to create system buckets")
+
+
+async def lock_system_bucket(bucket: int, db_session: AsyncSession):
+    """
+    Lock a SYSTEM bucket row, preferring `bucket`.
+    A bucket held by another transaction is skipped in favour of the next free sibling;
+    only when every bucket is busy do we wait, and then on the preferred one.
+    """
+    buckets = settings.SYSTEM_ACCOUNT_BUCKETS
+    result = await db_session.execute(select(WalletAccount)
+                                      .where(WalletAccount.account_type == AccountType.SYSTEM)
+                                      .where(WalletAccount.bucket < buckets)
+                                      .order_by((WalletAccount.bucket - bucket + buckets) % buckets)
+                                      .limit(1)
+                                      .with_for_update(skip_locked=True))
+    system_account = result.scalar_one_or_none()
+    if system_account is None:
+        result = await db_session.execute(select(WalletAccount)
+                                          .where(WalletAccount.account_type == AccountType.SYSTEM)
+                                          .where(WalletAccount.bucket == bucket)
+                                          .with_for_update())
+        system_account = result.scalar_one_or_none()
+    if system_account is None:
+        raise WalletNotFoundError()
+    return system_account
+
+
+async def get_system_balance(db_session: AsyncSession) -> int:
+    # sums every SYSTEM row, including buckets left over from a larger SYSTEM_ACCOUNT_BUCKETS
+    result = await db_session.execute(select(func.coalesce(func.sum(WalletAccount.cached_balance), 0))
+                                      .where(WalletAccount.account_type == AccountType.SYSTEM))
+    return int(result.scalar_one())
@@ -0,0 +1,120 @@
+from collections import defaultdict
+from uuid import uuid4
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import MultipleResultsFound
+from sqlalchemy.sql.dml import Insert
+from sqlalchemy.sql.selectable import Select
+from app.models.idempotency_key import IdempotencyKey
+from app.models.wallet_account import AccountStatus, AccountType, WalletAccount
+from app.services.idempotency_cache import IdempotencyCache
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def scalars(self):
+        return self
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def all(self):
+        return list(self.rows)
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+    def scalar_one_or_none(self):
+        if len(self.rows) > 1:
+            raise MultipleResultsFound("Multiple rows were found when one or none was required")
+        return self.first()
+
+
+class FakeTransaction:
+    def __init__(self, session):
+        self.session = session
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.session.commits += 1
+        else:
+            self.session.rollbacks += 1
+        return False
+
+
+class FakeSession:
+    """
+    In-memory stand-in for an AsyncSession. Selects of accounts and idempotency keys are answered
+    from the rows given, matched on the statement's bound parameters; inserts are recorded per table.
+    """
+
+    def __init__(self, accounts=(), saved_keys=(), fail_on_insert=None):
+        self.accounts = {account.id: account for account in accounts}
+        self.saved_keys = list(saved_keys)
+        self.inserted = defaultdict(list)
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+        # table name -> exception raised when a row is inserted into it
+        self.fail_on_insert = fail_on_insert or {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+    def begin(self):
+        return FakeTransaction(self)
+
+    async def execute(self, statement, params=None):
+        self.statements.append(statement)
+        if isinstance(statement, Insert):
+            table = statement.table.name
+            if table in self.fail_on_insert:
+                raise self.fail_on_insert[table]
+            rows = params if isinstance(params, list) else [params]
+            self.inserted[table].extend(rows)
+            if table == IdempotencyKey.__tablename__:
+                self.saved_keys.extend(IdempotencyKey(**row) for row in rows)
+            return FakeResult([])
+        if isinstance(statement, Select):
+            values = []
+            for value in statement.compile(dialect=postgresql.dialect()).params.values():
+                values.extend(value if isinstance(value, (list, tuple, set)) else [value])
+            entity = statement.column_descriptions[0]["entity"]
+            if entity is WalletAccount:
+                return FakeResult([account for account_id, account in sorted(self.accounts.items()) if account_id in values])
+            if entity is IdempotencyKey:
+                return FakeResult([row for row in self.saved_keys if row.key in values])
+        return FakeResult([])
+
+
+@pytest.fixture
+def make_session():
+    """Build a FakeSession, for tests that drive the ledger services without Postgres."""
+    return FakeSession
+
+
+@pytest.fixture
+def make_account():
+    def make(balance: int = 0, status: AccountStatus = AccountStatus.ACTIVE, account_type: AccountType = AccountType.USER_ACCOUNT):
+        return WalletAccount(id=uuid4(), user_id=str(uuid4()), account_type=account_type, status=status,
+                             cached_balance=balance, version=0, bucket=0)
+    return make
+
+
+@pytest.fixture
+def fresh_idempotency_cache(monkeypatch):
+    """A warmed, empty idempotency cache in place of the process-wide one."""
+    cache = IdempotencyCache()
+    cache.redis = None
+    cache.ready = True
+    for module in ("app.services.idempotency_service", "app.services.group_commit_service"):
+        monkeypatch.setattr(f"{module}.idempotency_cache", cache)
+    return cache
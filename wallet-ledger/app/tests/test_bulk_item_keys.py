@@ -0,0 +1,13 @@
+import re
+from app.api.routes_wallet import IDEMPOTENCY_KEY_PATTERN
+from app.crud.bulk_transfer_service import item_idempotency_key
+
+
+def test_item_keys_are_outside_the_client_key_space():
+    """
+    Test: a bulk item key can never be sent as a client Idempotency-Key, so a single transfer keyed "abc:0" can't collide with bulk "abc" item 0.
+    """
+    assert re.match(IDEMPOTENCY_KEY_PATTERN, "abc:0")
+    assert item_idempotency_key("abc", 0) != "abc:0"
+    assert not re.match(IDEMPOTENCY_KEY_PATTERN, item_idempotency_key("abc", 0))
+    assert item_idempotency_key("abc", 10) != item_idempotency_key("abc1", 0)
@@ -0,0 +1,116 @@
+import pytest
+from app.crud.bulk_transfer_service import BulkTransferCrudService, item_idempotency_key
+from app.models.idempotency_key import IdempotencyKey
+from app.models.transaction import TransactionStatus
+from app.models.wallet_account import AccountStatus
+from app.schemas.transaction import BulkTransferMode, BulkTransferRequest, BulkTransferStatus, TransferRequest
+from app.services.idempotency_service import compute_request_hash
+
+
+@pytest.fixture
+def bulk(monkeypatch, make_session, make_account, fresh_idempotency_cache):
+    """A BulkTransferCrudService running against one FakeSession, with recorded balance deltas."""
+    deltas = []
+
+    async def apply_balance_deltas(batch_deltas, db_session):
+        deltas.append(batch_deltas)
+
+    class Bulk:
+        service = BulkTransferCrudService()
+        session = make_session()
+        cache = fresh_idempotency_cache
+
+        def __init__(self):
+            self.deltas = deltas
+
+        def add_account(self, **kwargs):
+            account = make_account(**kwargs)
+            self.session.accounts[account.id] = account
+            return account
+
+    monkeypatch.setattr("app.crud.bulk_transfer_service.apply_balance_deltas", apply_balance_deltas)
+    return Bulk()
+
+
+def bulk_request(mode, *transfers):
+    return BulkTransferRequest(mode=mode, transfers=[
+        TransferRequest(source_account_id=source.id, destination_account_id=destination.id, amount=amount)
+        for source, destination, amount in transfers
+    ])
+
+
+async def test_all_or_nothing_rejects_the_whole_batch(bulk):
+    """
+    Test: with ALL_OR_NOTHING, one failing item leaves every item unapplied and nothing written.
+    """
+    alice, bob = bulk.add_account(balance=100), bulk.add_account(balance=0)
+    frozen = bulk.add_account(balance=0, status=AccountStatus.FROZEN)
+    data = bulk_request(BulkTransferMode.ALL_OR_NOTHING, (alice, bob, 40), (alice, frozen, 10), (alice, bob, 20))
+
+    response = await bulk.service.transfer_bulk("bulk-1", data, bulk.session)
+
+    assert response["status"] == BulkTransferStatus.REJECTED
+    assert (response["applied"], response["failed"]) == (0, 3)
+    assert all(result["status"] == TransactionStatus.FAILED for result in response["results"])
+    assert all("transaction_id" not in result for result in response["results"])
+    assert not bulk.session.inserted["transactions"] and not bulk.session.inserted["ledger_entries"]
+    assert bulk.deltas == []
+
+
+async def test_best_effort_keeps_running_balances(bulk):
+    """
+    Test: with BEST_EFFORT, each item is checked against the balances the earlier items of the same batch left.
+    """
+    alice, bob, carol = bulk.add_account(balance=50), bulk.add_account(balance=0), bulk.add_account(balance=0)
+    data = bulk_request(BulkTransferMode.BEST_EFFORT,
+                        (alice, bob, 30),   # alice 20, bob 30
+                        (bob, carol, 25),   # funded by the item before it: bob 5, carol 25
+                        (alice, carol, 30),  # alice only has 20 left
+                        (alice, carol, 20))  # alice 0, carol 45
+
+    response = await bulk.service.transfer_bulk("bulk-1", data, bulk.session)
+
+    assert response["status"] == BulkTransferStatus.PARTIAL
+    assert (response["applied"], response["failed"]) == (3, 1)
+    assert [result["status"] for result in response["results"]] == [
+        TransactionStatus.COMPLETED, TransactionStatus.COMPLETED, TransactionStatus.FAILED, TransactionStatus.COMPLETED]
+    assert [row["idempotency_key"] for row in bulk.session.inserted["transactions"]] == [
+        item_idempotency_key("bulk-1", index) for index in (0, 1, 3)]
+    assert [row["running_balance"] for row in bulk.session.inserted["ledger_entries"]] == [20, 30, 5, 25, 0, 45]
+    assert bulk.deltas == [{alice.id: -50, bob.id: 5, carol.id: 45}]
+    assert bulk.session.inserted["idempotency_keys"][0]["request_json"] == response
+
+
+async def test_rejected_batch_does_not_save_its_key(bulk):
+    """
+    Test: a rejected batch leaves its key unused, so the corrected batch can be sent again under it.
+    """
+    alice, bob = bulk.add_account(balance=10), bulk.add_account(balance=0)
+
+    rejected = await bulk.service.transfer_bulk("bulk-1", bulk_request(BulkTransferMode.ALL_OR_NOTHING, (alice, bob, 20)), bulk.session)
+    assert rejected["status"] == BulkTransferStatus.REJECTED
+    assert bulk.session.inserted["idempotency_keys"] == []
+    assert await bulk.cache.get("bulk-1") is None
+
+    corrected = await bulk.service.transfer_bulk("bulk-1", bulk_request(BulkTransferMode.ALL_OR_NOTHING, (alice, bob, 10)), bulk.session)
+    assert corrected["status"] == BulkTransferStatus.COMPLETED
+    assert bulk.deltas == [{alice.id: -10, bob.id: 10}]
+
+
+async def test_duplicate_waits_on_the_key_and_replays(bulk):
+    """
+    Test: the batch takes the advisory lock on its key before the lookup, and a key another instance saved is replayed from the table.
+    """
+    alice, bob = bulk.add_account(balance=100), bulk.add_account(balance=0)
+    data = bulk_request(BulkTransferMode.BEST_EFFORT, (alice, bob, 10))
+    saved_response = {"status": BulkTransferStatus.COMPLETED, "applied": 1, "failed": 0, "results": []}
+    bulk.session.saved_keys.append(IdempotencyKey(key="bulk-1", request_hash=compute_request_hash(data.model_dump(mode="json")),
+                                                  request_json=saved_response))
+    assert not bulk.cache.maybe_seen("bulk-1")
+
+    response = await bulk.service.transfer_bulk("bulk-1", data, bulk.session)
+
+    assert response == saved_response
+    assert "pg_advisory_xact_lock" in str(bulk.session.statements[0])
+    assert "idempotency_keys" in str(bulk.session.statements[1])
+    assert bulk.session.inserted["transactions"] == []
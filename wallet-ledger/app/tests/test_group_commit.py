@@ -0,0 +1,144 @@
+import asyncio
+import pytest
+from sqlalchemy.exc import IntegrityError
+from app.core.exceptions import IdempotencyConflictError, InsufficientBalanceError, WalletFrozenError, WalletNotFoundError
+from app.models.idempotency_key import IdempotencyKey
+from app.models.transaction import TransactionStatus
+from app.models.wallet_account import AccountStatus, AccountType
+from app.schemas.transaction import CreditRequest, DebitRequest
+from app.services.group_commit_service import GroupCommitEngine
+from app.services.idempotency_service import compute_request_hash
+
+
+@pytest.fixture
+def ledger(monkeypatch, make_session, make_account, fresh_idempotency_cache):
+    """A GroupCommitEngine whose batches run against one FakeSession, with a SYSTEM bucket and recorded balance deltas."""
+    system_account = make_account(account_type=AccountType.SYSTEM)
+    deltas = []
+
+    async def lock_system_bucket(bucket, db_session):
+        return system_account
+
+    async def apply_balance_deltas(batch_deltas, db_session):
+        deltas.append(batch_deltas)
+
+    class Ledger:
+        engine = GroupCommitEngine()
+        session = make_session()
+        cache = fresh_idempotency_cache
+
+        def __init__(self):
+            self.system_account = system_account
+            self.deltas = deltas
+
+        def add_account(self, **kwargs):
+            account = make_account(**kwargs)
+            self.session.accounts[account.id] = account
+            return account
+
+    ledger = Ledger()
+    monkeypatch.setattr("app.services.group_commit_service.async_session_factory", lambda: ledger.session)
+    monkeypatch.setattr("app.services.group_commit_service.lock_system_bucket", lock_system_bucket)
+    monkeypatch.setattr("app.services.group_commit_service.apply_balance_deltas", apply_balance_deltas)
+    return ledger
+
+
+async def test_batch_is_staged_against_running_balances(ledger):
+    """
+    Test: operations arriving together are applied in one transaction, each debit checked against the balance left by the ones before it.
+    """
+    wallet = ledger.add_account(balance=100)
+    results = await asyncio.gather(
+        ledger.engine.debit_wallet(wallet.id, "debit-1", DebitRequest(amount=60)),
+        ledger.engine.debit_wallet(wallet.id, "debit-2", DebitRequest(amount=60)),
+        ledger.engine.credit_wallet(wallet.id, "credit-1", CreditRequest(amount=30)),
+        ledger.engine.debit_wallet(wallet.id, "debit-3", DebitRequest(amount=60)),
+        return_exceptions=True,
+    )
+
+    assert results[0]["status"] == TransactionStatus.COMPLETED
+    assert isinstance(results[1], InsufficientBalanceError)
+    assert results[2]["status"] == TransactionStatus.COMPLETED
+    assert results[3]["status"] == TransactionStatus.COMPLETED, "Expected the credit before it to cover the third debit"
+    assert ledger.session.commits == 1
+    assert [row["idempotency_key"] for row in ledger.session.inserted["transactions"]] == ["debit-1", "credit-1", "debit-3"]
+    assert len(ledger.session.inserted["ledger_entries"]) == 6
+    assert ledger.deltas == [{wallet.id: -90, ledger.system_account.id: 90}]
+    assert await ledger.cache.get("debit-1") is not None, "Expected committed keys to be remembered"
+    assert await ledger.cache.get("debit-2") is None
+
+
+async def test_each_waiter_gets_its_own_outcome(ledger):
+    """
+    Test: a frozen wallet, an unknown wallet, a replay and a conflicting reuse of a key in the same batch each get their own answer.
+    """
+    wallet = ledger.add_account(balance=0)
+    frozen = ledger.add_account(balance=0, status=AccountStatus.FROZEN)
+    results = await asyncio.gather(
+        ledger.engine.credit_wallet(wallet.id, "credit-1", CreditRequest(amount=10)),
+        ledger.engine.credit_wallet(wallet.id, "credit-1", CreditRequest(amount=10)),
+        ledger.engine.credit_wallet(wallet.id, "credit-1", CreditRequest(amount=20)),
+        ledger.engine.credit_wallet(frozen.id, "credit-2", CreditRequest(amount=10)),
+        ledger.engine.credit_wallet("not-a-uuid", "credit-3", CreditRequest(amount=10)),
+        return_exceptions=True,
+    )
+
+    assert results[1] == results[0], "Expected the same request twice in a batch to replay the first"
+    assert isinstance(results[2], IdempotencyConflictError)
+    assert isinstance(results[3], WalletFrozenError)
+    assert isinstance(results[4], WalletNotFoundError)
+    assert len(ledger.session.inserted["transactions"]) == 1
+
+
+async def test_recheck_replays_a_retry_the_filter_skipped(ledger):
+    """
+    Test: a debit that now fails on balance, whose key another instance saved, is answered from the saved response instead of the error.
+    """
+    wallet = ledger.add_account(balance=0)
+    saved_response = {"transaction_id": "saved", "amount": 50, "status": TransactionStatus.COMPLETED}
+    ledger.session.saved_keys.append(IdempotencyKey(key="debit-1", request_hash=compute_request_hash(DebitRequest(amount=50).model_dump()),
+                                                    request_json=saved_response))
+    assert not ledger.cache.maybe_seen("debit-1")
+
+    results = await asyncio.gather(
+        ledger.engine.debit_wallet(wallet.id, "debit-1", DebitRequest(amount=50)),
+        ledger.engine.debit_wallet(wallet.id, "debit-2", DebitRequest(amount=50)),
+        return_exceptions=True,
+    )
+
+    assert results[0] == saved_response
+    assert isinstance(results[1], InsufficientBalanceError)
+    assert ledger.session.inserted["transactions"] == []
+
+
+async def test_failed_batch_falls_back_to_the_per_request_path(ledger, monkeypatch):
+    """
+    Test: when the batch transaction fails (a key committed elsewhere meanwhile), every operation is retried on its own and gets that answer.
+    """
+    from app.crud.wallet_service import wallet_crud_service
+    wallet = ledger.add_account(balance=100)
+    ledger.session.fail_on_insert["transactions"] = IntegrityError("INSERT", {}, Exception("duplicate key"))
+    applied = []
+
+    async def credit_wallet(walletId, idempotency_key, data, db_session):
+        applied.append(idempotency_key)
+        return {"transaction_id": f"single-{idempotency_key}"}
+
+    async def debit_wallet(wallet_id, idempotency_key, data, db_session):
+        applied.append(idempotency_key)
+        raise InsufficientBalanceError()
+
+    monkeypatch.setattr(wallet_crud_service, "credit_wallet", credit_wallet)
+    monkeypatch.setattr(wallet_crud_service, "debit_wallet", debit_wallet)
+
+    results = await asyncio.gather(
+        ledger.engine.credit_wallet(wallet.id, "credit-1", CreditRequest(amount=10)),
+        ledger.engine.debit_wallet(wallet.id, "debit-1", DebitRequest(amount=10)),
+        return_exceptions=True,
+    )
+
+    assert ledger.session.rollbacks == 1
+    assert sorted(applied) == ["credit-1", "debit-1"]
+    assert results[0] == {"transaction_id": "single-credit-1"}
+    assert isinstance(results[1], InsufficientBalanceError)
+    assert await ledger.cache.get("credit-1") is None, "Expected nothing remembered from the rolled back batch"
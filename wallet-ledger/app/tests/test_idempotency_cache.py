@@ -0,0 +1,106 @@
+import json
+import pytest
+from app.core.config import settings
+from app.services.idempotency_cache import BloomFilter, IdempotencyCache
+
+
+class SharedRedis:
+    """In-memory stand-in for the Redis tier, shared by the caches of several instances."""
+
+    def __init__(self):
+        self.values = {}
+        self.down = False
+
+    async def get(self, key):
+        if self.down:
+            raise ConnectionError("redis down")
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        if self.down:
+            raise ConnectionError("redis down")
+        self.values[key] = value
+
+
+@pytest.fixture
+def warm_cache():
+    cache = IdempotencyCache()
+    cache.ready = True
+    return cache
+
+
+def test_bloom_filter_has_no_false_negatives():
+    """
+    Test: every key added to the filter is reported as present.
+    """
+    bloom = BloomFilter(capacity=1_000, false_positive_rate=0.01)
+    keys = [f"key-{i}" for i in range(1_000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+
+
+def test_bloom_filter_false_positive_rate_is_near_its_target():
+    """
+    Test: at capacity, keys never added come back as present at roughly the configured rate.
+    """
+    bloom = BloomFilter(capacity=1_000, false_positive_rate=0.01)
+    for i in range(1_000):
+        bloom.add(f"key-{i}")
+    false_positives = sum(f"other-{i}" in bloom for i in range(20_000))
+    assert false_positives / 20_000 < 0.03, f"Expected about 1% false positives, got {false_positives / 200:.2f}%"
+
+
+def test_filter_vouches_for_nothing_until_warmed():
+    """
+    Test: before warm() has loaded the saved keys every key may have been seen; afterwards only keys put or loaded.
+    """
+    cache = IdempotencyCache()
+    assert cache.maybe_seen("never-saved")
+    cache.ready = True
+    assert not cache.maybe_seen("never-saved")
+
+
+async def test_lru_evicts_the_least_recently_used_key(warm_cache, monkeypatch):
+    """
+    Test: past IDEMPOTENCY_CACHE_SIZE the entry read or written longest ago is dropped, and a read refreshes an entry.
+    """
+    monkeypatch.setattr(settings, "IDEMPOTENCY_CACHE_SIZE", 2)
+    await warm_cache.put("a", "hash-a", {"transaction_id": "1"})
+    await warm_cache.put("b", "hash-b", {"transaction_id": "2"})
+    assert await warm_cache.get("a") == ("hash-a", {"transaction_id": "1"})
+    await warm_cache.put("c", "hash-c", {"transaction_id": "3"})
+
+    assert await warm_cache.get("b") is None
+    assert await warm_cache.get("a") is not None
+    assert await warm_cache.get("c") is not None
+    # evicted from the LRU, still known to have been saved
+    assert warm_cache.maybe_seen("b")
+
+
+async def test_redis_tier_answers_keys_saved_by_another_instance(warm_cache):
+    """
+    Test: a key saved by another instance is answered from Redis even though this instance's filter has never seen it.
+    """
+    redis = SharedRedis()
+    other_instance = IdempotencyCache()
+    other_instance.redis = redis
+    warm_cache.redis = redis
+    await other_instance.put("saved-elsewhere", "hash", {"transaction_id": "1"})
+
+    assert not warm_cache.maybe_seen("saved-elsewhere")
+    assert await warm_cache.get("saved-elsewhere") == ("hash", {"transaction_id": "1"})
+    assert "saved-elsewhere" in warm_cache.entries, "Expected the Redis hit to be kept in the local LRU"
+    assert json.loads(redis.values["idempotency:saved-elsewhere"])["request_hash"] == "hash"
+
+
+async def test_redis_failure_falls_through_to_the_table(warm_cache):
+    """
+    Test: a Redis error is treated as a miss instead of failing the request.
+    """
+    redis = SharedRedis()
+    redis.down = True
+    warm_cache.redis = redis
+    await warm_cache.put("key", "hash", {"transaction_id": "1"})
+    warm_cache.entries.clear()
+    assert await warm_cache.get("key") is None
@@ -0,0 +1,26 @@
+import pytest
+from app.core.exceptions import IdempotencyConflictError
+from app.models.idempotency_key import IdempotencyKey
+from app.services.idempotency_service import check_idempotency, replay_idempotency
+
+
+@pytest.fixture
+def duplicated_key(make_session, fresh_idempotency_cache):
+    """A session holding two saved rows for one key, as a key saved twice before it was fenced would leave."""
+    return make_session(saved_keys=[
+        IdempotencyKey(key="dup", request_hash="hash", request_json={"transaction_id": "first"}),
+        IdempotencyKey(key="dup", request_hash="hash", request_json={"transaction_id": "second"}),
+    ])
+
+
+async def test_lookup_answers_a_duplicated_key_from_its_first_row(duplicated_key):
+    """
+    Test: check and replay return the first saved response of a key saved twice instead of failing on the duplicate.
+    """
+    assert await check_idempotency("dup", "hash", duplicated_key, trust_filter=False) == {"transaction_id": "first"}
+    assert await replay_idempotency("dup", "hash", duplicated_key) == {"transaction_id": "first"}
+    lookup = str(duplicated_key.statements[-1])
+    assert "ORDER BY idempotency_keys.created_at" in lookup and "LIMIT" in lookup, "Expected the lookup to take the oldest row"
+
+    with pytest.raises(IdempotencyConflictError):
+        await check_idempotency("dup", "other-hash", duplicated_key, trust_filter=False)
@@ -0,0 +1,57 @@
+import pytest
+from sqlalchemy.exc import DBAPIError
+from app.core.exceptions import IdempotencyConflictError, InsufficientBalanceError, WalletError, WalletFrozenError, WalletNotFoundError
+from app.crud.plpgsql_wallet_service import PlpgsqlWalletService
+from app.schemas.transaction import DebitRequest
+
+
+class DriverError(Exception):
+    """What the asyncpg adapter raises: the server's SQLSTATE on a sqlstate attribute."""
+
+    def __init__(self, sqlstate):
+        super().__init__(f"function raised {sqlstate}")
+        self.sqlstate = sqlstate
+
+
+@pytest.fixture
+def raising_session(make_session):
+    """A session whose function call fails with the given SQLSTATE, as Postgres would report it."""
+
+    def make(sqlstate):
+        class RaisingSession(make_session):
+            async def connection(self, execution_options=None):
+                return self
+
+            async def execute(self, statement, params=None):
+                self.statements.append(statement)
+                raise DBAPIError(str(statement), params, DriverError(sqlstate))
+
+        return RaisingSession()
+    return make
+
+
+@pytest.mark.parametrize("sqlstate, error", [
+    ("WL404", WalletNotFoundError),
+    ("WL403", WalletFrozenError),
+    ("WL422", InsufficientBalanceError),
+    ("WL409", IdempotencyConflictError),
+])
+async def test_function_errors_map_to_wallet_errors(raising_session, fresh_idempotency_cache, sqlstate, error):
+    """
+    Test: a SQLSTATE raised by the wallet functions surfaces as the matching WalletError.
+    """
+    session = raising_session(sqlstate)
+    with pytest.raises(error):
+        await PlpgsqlWalletService().debit_wallet("4b1e7c56-3a9e-4d8e-9f8e-2c1a5f7e6d40", "debit-1", DebitRequest(amount=10), session)
+    assert "wallet_debit" in str(session.statements[0])
+
+
+async def test_unknown_sqlstate_is_a_generic_wallet_error(raising_session, fresh_idempotency_cache):
+    """
+    Test: any other database error is logged and answered with a plain WalletError.
+    """
+    with pytest.raises(WalletError) as raised:
+        await PlpgsqlWalletService().debit_wallet("4b1e7c56-3a9e-4d8e-9f8e-2c1a5f7e6d40", "debit-1", DebitRequest(amount=10),
+                                                  raising_session("40P01"))
+    assert type(raised.value) is WalletError
+    assert raised.value.message == "failed to debit wallet"
@@ -0,0 +1,30 @@
+import asyncio
+import logging
+from app.core.config import settings
+from app.db.core import advisory_lock, async_session_factory
+from app.services.snapshot_service import active_accounts, snapshot_accounts, snapshot_all_accounts, snapshot_horizon
+
+
+async def balance_snapshotter():
+    """
+    Incrementally snapshot account balances. The first pass this instance runs covers every
+    account; later passes only look at accounts with entries since its previous pass.
+    Each pass takes an advisory lock, so with several instances only one runs it at a time.
+    """
+    previous_upto = None
+    while True:
+        try:
+            async with advisory_lock("wallet-ledger:balance-snapshots", wait=False) as acquired:
+                if acquired:
+                    upto = snapshot_horizon()
+                    if previous_upto is None:
+                        written = await snapshot_all_accounts(async_session_factory, upto)
+                    else:
+                        async with async_session_factory() as db_session:
+                            account_ids = await active_accounts(db_session, since=previous_upto, upto=upto)
+                        written = await snapshot_accounts(account_ids, async_session_factory, upto)
+                    previous_upto = upto
+                    logging.info(f"balance snapshots: wrote {written}")
+        except Exception as e:
+            logging.error(f"balance snapshot pass failed: {e}", exc_info=True)
+        await asyncio.sleep(settings.BALANCE_SNAPSHOT_INTERVAL_SECONDS)
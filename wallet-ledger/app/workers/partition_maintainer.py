@@ -0,0 +1,39 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from app.core.config import settings
+from app.db.core import advisory_lock, engine
+from app.services.idempotency_service import idempotency_cutoff, idempotency_partitions
+from app.services.partition_service import PartitionedTable, drop_partitions_before, ensure_partitions
+
+ledger_partitions = PartitionedTable("ledger_entries", "month")
+
+
+async def maintain_partitions(wait: bool = True):
+    """
+    One instance at a time: concurrent CREATE ... PARTITION OF and DETACH ... CONCURRENTLY race.
+    At startup wait for whoever holds the lock (today's partition must exist before serving);
+    the periodic pass just skips when another instance is already on it.
+    """
+    async with advisory_lock("wallet-ledger:partition-maintenance", wait=wait) as acquired:
+        if acquired:
+            await _maintain_partitions()
+
+
+async def _maintain_partitions():
+    await ensure_partitions(idempotency_partitions, engine, ahead=settings.IDEMPOTENCY_PARTITIONS_AHEAD)
+    await drop_partitions_before(idempotency_partitions, engine, cutoff=idempotency_cutoff())
+    await ensure_partitions(ledger_partitions, engine, ahead=settings.LEDGER_PARTITIONS_AHEAD)
+    if settings.LEDGER_DETACH_AFTER_MONTHS is not None:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=31 * settings.LEDGER_DETACH_AFTER_MONTHS)
+        await drop_partitions_before(ledger_partitions, engine, cutoff=cutoff, drop=False)
+
+
+async def partition_maintainer():
+    """Keep partitions created ahead of time and drop the expired ones."""
+    while True:
+        await asyncio.sleep(settings.PARTITION_MAINTENANCE_INTERVAL_SECONDS)
+        try:
+            await maintain_partitions(wait=False)
+        except Exception as e:
+            logging.error(f"partition maintenance failed: {e}", exc_info=True)
@@ -8,7 +8,7 @@ from sqlalchemy.ext.asyncio import async_engine_from_config
 from alembic import context
 
 from app.db.base import Base
-from app.models import WalletAccount, LedgerEntry, IdempotencyKey, Transaction
+from app.models import WalletAccount, LedgerEntry, IdempotencyKey, Transaction, BalanceSnapshot
 from app.core.config import settings
 
 target_metadata = Base.metadata
@@ -0,0 +1,209 @@
+"""wallet plpgsql functions
+
+Revision ID: 166b063cdaea
+Revises: b7d5c367377b
+Create Date: 2026-10-19 22:04:51.730914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '166b063cdaea'
+down_revision: Union[str, Sequence[str], None] = 'b7d5c367377b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Server-side credit, debit and transfer for WALLET_ENGINE=plpgsql (see app/crud/plpgsql_wallet_service.py).
+# Each function does what the ORM path does in one call: idempotency check, ordered locking,
+# balance checks, the transaction, both ledger entries, the balance updates and the saved response.
+# Errors are raised with SQLSTATEs the service maps back to WalletError subclasses:
+#   WL404 wallet not found, WL403 frozen, WL422 insufficient balance, WL409 idempotency conflict.
+# A duplicate key committed concurrently still fails on transactions.idempotency_key (23505),
+# which the service answers by replaying the saved response, as the ORM path does.
+
+FUNCTIONS = [
+    """
+    CREATE OR REPLACE FUNCTION wallet_check_idempotency(p_key text, p_request_hash text, p_cutoff timestamptz)
+    RETURNS jsonb LANGUAGE plpgsql AS $$
+    DECLARE
+        saved idempotency_keys%ROWTYPE;
+    BEGIN
+        SELECT * INTO saved FROM idempotency_keys WHERE key = p_key AND created_at >= p_cutoff;
+        IF NOT FOUND THEN
+            RETURN NULL;
+        END IF;
+        IF saved.request_hash <> p_request_hash THEN
+            RAISE EXCEPTION 'Idempotency key conflict' USING ERRCODE = 'WL409';
+        END IF;
+        RETURN saved.request_json;
+    END
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION wallet_lock_system_bucket(p_bucket integer, p_buckets integer)
+    RETURNS wallet_accounts LANGUAGE plpgsql AS $$
+    DECLARE
+        system_account wallet_accounts%ROWTYPE;
+    BEGIN
+        -- same policy as lock_system_bucket: the preferred bucket or the next free sibling, else wait
+        SELECT * INTO system_account FROM wallet_accounts
+        WHERE account_type = 'SYSTEM' AND bucket < p_buckets
+        ORDER BY (bucket - p_bucket + p_buckets) % p_buckets
+        LIMIT 1 FOR UPDATE SKIP LOCKED;
+        IF NOT FOUND THEN
+            SELECT * INTO system_account FROM wallet_accounts
+            WHERE account_type = 'SYSTEM' AND bucket = p_bucket FOR UPDATE;
+        END IF;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'Wallet Account not found' USING ERRCODE = 'WL404';
+        END IF;
+        RETURN system_account;
+    END
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION wallet_post_transaction(p_type transactiontype, p_source uuid, p_source_balance bigint,
+                                                       p_destination uuid, p_destination_balance bigint, p_amount bigint,
+                                                       p_key text, p_request_hash text)
+    RETURNS jsonb LANGUAGE plpgsql AS $$
+    DECLARE
+        transaction_id uuid := gen_random_uuid();
+        response jsonb;
+    BEGIN
+        -- callers hold the locks on both accounts and pass their balances as read under the lock
+        INSERT INTO transactions (id, source_account_id, destination_account_id, transaction_type, idempotency_key, amount, status, created_at)
+        VALUES (transaction_id, p_source, p_destination, p_type, p_key, p_amount, 'COMPLETED', clock_timestamp());
+        INSERT INTO ledger_entries (id, account_id, transaction_id, amount, running_balance, entry_type, created_at)
+        VALUES (gen_random_uuid(), p_source, transaction_id, p_amount, p_source_balance - p_amount, 'DEBIT', clock_timestamp()),
+               (gen_random_uuid(), p_destination, transaction_id, p_amount, p_destination_balance + p_amount, 'CREDIT', clock_timestamp());
+        UPDATE wallet_accounts
+        SET cached_balance = cached_balance - CASE WHEN id = p_source THEN p_amount ELSE 0 END
+                                            + CASE WHEN id = p_destination THEN p_amount ELSE 0 END,
+            version = version + 1
+        WHERE id IN (p_source, p_destination);
+        response := jsonb_build_object('transaction_id', transaction_id::text, 'amount', p_amount, 'status', 'COMPLETED');
+        INSERT INTO idempotency_keys (key, request_hash, request_json, created_at, updated_at)
+        VALUES (p_key, p_request_hash, response, clock_timestamp(), clock_timestamp());
+        RETURN response;
+    END
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION wallet_credit(p_wallet_id uuid, p_amount bigint, p_key text, p_request_hash text,
+                                             p_cutoff timestamptz, p_bucket integer, p_buckets integer)
+    RETURNS jsonb LANGUAGE plpgsql AS $$
+    DECLARE
+        saved jsonb;
+        wallet wallet_accounts%ROWTYPE;
+        system_account wallet_accounts%ROWTYPE;
+    BEGIN
+        saved := wallet_check_idempotency(p_key, p_request_hash, p_cutoff);
+        IF saved IS NOT NULL THEN
+            RETURN saved;
+        END IF;
+        -- wallet first, then a SYSTEM bucket, as in credit_wallet
+        SELECT * INTO wallet FROM wallet_accounts WHERE id = p_wallet_id FOR UPDATE;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'Wallet Account not found' USING ERRCODE = 'WL404';
+        END IF;
+        IF wallet.status <> 'ACTIVE' THEN
+            RAISE EXCEPTION 'Account is frozen' USING ERRCODE = 'WL403';
+        END IF;
+        system_account := wallet_lock_system_bucket(p_bucket, p_buckets);
+        RETURN wallet_post_transaction('CREDIT', system_account.id, system_account.cached_balance,
+                                       wallet.id, wallet.cached_balance, p_amount, p_key, p_request_hash);
+    END
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION wallet_debit(p_wallet_id uuid, p_amount bigint, p_key text, p_request_hash text,
+                                            p_cutoff timestamptz, p_bucket integer, p_buckets integer)
+    RETURNS jsonb LANGUAGE plpgsql AS $$
+    DECLARE
+        saved jsonb;
+        wallet wallet_accounts%ROWTYPE;
+        system_account wallet_accounts%ROWTYPE;
+    BEGIN
+        saved := wallet_check_idempotency(p_key, p_request_hash, p_cutoff);
+        IF saved IS NOT NULL THEN
+            RETURN saved;
+        END IF;
+        SELECT * INTO wallet FROM wallet_accounts WHERE id = p_wallet_id FOR UPDATE;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'Wallet Account not found' USING ERRCODE = 'WL404';
+        END IF;
+        IF wallet.status <> 'ACTIVE' THEN
+            RAISE EXCEPTION 'Account is frozen' USING ERRCODE = 'WL403';
+        END IF;
+        IF wallet.cached_balance < p_amount THEN
+            RAISE EXCEPTION 'Insufficient balance' USING ERRCODE = 'WL422';
+        END IF;
+        system_account := wallet_lock_system_bucket(p_bucket, p_buckets);
+        RETURN wallet_post_transaction('DEBIT', wallet.id, wallet.cached_balance,
+                                       system_account.id, system_account.cached_balance, p_amount, p_key, p_request_hash);
+    END
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION wallet_transfer(p_source uuid, p_destination uuid, p_amount bigint, p_key text,
+                                               p_request_hash text, p_cutoff timestamptz)
+    RETURNS jsonb LANGUAGE plpgsql AS $$
+    DECLARE
+        saved jsonb;
+        source wallet_accounts%ROWTYPE;
+        destination wallet_accounts%ROWTYPE;
+    BEGIN
+        saved := wallet_check_idempotency(p_key, p_request_hash, p_cutoff);
+        IF saved IS NOT NULL THEN
+            RETURN saved;
+        END IF;
+        -- lock both accounts in id order, so opposite transfers can't deadlock
+        PERFORM 1 FROM wallet_accounts WHERE id IN (p_source, p_destination) ORDER BY id FOR UPDATE;
+        SELECT * INTO source FROM wallet_accounts WHERE id = p_source;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'Wallet Account not found' USING ERRCODE = 'WL404';
+        END IF;
+        IF source.status <> 'ACTIVE' THEN
+            RAISE EXCEPTION 'Account is frozen' USING ERRCODE = 'WL403';
+        END IF;
+        IF source.cached_balance < p_amount THEN
+            RAISE EXCEPTION 'Insufficient balance' USING ERRCODE = 'WL422';
+        END IF;
+        SELECT * INTO destination FROM wallet_accounts WHERE id = p_destination;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'Wallet Account not found' USING ERRCODE = 'WL404';
+        END IF;
+        IF destination.status <> 'ACTIVE' THEN
+            RAISE EXCEPTION 'Account is frozen' USING ERRCODE = 'WL403';
+        END IF;
+        RETURN wallet_post_transaction('TRANSFER', source.id, source.cached_balance,
+                                       destination.id, destination.cached_balance, p_amount, p_key, p_request_hash);
+    END
+    $$
+    """,
+]
+
+DROP_FUNCTIONS = [
+    "DROP FUNCTION IF EXISTS wallet_transfer(uuid, uuid, bigint, text, text, timestamptz)",
+    "DROP FUNCTION IF EXISTS wallet_debit(uuid, bigint, text, text, timestamptz, integer, integer)",
+    "DROP FUNCTION IF EXISTS wallet_credit(uuid, bigint, text, text, timestamptz, integer, integer)",
+    "DROP FUNCTION IF EXISTS wallet_post_transaction(transactiontype, uuid, bigint, uuid, bigint, bigint, text, text)",
+    "DROP FUNCTION IF EXISTS wallet_lock_system_bucket(integer, integer)",
+    "DROP FUNCTION IF EXISTS wallet_check_idempotency(text, text, timestamptz)",
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for function in FUNCTIONS:
+        op.execute(function)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for function in DROP_FUNCTIONS:
+        op.execute(function)
@@ -0,0 +1,85 @@
+"""partition idempotency_keys by day
+
+Revision ID: 4c109325d1ba
+Revises: 550afee363bc
+Create Date: 2026-10-19 14:03:52.918340
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from app.core.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c109325d1ba'
+down_revision: Union[str, Sequence[str], None] = '550afee363bc'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("ALTER TABLE idempotency_keys RENAME TO idempotency_keys_legacy")
+    op.execute("ALTER INDEX idempotency_keys_pkey RENAME TO idempotency_keys_legacy_pkey")
+    # the partition key has to be part of the primary key
+    op.execute("""
+        CREATE TABLE idempotency_keys (
+            key VARCHAR NOT NULL,
+            request_hash VARCHAR NOT NULL,
+            request_json JSONB NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            PRIMARY KEY (key, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    # one partition per UTC day, from the start of the retention window to a few days ahead;
+    # the app's partition maintainer takes over from here
+    op.execute(f"""
+        DO $$
+        DECLARE day date;
+        BEGIN
+            FOR day IN SELECT generate_series((now() AT TIME ZONE 'UTC')::date - {settings.IDEMPOTENCY_RETENTION_DAYS},
+                                              (now() AT TIME ZONE 'UTC')::date + {settings.IDEMPOTENCY_PARTITIONS_AHEAD},
+                                              interval '1 day')::date
+            LOOP
+                EXECUTE format('CREATE TABLE %I PARTITION OF idempotency_keys FOR VALUES FROM (%L) TO (%L)',
+                               'idempotency_keys_p' || to_char(day, 'YYYYMMDD'),
+                               day::timestamp AT TIME ZONE 'UTC',
+                               (day + 1)::timestamp AT TIME ZONE 'UTC');
+            END LOOP;
+        END $$
+    """)
+    # keys that have already expired are not carried over
+    op.execute(f"""
+        INSERT INTO idempotency_keys (key, request_hash, request_json, created_at, updated_at)
+        SELECT key, request_hash, request_json, created_at, updated_at
+        FROM idempotency_keys_legacy
+        WHERE created_at >= ((now() AT TIME ZONE 'UTC')::date - {settings.IDEMPOTENCY_RETENTION_DAYS})::timestamp AT TIME ZONE 'UTC'
+    """)
+    op.execute("DROP TABLE idempotency_keys_legacy")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER TABLE idempotency_keys RENAME TO idempotency_keys_partitioned")
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('request_hash', sa.String(), nullable=False),
+        sa.Column('request_json', postgresql.JSONB(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('key'),
+    )
+    op.execute("""
+        INSERT INTO idempotency_keys (key, request_hash, request_json, created_at, updated_at)
+        SELECT key, request_hash, request_json, created_at, updated_at
+        FROM idempotency_keys_partitioned
+        ON CONFLICT (key) DO NOTHING
+    """)
+    # dropping the parent drops every partition with it
+    op.execute("DROP TABLE idempotency_keys_partitioned")
@@ -0,0 +1,35 @@
+"""system account buckets
+
+Revision ID: 550afee363bc
+Revises: bb58e249a95a
+Create Date: 2026-10-19 10:12:31.402117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '550afee363bc'
+down_revision: Union[str, Sequence[str], None] = 'bb58e249a95a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # the existing SYSTEM account becomes bucket 0; the rest are created at startup
+    op.add_column('wallet_accounts', sa.Column('bucket', sa.Integer(), server_default='0', nullable=False))
+    op.create_index('uq_wallet_accounts_system_bucket', 'wallet_accounts', ['bucket'], unique=True,
+                    postgresql_where=sa.text("account_type = 'SYSTEM'"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # bucket rows other than 0 stay behind as plain SYSTEM accounts: they carry ledger
+    # history, and SUM(cached_balance) over all accounts is still zero with them in place.
+    # Code from before this revision expects a single SYSTEM row, so merge them by hand first.
+    op.drop_index('uq_wallet_accounts_system_bucket', table_name='wallet_accounts')
+    op.drop_column('wallet_accounts', 'bucket')
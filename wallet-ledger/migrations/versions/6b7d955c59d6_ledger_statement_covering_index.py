@@ -0,0 +1,51 @@
+"""covering index for account statements
+
+Revision ID: 6b7d955c59d6
+Revises: c62a422b7c86
+Create Date: 2026-10-19 18:22:40.513870
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6b7d955c59d6'
+down_revision: Union[str, Sequence[str], None] = 'c62a422b7c86'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+STATEMENT_INDEX_COLUMNS = "(account_id, created_at, id) INCLUDE (transaction_id, entry_type, amount, running_balance)"
+
+
+def ledger_partitions() -> list[str]:
+    result = op.get_bind().execute(sa.text("""
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'ledger_entries'
+    """))
+    return [row[0] for row in result]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CREATE INDEX on a partitioned table can't be CONCURRENTLY, so: create the parent index
+    # ON ONLY the parent (invalid, no build), build each partition's index concurrently and
+    # attach it. The parent index turns valid once every partition has one.
+    op.execute(f"CREATE INDEX IF NOT EXISTS ix_ledger_entries_account_statement ON ONLY ledger_entries {STATEMENT_INDEX_COLUMNS}")
+    partitions = ledger_partitions()
+    with op.get_context().autocommit_block():
+        for partition in partitions:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_account_statement ON {partition} {STATEMENT_INDEX_COLUMNS}")
+            op.execute(f"ALTER INDEX ix_ledger_entries_account_statement ATTACH PARTITION {partition}_account_statement")
+    # superseded: the new index has the same leading columns
+    op.execute("DROP INDEX IF EXISTS ix_ledger_entries_account_id_created_at")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("CREATE INDEX IF NOT EXISTS ix_ledger_entries_account_id_created_at ON ledger_entries (account_id, created_at)")
+    op.execute("DROP INDEX IF EXISTS ix_ledger_entries_account_statement")
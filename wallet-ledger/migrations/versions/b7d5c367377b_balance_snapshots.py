@@ -0,0 +1,43 @@
+"""balance snapshots
+
+Revision ID: b7d5c367377b
+Revises: 6b7d955c59d6
+Create Date: 2026-10-19 20:57:13.184529
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d5c367377b'
+down_revision: Union[str, Sequence[str], None] = '6b7d955c59d6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'balance_snapshots',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('account_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('balance', sa.BigInteger(), nullable=False),
+        sa.Column('entry_count', sa.BigInteger(), nullable=False),
+        sa.Column('last_entry_created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('last_entry_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(['account_id'], ['wallet_accounts.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_balance_snapshots_account_position', 'balance_snapshots',
+                    ['account_id', 'last_entry_created_at', 'last_entry_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_balance_snapshots_account_position', table_name='balance_snapshots')
+    op.drop_table('balance_snapshots')
@@ -0,0 +1,85 @@
+"""partition ledger_entries by month
+
+Revision ID: c62a422b7c86
+Revises: 4c109325d1ba
+Create Date: 2026-10-19 16:41:07.266903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c62a422b7c86'
+down_revision: Union[str, Sequence[str], None] = '4c109325d1ba'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Rows are not copied. The existing heap is attached as one partition covering everything
+# before the start of next month, and new monthly partitions start there. The slow steps
+# (index builds, constraint validation) run beforehand without blocking writers; the swap
+# itself only takes brief locks.
+BOUNDARY = "date_trunc('month', now() AT TIME ZONE 'UTC') + interval '1 month'"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    boundary = op.get_bind().execute(sa.text(f"SELECT ({BOUNDARY})::timestamp AT TIME ZONE 'UTC'")).scalar_one()
+    with op.get_context().autocommit_block():
+        # the partition needs indexes matching the parent's, built here so ATTACH can reuse them
+        op.execute("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ledger_entries_legacy_id_created_at "
+                   "ON ledger_entries (id, created_at)")
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ledger_entries_legacy_account_id_created_at "
+                   "ON ledger_entries (account_id, created_at)")
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ledger_entries_legacy_created_at_brin "
+                   "ON ledger_entries USING brin (created_at) WITH (autosummarize = on)")
+        # a validated CHECK lets ATTACH skip scanning the whole table for out-of-range rows
+        op.execute(f"ALTER TABLE ledger_entries ADD CONSTRAINT ledger_entries_legacy_range "
+                   f"CHECK (created_at < '{boundary.isoformat()}') NOT VALID")
+        op.execute("ALTER TABLE ledger_entries VALIDATE CONSTRAINT ledger_entries_legacy_range")
+
+    op.execute("ALTER TABLE ledger_entries RENAME TO ledger_entries_legacy")
+    op.execute("""
+        CREATE TABLE ledger_entries (
+            id UUID NOT NULL,
+            account_id UUID NOT NULL REFERENCES wallet_accounts (id),
+            amount BIGINT NOT NULL,
+            transaction_id UUID NOT NULL REFERENCES transactions (id),
+            running_balance BIGINT NOT NULL,
+            entry_type entrytype NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("CREATE INDEX ix_ledger_entries_account_id_created_at ON ledger_entries (account_id, created_at)")
+    op.execute("CREATE INDEX ix_ledger_entries_created_at_brin ON ledger_entries USING brin (created_at) WITH (autosummarize = on)")
+    op.execute(f"ALTER TABLE ledger_entries ATTACH PARTITION ledger_entries_legacy "
+               f"FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat()}')")
+    # the legacy partition's own PK on (id) stays; it is a stricter constraint than the parent's
+    for month in range(settings.LEDGER_PARTITIONS_AHEAD + 1):
+        op.execute(f"""
+            DO $$
+            DECLARE lower timestamptz := '{boundary.isoformat()}'::timestamptz + interval '{month} month';
+            BEGIN
+                EXECUTE format('CREATE TABLE %I PARTITION OF ledger_entries FOR VALUES FROM (%L) TO (%L)',
+                               'ledger_entries_p' || to_char(lower AT TIME ZONE 'UTC', 'YYYYMM'),
+                               lower, lower + interval '1 month');
+            END $$
+        """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # folds every monthly partition back into the legacy heap; this copies rows, so it is slow on big ledgers
+    op.execute("ALTER TABLE ledger_entries DETACH PARTITION ledger_entries_legacy")
+    op.execute("ALTER TABLE ledger_entries_legacy DROP CONSTRAINT ledger_entries_legacy_range")
+    op.execute("INSERT INTO ledger_entries_legacy SELECT * FROM ledger_entries")
+    op.execute("DROP TABLE ledger_entries")
+    op.execute("ALTER TABLE ledger_entries_legacy RENAME TO ledger_entries")
+    op.execute("DROP INDEX IF EXISTS ledger_entries_legacy_id_created_at")
+    op.execute("DROP INDEX IF EXISTS ledger_entries_legacy_account_id_created_at")
+    op.execute("DROP INDEX IF EXISTS ledger_entries_legacy_created_at_brin")